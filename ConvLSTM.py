@@ -55,8 +55,25 @@ def ConvLSTM_network(input_shape, return_seq=False):
     
 
 if __name__ == '__main__':
-    # modelの作成
-    model = ConvLSTM_network((10, 128, 128, 3), return_seq=True)
-    model.compile(optimizer='rmsprop', loss='mae', metrics=['accuracy'])
-    model.summary()
+    import sys
+
+    if len(sys.argv) > 2 and sys.argv[1] == 'train':
+        # 実際の画像の並びで、次の画像を予測するように学習する
+        #   python ConvLSTM.py train <A_model_*.csv のフォルダ> [T] [stride]
+        # 画像は frame_store.py で作った日付ごとの配列から読む
+        from sequence_dataset import SEQUENCE_LENGTH, SequenceDataset, list_label_csvs
+        T = int(sys.argv[3]) if len(sys.argv) > 3 else SEQUENCE_LENGTH
+        stride = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+        data = SequenceDataset(list_label_csvs(sys.argv[2]), length=T, stride=stride,
+                               target='next_frame')
+        print(f"並び: {len(data)} 本（{len(data.days)}日分, T={T}, stride={stride}）")
+        model = ConvLSTM_network(data.frame_shape, return_seq=False)
+        model.compile(optimizer='rmsprop', loss='mae')
+        model.fit(data.as_tf_dataset(batch_size=4, shuffle=True), epochs=10)
+        model.save('convlstm_next_frame.h5')
+    else:
+        # modelの作成
+        model = ConvLSTM_network((10, 128, 128, 3), return_seq=True)
+        model.compile(optimizer='rmsprop', loss='mae', metrics=['accuracy'])
+        model.summary()
 
@@ -1,81 +1,39 @@
 import numpy as np
 
-from keras import backend as K
-from keras import activations
-from keras.layers import Recurrent
-from keras.layers import Conv2D, UpSampling2D, MaxPooling2D
-from keras.engine import InputSpec
-from keras_utils import legacy_prednet_support
-
-class PredNet(Recurrent):
-    '''PredNet architecture - Lotter 2016.
-        Stacked convolutional LSTM inspired by predictive coding principles.
+import tensorflow as tf
+from tensorflow.keras import activations, backend, layers, ops
+from tensorflow.keras.layers import Conv2D, UpSampling2D, MaxPooling2D
+from tensorflow.keras.utils import register_keras_serializable
 
-    # Arguments
-        stack_sizes: number of channels in targets (A) and predictions (Ahat) in each layer of the architecture.
-            Length is the number of layers in the architecture.
-            First element is the number of channels in the input.
-            Ex. (3, 16, 32) would correspond to a 3 layer architecture that takes in RGB images and has 16 and 32
-                channels in the second and third layers, respectively.
-        R_stack_sizes: number of channels in the representation (R) modules.
-            Length must equal length of stack_sizes, but the number of channels per layer can be different.
-        A_filt_sizes: filter sizes for the target (A) modules.
-            Has length of 1 - len(stack_sizes).
-            Ex. (3, 3) would mean that targets for layers 2 and 3 are computed by a 3x3 convolution of the errors (E)
-                from the layer below (followed by max-pooling)
-        Ahat_filt_sizes: filter sizes for the prediction (Ahat) modules.
-            Has length equal to length of stack_sizes.
-            Ex. (3, 3, 3) would mean that the predictions for each layer are computed by a 3x3 convolution of the
-                representation (R) modules at each layer.
-        R_filt_sizes: filter sizes for the representation (R) modules.
-            Has length equal to length of stack_sizes.
-            Corresponds to the filter sizes for all convolutions in the LSTM.
-        pixel_max: the maximum pixel value.
-            Used to clip the pixel-layer prediction.
-        error_activation: activation function for the error (E) units.
-        A_activation: activation function for the target (A) and prediction (A_hat) units.
-        LSTM_activation: activation function for the cell and hidden states of the LSTM.
-        LSTM_inner_activation: activation function for the gates in the LSTM.
-        output_mode: either 'error', 'prediction', 'all' or layer specification (ex. R2, see below).
-            Controls what is outputted by the PredNet.
-            If 'error', the mean response of the error (E) units of each layer will be outputted.
-                That is, the output shape will be (batch_size, nb_layers).
-            If 'prediction', the frame prediction will be outputted.
-            If 'all', the output will be the frame prediction concatenated with the mean layer errors.
-                The frame prediction is flattened before concatenation.
-                Nomenclature of 'all' is kept for backwards compatibility, but should not be confused with returning all of the layers of the model
-            For returning the features of a particular layer, output_mode should be of the form unit_type + layer_number.
-                For instance, to return the features of the LSTM "representational" units in the lowest layer, output_mode should be specificied as 'R0'.
-                The possible unit types are 'R', 'Ahat', 'A', and 'E' corresponding to the 'representation', 'prediction', 'target', and 'error' units respectively.
-        extrap_start_time: time step for which model will start extrapolating.
-            Starting at this time step, the prediction from the previous time step will be treated as the "actual"
-        data_format: 'channels_first' or 'channels_last'.
-            It defaults to the `image_data_format` value found in your
-            Keras config file at `~/.keras/keras.json`.
 
-    # References
-        - [Deep predictive coding networks for video prediction and unsupervised learning](https://arxiv.org/abs/1605.08104)
-        - [Long short-term memory](http://deeplearning.cs.cmu.edu/pdfs/Hochreiter97_lstm.pdf)
-        - [Convolutional LSTM network: a machine learning approach for precipitation nowcasting](http://arxiv.org/abs/1506.04214)
-        - [Predictive coding in the visual cortex: a functional interpretation of some extra-classical receptive-field effects](http://www.nature.com/neuro/journal/v2/n1/pdf/nn0199_79.pdf)
+@register_keras_serializable(package="prednet")
+class PredNetCell(layers.Layer):
+    '''PredNet の1ステップ分（tf.keras.layers.RNN に入れて使う）。
+
+    引数は PredNet と同じ。LSTM の i/f/c/o の4つのゲートは、層ごとに1つの畳み込み
+    （出力 4 * R_stack_sizes[l] チャンネル）でまとめて計算し、チャンネル方向に分ける。
+
+    状態は r（各層）, c（各層）, e（各層）の順。extrap_start_time を指定したときは
+    さらに前のステップの画像の予測 ahat と、いまのステップ数 t を持つ。
     '''
-    @legacy_prednet_support
+
     def __init__(self, stack_sizes, R_stack_sizes,
                  A_filt_sizes, Ahat_filt_sizes, R_filt_sizes,
                  pixel_max=1., error_activation='relu', A_activation='relu',
                  LSTM_activation='tanh', LSTM_inner_activation='hard_sigmoid',
                  output_mode='error', extrap_start_time=None,
-                 data_format=K.image_data_format(), **kwargs):
-        self.stack_sizes = stack_sizes
+                 data_format=None, **kwargs):
+        super().__init__(**kwargs)
+        self.stack_sizes = tuple(stack_sizes)
         self.nb_layers = len(stack_sizes)
         assert len(R_stack_sizes) == self.nb_layers, 'len(R_stack_sizes) must equal len(stack_sizes)'
-        self.R_stack_sizes = R_stack_sizes
+        self.R_stack_sizes = tuple(R_stack_sizes)
         assert len(A_filt_sizes) == (self.nb_layers - 1), 'len(A_filt_sizes) must equal len(stack_sizes) - 1'
-        self.A_filt_sizes = A_filt_sizes
+        self.A_filt_sizes = tuple(A_filt_sizes)
         assert len(Ahat_filt_sizes) == self.nb_layers, 'len(Ahat_filt_sizes) must equal len(stack_sizes)'
-        self.Ahat_filt_sizes = Ahat_filt_sizes
+        self.Ahat_filt_sizes = tuple(Ahat_filt_sizes)
         assert len(R_filt_sizes) == (self.nb_layers), 'len(R_filt_sizes) must equal len(stack_sizes)'
-        self.R_filt_sizes = R_filt_sizes
+        self.R_filt_sizes = tuple(R_filt_sizes)
 
         self.pixel_max = pixel_max
         self.error_activation = activations.get(error_activation)
@@ -95,137 +53,95 @@ class PredNet(Recurrent):
             self.output_layer_num = None
         self.extrap_start_time = extrap_start_time
 
+        data_format = data_format or backend.image_data_format()
         assert data_format in {'channels_last', 'channels_first'}, 'data_format must be in {channels_last, channels_first}'
         self.data_format = data_format
         self.channel_axis = -3 if data_format == 'channels_first' else -1
         self.row_axis = -2 if data_format == 'channels_first' else -3
         self.column_axis = -1 if data_format == 'channels_first' else -2
-        super(PredNet, self).__init__(**kwargs)
-        self.input_spec = [InputSpec(ndim=5)]
-
-    def compute_output_shape(self, input_shape):
-        if self.output_mode == 'prediction':
-            out_shape = input_shape[2:]
-        elif self.output_mode == 'error':
-            out_shape = (self.nb_layers,)
-        elif self.output_mode == 'all':
-            out_shape = (np.prod(input_shape[2:]) + self.nb_layers,)
-        else:
-            stack_str = 'R_stack_sizes' if self.output_layer_type == 'R' else 'stack_sizes'
-            stack_mult = 2 if self.output_layer_type == 'E' else 1
-            out_stack_size = stack_mult * getattr(self, stack_str)[self.output_layer_num]
-            out_nb_row = input_shape[self.row_axis] / 2**self.output_layer_num
-            out_nb_col = input_shape[self.column_axis] / 2**self.output_layer_num
-            if self.data_format == 'channels_first':
-                out_shape = (out_stack_size, out_nb_row, out_nb_col)
-            else:
-                out_shape = (out_nb_row, out_nb_col, out_stack_size)
 
-        if self.return_sequences:
-            return (input_shape[0], input_shape[1]) + out_shape
-        else:
-            return (input_shape[0],) + out_shape
-
-    def get_initial_state(self, x):
-        input_shape = self.input_spec[0].shape
-        init_nb_row = input_shape[self.row_axis]
-        init_nb_col = input_shape[self.column_axis]
-
-        base_initial_state = K.zeros_like(x)  # (samples, timesteps) + image_shape
-        non_channel_axis = -1 if self.data_format == 'channels_first' else -2
-        for _ in range(2):
-            base_initial_state = K.sum(base_initial_state, axis=non_channel_axis)
-        base_initial_state = K.sum(base_initial_state, axis=1)  # (samples, nb_channels)
-
-        initial_states = []
-        states_to_pass = ['r', 'c', 'e']
-        nlayers_to_pass = {u: self.nb_layers for u in states_to_pass}
+        # 状態の形は入力の画像の大きさで決まるので、build までは数だけ決めておく
+        nb_states = 3 * self.nb_layers + (2 if self.extrap_start_time is not None else 0)
+        self.state_size = [-1] * nb_states
+        self.input_rows = None
+        self.input_cols = None
+
+    def _image_shape(self, stack_size, l):
+        nb_row = self.input_rows // 2 ** l
+        nb_col = self.input_cols // 2 ** l
+        if self.data_format == 'channels_first':
+            return (stack_size, nb_row, nb_col)
+        return (nb_row, nb_col, stack_size)
+
+    def state_shapes(self):
+        '''各状態の（バッチを除いた）形。r, c, e の順に各層、extrap のときは ahat, t が続く'''
+        shapes = [self._image_shape(self.R_stack_sizes[l], l) for l in range(self.nb_layers)]
+        shapes += [self._image_shape(self.R_stack_sizes[l], l) for l in range(self.nb_layers)]
+        shapes += [self._image_shape(2 * self.stack_sizes[l], l) for l in range(self.nb_layers)]
         if self.extrap_start_time is not None:
-           states_to_pass.append('ahat')  # pass prediction in states so can use as actual for t+1 when extrapolating
-           nlayers_to_pass['ahat'] = 1
-        for u in states_to_pass:
-            for l in range(nlayers_to_pass[u]):
-                ds_factor = 2 ** l
-                nb_row = init_nb_row // ds_factor
-                nb_col = init_nb_col // ds_factor
-                if u in ['r', 'c']:
-                    stack_size = self.R_stack_sizes[l]
-                elif u == 'e':
-                    stack_size = 2 * self.stack_sizes[l]
-                elif u == 'ahat':
-                    stack_size = self.stack_sizes[l]
-                output_size = stack_size * nb_row * nb_col  # flattened size
-
-                reducer = K.zeros((input_shape[self.channel_axis], output_size)) # (nb_channels, output_size)
-                initial_state = K.dot(base_initial_state, reducer) # (samples, output_size)
-                if self.data_format == 'channels_first':
-                    output_shp = (-1, stack_size, nb_row, nb_col)
-                else:
-                    output_shp = (-1, nb_row, nb_col, stack_size)
-                initial_state = K.reshape(initial_state, output_shp)
-                initial_states += [initial_state]
-
-        if K._BACKEND == 'theano':
-            from theano import tensor as T
-            # There is a known issue in the Theano scan op when dealing with inputs whose shape is 1 along a dimension.
-            # In our case, this is a problem when training on grayscale images, and the below line fixes it.
-            initial_states = [T.unbroadcast(init_state, 0, 1) for init_state in initial_states]
+            shapes += [self._image_shape(self.stack_sizes[0], 0), (1,)]
+        return shapes
 
-        if self.extrap_start_time is not None:
-            initial_states += [K.variable(0, int if K.backend() != 'tensorflow' else 'int32')]  # the last state will correspond to the current timestep
-        return initial_states
+    def step_output_shape(self, frame_shape):
+        '''1ステップの出力の（バッチを除いた）形。frame_shape は入力画像1枚の形'''
+        if self.output_mode == 'prediction':
+            return tuple(frame_shape)
+        if self.output_mode == 'error':
+            return (self.nb_layers,)
+        if self.output_mode == 'all':
+            return (int(np.prod(frame_shape)) + self.nb_layers,)
+        stack_str = 'R_stack_sizes' if self.output_layer_type == 'R' else 'stack_sizes'
+        stack_mult = 2 if self.output_layer_type == 'E' else 1
+        out_stack_size = stack_mult * getattr(self, stack_str)[self.output_layer_num]
+        return self._image_shape(out_stack_size, self.output_layer_num)
 
     def build(self, input_shape):
-        self.input_spec = [InputSpec(shape=input_shape)]
-        self.conv_layers = {c: [] for c in ['i', 'f', 'c', 'o', 'a', 'ahat']}
+        self.input_rows = input_shape[self.row_axis]
+        self.input_cols = input_shape[self.column_axis]
+        self.conv_lstm = []  # i/f/c/o をまとめた畳み込み
+        self.conv_ahat = []
+        self.conv_a = []
 
         for l in range(self.nb_layers):
-            for c in ['i', 'f', 'c', 'o']:
-                act = self.LSTM_activation if c == 'c' else self.LSTM_inner_activation
-                self.conv_layers[c].append(Conv2D(self.R_stack_sizes[l], self.R_filt_sizes[l], padding='same', activation=act, data_format=self.data_format))
+            nb_channels = self.stack_sizes[l] * 2 + self.R_stack_sizes[l]
+            if l < self.nb_layers - 1:
+                nb_channels += self.R_stack_sizes[l + 1]
+            conv = Conv2D(4 * self.R_stack_sizes[l], self.R_filt_sizes[l], padding='same',
+                          data_format=self.data_format, name=f'layer_ifco_{l}')
+            conv.build((None,) + self._image_shape(nb_channels, l))
+            self.conv_lstm.append(conv)
 
             act = 'relu' if l == 0 else self.A_activation
-            self.conv_layers['ahat'].append(Conv2D(self.stack_sizes[l], self.Ahat_filt_sizes[l], padding='same', activation=act, data_format=self.data_format))
+            conv = Conv2D(self.stack_sizes[l], self.Ahat_filt_sizes[l], padding='same', activation=act,
+                          data_format=self.data_format, name=f'layer_ahat_{l}')
+            conv.build((None,) + self._image_shape(self.R_stack_sizes[l], l))
+            self.conv_ahat.append(conv)
 
             if l < self.nb_layers - 1:
-                self.conv_layers['a'].append(Conv2D(self.stack_sizes[l+1], self.A_filt_sizes[l], padding='same', activation=self.A_activation, data_format=self.data_format))
+                conv = Conv2D(self.stack_sizes[l + 1], self.A_filt_sizes[l], padding='same',
+                              activation=self.A_activation, data_format=self.data_format,
+                              name=f'layer_a_{l}')
+                conv.build((None,) + self._image_shape(2 * self.stack_sizes[l], l))
+                self.conv_a.append(conv)
 
         self.upsample = UpSampling2D(data_format=self.data_format)
         self.pool = MaxPooling2D(data_format=self.data_format)
+        self.state_size = [int(np.prod(s)) for s in self.state_shapes()]
+        self.built = True
 
-        self.trainable_weights = []
-        nb_row, nb_col = (input_shape[-2], input_shape[-1]) if self.data_format == 'channels_first' else (input_shape[-3], input_shape[-2])
-        for c in sorted(self.conv_layers.keys()):
-            for l in range(len(self.conv_layers[c])):
-                ds_factor = 2 ** l
-                if c == 'ahat':
-                    nb_channels = self.R_stack_sizes[l]
-                elif c == 'a':
-                    nb_channels = 2 * self.stack_sizes[l]
-                else:
-                    nb_channels = self.stack_sizes[l] * 2 + self.R_stack_sizes[l]
-                    if l < self.nb_layers - 1:
-                        nb_channels += self.R_stack_sizes[l+1]
-                in_shape = (input_shape[0], nb_channels, nb_row // ds_factor, nb_col // ds_factor)
-                if self.data_format == 'channels_last': in_shape = (in_shape[0], in_shape[2], in_shape[3], in_shape[1])
-                with K.name_scope('layer_' + c + '_' + str(l)):
-                    self.conv_layers[c][l].build(in_shape)
-                self.trainable_weights += self.conv_layers[c][l].trainable_weights
-
-        self.states = [None] * self.nb_layers*3
-
-        if self.extrap_start_time is not None:
-            self.t_extrap = K.variable(self.extrap_start_time, int if K.backend() != 'tensorflow' else 'int32')
-            self.states += [None] * 2  # [previous frame prediction, timestep]
+    def get_initial_state(self, batch_size=None):
+        return [ops.zeros((batch_size,) + shape, dtype=self.compute_dtype) for shape in self.state_shapes()]
 
-    def step(self, a, states):
+    def call(self, a, states):
         r_tm1 = states[:self.nb_layers]
         c_tm1 = states[self.nb_layers:2*self.nb_layers]
         e_tm1 = states[2*self.nb_layers:3*self.nb_layers]
 
         if self.extrap_start_time is not None:
             t = states[-1]
-            a = K.switch(t >= self.t_extrap, states[-2], a)  # if past self.extrap_start_time, the previous prediction will be treated as the actual
+            # extrap_start_time 以降は、前のステップの予測を実際の画像として扱う
+            extrapolate = ops.reshape(t >= self.extrap_start_time, (-1, 1, 1, 1))
+            a = ops.where(extrapolate, states[-2], a)
 
         c = []
         r = []
@@ -237,30 +153,32 @@ class PredNet(Recurrent):
             if l < self.nb_layers - 1:
                 inputs.append(r_up)
 
-            inputs = K.concatenate(inputs, axis=self.channel_axis)
-            i = self.conv_layers['i'][l].call(inputs)
-            f = self.conv_layers['f'][l].call(inputs)
-            o = self.conv_layers['o'][l].call(inputs)
-            _c = f * c_tm1[l] + i * self.conv_layers['c'][l].call(inputs)
+            inputs = ops.concatenate(inputs, axis=self.channel_axis)
+            # 4つのゲートを1回の畳み込みで計算して分ける
+            i, f, c_in, o = ops.split(self.conv_lstm[l](inputs), 4, axis=self.channel_axis)
+            i = self.LSTM_inner_activation(i)
+            f = self.LSTM_inner_activation(f)
+            o = self.LSTM_inner_activation(o)
+            _c = f * c_tm1[l] + i * self.LSTM_activation(c_in)
             _r = o * self.LSTM_activation(_c)
             c.insert(0, _c)
             r.insert(0, _r)
 
             if l > 0:
-                r_up = self.upsample.call(_r)
+                r_up = self.upsample(_r)
 
         # Update feedforward path starting from the bottom
         for l in range(self.nb_layers):
-            ahat = self.conv_layers['ahat'][l].call(r[l])
+            ahat = self.conv_ahat[l](r[l])
             if l == 0:
-                ahat = K.minimum(ahat, self.pixel_max)
+                ahat = ops.minimum(ahat, self.pixel_max)
                 frame_prediction = ahat
 
             # compute errors
             e_up = self.error_activation(ahat - a)
             e_down = self.error_activation(a - ahat)
 
-            e.append(K.concatenate((e_up, e_down), axis=self.channel_axis))
+            e.append(ops.concatenate((e_up, e_down), axis=self.channel_axis))
 
             if self.output_layer_num == l:
                 if self.output_layer_type == 'A':
@@ -273,20 +191,20 @@ class PredNet(Recurrent):
                     output = e[l]
 
             if l < self.nb_layers - 1:
-                a = self.conv_layers['a'][l].call(e[l])
-                a = self.pool.call(a)  # target for next layer
+                a = self.conv_a[l](e[l])
+                a = self.pool(a)  # target for next layer
 
         if self.output_layer_type is None:
             if self.output_mode == 'prediction':
                 output = frame_prediction
             else:
-                for l in range(self.nb_layers):
-                    layer_error = K.mean(K.batch_flatten(e[l]), axis=-1, keepdims=True)
-                    all_error = layer_error if l == 0 else K.concatenate((all_error, layer_error), axis=-1)
+                all_error = ops.stack([ops.mean(e[l], axis=(1, 2, 3)) for l in range(self.nb_layers)], axis=-1)
                 if self.output_mode == 'error':
                     output = all_error
                 else:
-                    output = K.concatenate((K.batch_flatten(frame_prediction), all_error), axis=-1)
+                    frame_size = int(np.prod(self._image_shape(self.stack_sizes[0], 0)))
+                    flat = ops.reshape(frame_prediction, (-1, frame_size))
+                    output = ops.concatenate((flat, all_error), axis=-1)
 
         states = r + c + e
         if self.extrap_start_time is not None:
@@ -300,12 +218,217 @@ class PredNet(Recurrent):
                   'Ahat_filt_sizes': self.Ahat_filt_sizes,
                   'R_filt_sizes': self.R_filt_sizes,
                   'pixel_max': self.pixel_max,
-                  'error_activation': self.error_activation.__name__,
-                  'A_activation': self.A_activation.__name__,
-                  'LSTM_activation': self.LSTM_activation.__name__,
-                  'LSTM_inner_activation': self.LSTM_inner_activation.__name__,
+                  'error_activation': activations.serialize(self.error_activation),
+                  'A_activation': activations.serialize(self.A_activation),
+                  'LSTM_activation': activations.serialize(self.LSTM_activation),
+                  'LSTM_inner_activation': activations.serialize(self.LSTM_inner_activation),
                   'data_format': self.data_format,
                   'extrap_start_time': self.extrap_start_time,
                   'output_mode': self.output_mode}
-        base_config = super(PredNet, self).get_config()
+        base_config = super().get_config()
         return dict(list(base_config.items()) + list(config.items()))
+
+
+@register_keras_serializable(package="prednet")
+class PredNet(layers.RNN):
+    '''PredNet architecture - Lotter 2016.
+        Stacked convolutional LSTM inspired by predictive coding principles.
+
+    PredNetCell を tf.keras.layers.RNN で時間方向に回す。入力は (batch, time) + 画像の形。
+    return_sequences / return_state / stateful などは RNN と同じ引数で指定する。
+    XLA でコンパイルするときは model.compile(..., jit_compile=True) とする（bench() を参照）。
+
+    # Arguments
+        stack_sizes: number of channels in targets (A) and predictions (Ahat) in each layer of the architecture.
+            Length is the number of layers in the architecture.
+            First element is the number of channels in the input.
+            Ex. (3, 16, 32) would correspond to a 3 layer architecture that takes in RGB images and has 16 and 32
+                channels in the second and third layers, respectively.
+        R_stack_sizes: number of channels in the representation (R) modules.
+            Length must equal length of stack_sizes, but the number of channels per layer can be different.
+        A_filt_sizes: filter sizes for the target (A) modules.
+            Has length of 1 - len(stack_sizes).
+            Ex. (3, 3) would mean that targets for layers 2 and 3 are computed by a 3x3 convolution of the errors (E)
+                from the layer below (followed by max-pooling)
+        Ahat_filt_sizes: filter sizes for the prediction (Ahat) modules.
+            Has length equal to length of stack_sizes.
+            Ex. (3, 3, 3) would mean that the predictions for each layer are computed by a 3x3 convolution of the
+                representation (R) modules at each layer.
+        R_filt_sizes: filter sizes for the representation (R) modules.
+            Has length equal to length of stack_sizes.
+            Corresponds to the filter sizes for all convolutions in the LSTM.
+        pixel_max: the maximum pixel value.
+            Used to clip the pixel-layer prediction.
+        error_activation: activation function for the error (E) units.
+        A_activation: activation function for the target (A) and prediction (A_hat) units.
+        LSTM_activation: activation function for the cell and hidden states of the LSTM.
+        LSTM_inner_activation: activation function for the gates in the LSTM.
+        output_mode: either 'error', 'prediction', 'all' or layer specification (ex. R2, see below).
+            Controls what is outputted by the PredNet.
+            If 'error', the mean response of the error (E) units of each layer will be outputted.
+                That is, the output shape will be (batch_size, nb_layers).
+            If 'prediction', the frame prediction will be outputted.
+            If 'all', the output will be the frame prediction concatenated with the mean layer errors.
+                The frame prediction is flattened before concatenation.
+                Nomenclature of 'all' is kept for backwards compatibility, but should not be confused with returning all of the layers of the model
+            For returning the features of a particular layer, output_mode should be of the form unit_type + layer_number.
+                For instance, to return the features of the LSTM "representational" units in the lowest layer, output_mode should be specificied as 'R0'.
+                The possible unit types are 'R', 'Ahat', 'A', and 'E' corresponding to the 'representation', 'prediction', 'target', and 'error' units respectively.
+        extrap_start_time: time step for which model will start extrapolating.
+            Starting at this time step, the prediction from the previous time step will be treated as the "actual"
+        data_format: 'channels_first' or 'channels_last'.
+            It defaults to the `image_data_format` value found in your
+            Keras config file at `~/.keras/keras.json`.
+
+    # References
+        - [Deep predictive coding networks for video prediction and unsupervised learning](https://arxiv.org/abs/1605.08104)
+        - [Long short-term memory](http://deeplearning.cs.cmu.edu/pdfs/Hochreiter97_lstm.pdf)
+        - [Convolutional LSTM network: a machine learning approach for precipitation nowcasting](http://arxiv.org/abs/1506.04214)
+        - [Predictive coding in the visual cortex: a functional interpretation of some extra-classical receptive-field effects](http://www.nature.com/neuro/journal/v2/n1/pdf/nn0199_79.pdf)
+    '''
+    CELL_ARGS = ('stack_sizes', 'R_stack_sizes', 'A_filt_sizes', 'Ahat_filt_sizes', 'R_filt_sizes',
+                 'pixel_max', 'error_activation', 'A_activation', 'LSTM_activation',
+                 'LSTM_inner_activation', 'output_mode', 'extrap_start_time', 'data_format')
+
+    def __init__(self, stack_sizes, R_stack_sizes,
+                 A_filt_sizes, Ahat_filt_sizes, R_filt_sizes,
+                 pixel_max=1., error_activation='relu', A_activation='relu',
+                 LSTM_activation='tanh', LSTM_inner_activation='hard_sigmoid',
+                 output_mode='error', extrap_start_time=None,
+                 data_format=None, **kwargs):
+        cell = PredNetCell(stack_sizes, R_stack_sizes, A_filt_sizes, Ahat_filt_sizes, R_filt_sizes,
+                           pixel_max=pixel_max, error_activation=error_activation,
+                           A_activation=A_activation, LSTM_activation=LSTM_activation,
+                           LSTM_inner_activation=LSTM_inner_activation, output_mode=output_mode,
+                           extrap_start_time=extrap_start_time, data_format=data_format,
+                           name='prednet_cell', dtype=kwargs.get('dtype'))
+        super().__init__(cell, **kwargs)
+        self.input_spec = layers.InputSpec(ndim=5)
+
+    def compute_output_shape(self, sequences_shape, initial_state_shape=None):
+        batch_size, steps = sequences_shape[0], sequences_shape[1]
+        frame_shape = tuple(sequences_shape[2:])
+        if not self.cell.built:
+            self.cell.build((batch_size,) + frame_shape)
+        out_shape = self.cell.step_output_shape(frame_shape)
+        if self.return_sequences:
+            output_shape = (batch_size, steps) + out_shape
+        else:
+            output_shape = (batch_size,) + out_shape
+        if self.return_state:
+            return (output_shape,) + tuple((batch_size,) + s for s in self.cell.state_shapes())
+        return output_shape
+
+    def get_config(self):
+        config = super().get_config()
+        config.pop('cell', None)
+        cell_config = self.cell.get_config()
+        config.update({k: cell_config[k] for k in self.CELL_ARGS})
+        return config
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**config)
+
+
+def build_prednet_model(input_shape, stack_sizes=(3, 48, 96, 192), R_stack_sizes=None,
+                        output_mode='error', extrap_start_time=None, return_sequences=True):
+    '''(T, H, W, C) の入力を受け取る PredNet だけのモデル（Lotter の KITTI の設定が既定）'''
+    R_stack_sizes = R_stack_sizes or stack_sizes
+    nb_layers = len(stack_sizes)
+    inputs = layers.Input(shape=input_shape)
+    outputs = PredNet(stack_sizes, R_stack_sizes,
+                      A_filt_sizes=(3,) * (nb_layers - 1), Ahat_filt_sizes=(3,) * nb_layers,
+                      R_filt_sizes=(3,) * nb_layers, output_mode=output_mode,
+                      extrap_start_time=extrap_start_time,
+                      return_sequences=return_sequences)(inputs)
+    return tf.keras.Model(inputs, outputs)
+
+
+def check():
+    '''まとめたゲートの畳み込み・出力の形・extrap_start_time の動きを確かめる'''
+    rng = np.random.default_rng(0)
+    T, H, W = 5, 16, 16
+    x = rng.random((2, T, H, W, 3)).astype(np.float32)
+
+    # 出力の形が compute_output_shape と一致する
+    for mode in ['prediction', 'error', 'all', 'R0', 'E1', 'A1', 'Ahat0']:
+        model = build_prednet_model((T, H, W, 3), stack_sizes=(3, 8), output_mode=mode)
+        y = np.asarray(model(x))
+        expected = model.layers[-1].compute_output_shape((2, T, H, W, 3))
+        assert y.shape == tuple(expected), (mode, y.shape, expected)
+
+    # まとめた畳み込みが、重みを分けた4つの畳み込みと同じ値になる（順番は i, f, c, o）
+    model = build_prednet_model((T, H, W, 3), stack_sizes=(3, 8), output_mode='prediction')
+    cell = model.layers[-1].cell
+    conv = cell.conv_lstm[0]
+    inputs = rng.random((2, H, W, conv.kernel.shape[2])).astype(np.float32)
+    fused = np.split(np.asarray(conv(inputs)), 4, axis=-1)
+    for k, gate in enumerate(np.split(np.asarray(conv.kernel), 4, axis=-1)):
+        bias = np.split(np.asarray(conv.bias), 4)[k]
+        separate = np.asarray(tf.nn.conv2d(inputs, gate, 1, 'SAME')) + bias
+        assert np.allclose(fused[k], separate, atol=1e-5), 'ゲート' + 'ifco'[k]
+
+    # extrap_start_time 以降の予測は、そのあとの入力に左右されない
+    start = 3
+    model = build_prednet_model((T, H, W, 3), stack_sizes=(3, 8), output_mode='prediction',
+                                extrap_start_time=start)
+    x2 = x.copy()
+    x2[:, start:] = rng.random(x2[:, start:].shape)
+    y1, y2 = np.asarray(model(x)), np.asarray(model(x2))
+    assert np.allclose(y1, y2), 'extrap_start_time 以降に入力を見ています'
+    x3 = x.copy()
+    x3[:, start - 1] += 0.5
+    assert not np.allclose(y1[:, start:], np.asarray(model(x3))[:, start:])
+
+    # 保存して読み直しても同じ出力になる
+    import os
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'prednet.keras')
+        model.save(path)
+        again = tf.keras.models.load_model(path)
+        assert np.allclose(y1, np.asarray(again(x)), atol=1e-6)
+    print('✅ PredNet: 出力の形・ゲートの畳み込み・extrap_start_time・保存の確認 OK')
+
+
+def bench(T=10, size=(128, 128), batch=4, repeat=5):
+    '''CPU で1ステップ（1枚）あたりの処理量を測る（XLA あり・なし）'''
+    import time
+
+    x = np.random.default_rng(0).random((batch, T) + size + (3,)).astype(np.float32)
+    model = build_prednet_model((T,) + size + (3,), output_mode='error')
+    print(f'入力 {x.shape}, 層 {model.layers[-1].cell.stack_sizes}')
+    for jit in (False, True):
+        fn = tf.function(lambda v: model(v, training=False), jit_compile=jit)
+        fn(x)  # トレースとコンパイル
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            np.asarray(fn(x))
+        dt = (time.perf_counter() - t0) / repeat
+        print(f"  {'XLA   ' if jit else 'XLA なし'}: {dt * 1000:8.1f} ms / バッチ, "
+              f"{batch * T / dt:7.1f} ステップ/秒（1ステップ {dt / T * 1000:.1f} ms）")
+
+    # いちばん下の層のゲートの畳み込みだけを、4回に分けた場合とまとめた場合で比べる
+    conv = model.layers[-1].cell.conv_lstm[0]
+    inputs = tf.constant(np.random.default_rng(1).random((batch,) + size + (conv.kernel.shape[2],)),
+                         dtype=tf.float32)
+    gates = [tf.constant(k) for k in np.split(np.asarray(conv.kernel), 4, axis=-1)]
+    separate = tf.function(lambda v: [tf.nn.conv2d(v, k, 1, 'SAME') for k in gates])
+    fused = tf.function(lambda v: tf.nn.conv2d(v, conv.kernel, 1, 'SAME'))
+    for name, fn in (('4回に分ける', separate), ('まとめる   ', fused)):
+        fn(inputs)
+        t0 = time.perf_counter()
+        for _ in range(repeat * 4):
+            fn(inputs)
+        dt = (time.perf_counter() - t0) / (repeat * 4)
+        print(f"  ゲートの畳み込み（層0, {name}）: {dt * 1000:6.2f} ms / ステップ")
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        bench()
+    else:
+        check()
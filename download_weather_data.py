@@ -1,69 +1,340 @@
 # download_weather_data.py
+#
+# 気象庁の10分値（枚方）を1日1ファイルの CSV に保存する。
+#   - 1つの Session（接続プール）を複数スレッドで使い、同時接続数は workers までに抑える
+#   - 全スレッド合わせて1秒に rate 回までしか取りに行かない（気象庁のサーバーに優しく）
+#   - 429 / 5xx や通信エラーは指数バックオフでやり直す
+#   - CSV は一時ファイルに書いてから置き換えるので、途中で止まっても壊れたファイルは残らない
+#     （既にある日は飛ばすので、止まったところから再開できる）
+#   - 表は正規表現で data2_s の表だけを取り出して読む（BeautifulSoup の html.parser より速い）
+#   - store（weather_store.WeatherStore）を渡すと、まだ入っていない日を型付きのストアにも足す
+#
+#   python download_weather_data.py [--workers 4] [--rate 2] [--start 20250715] [--end 20250801]
+#                                   [--store weather_store]
+#   python download_weather_data.py --selftest    ローカルの HTTP サーバーで動作確認
 
-import requests
-from bs4 import BeautifulSoup
-import os
+import argparse
 import csv
+import html
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from weather_store import (QUALITY_QUASI, WEATHER_STORE_DIR, WeatherStore, parse_rows,
+                           read_csv_rows)
+
 # === 開始日 ===
 start_date = datetime(2025, 7, 15)
-today = datetime.now()
-yesterday = today - timedelta(days=1)
 
 # === 保存先フォルダ ===
 save_dir = r"\\150.89.226.195\Private\7期生\西山\weather_data"
-os.makedirs(save_dir, exist_ok=True)
 
 # === 枚方の気象庁コード ===
 pref_no = "62"
 block_no = "1065"
 
-# === 処理開始 ===
-current_date = start_date
-while current_date <= yesterday:
-    target_date_str = current_date.strftime("%Y%m%d")
-    year, month, day = current_date.strftime("%Y"), current_date.strftime("%m"), current_date.strftime("%d")
-    url = f"https://www.data.jma.go.jp/stats/etrn/view/10min_a1.php?prec_no={pref_no}&block_no={block_no}&year={year}&month={month}&day={day}&view="
+JMA_BASE_URL = "https://www.data.jma.go.jp"
+JMA_PATH = "/stats/etrn/view/10min_a1.php"
+CSV_HEADER = ["時分", "降水量 (mm)", "気温 (℃)", "相対湿度 (%)", "平均風速 (m/s)", "平均風向"]
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
-    csv_path = os.path.join(save_dir, f"{target_date_str}.csv")
-    if os.path.exists(csv_path):
-        current_date += timedelta(days=1)
-        continue
+TABLE_RE = re.compile(r'<table[^>]*class="data2_s"[^>]*>(.*?)</table>', re.S | re.I)
+ROW_RE = re.compile(r"<tr[^>]*>(.*?)</tr>", re.S | re.I)
+CELL_RE = re.compile(r"<td[^>]*>(.*?)</td>", re.S | re.I)
+TAG_RE = re.compile(r"<[^>]*>")
 
-    try:
-        response = requests.get(url)
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
-        table = soup.find("table", class_="data2_s")
-
-        if table:
-            rows = table.find_all("tr")
-            with open(csv_path, "w", newline="", encoding="cp932", errors="replace") as f:
-                writer = csv.writer(f)
-                writer.writerow(["時分", "降水量 (mm)", "気温 (℃)", "相対湿度 (%)", "平均風速 (m/s)", "平均風向"])
-                
-                for row in rows[2:]:  # ヘッダーの次から
-                    cells = row.find_all("td")
-                    if len(cells) < 6:
-                        continue
-
-                    time_str = cells[0].get_text(strip=True)
-                    try:
-                        hour = int(time_str.split(":")[0])
-                        if hour < 6 or hour > 21:
-                            continue  # 6:00〜21:59 のみ
-                    except:
-                        continue
-                    
-                    data = [cell.get_text(strip=True) for cell in cells[:6]]
-                    writer.writerow(data)
-
-            print(f"✅ {target_date_str}.csv を保存しました。")
-        else:
+
+def day_url(date, base_url=JMA_BASE_URL):
+    return (f"{base_url}{JMA_PATH}?prec_no={pref_no}&block_no={block_no}"
+            f"&year={date:%Y}&month={date:%m}&day={date:%d}&view=")
+
+
+def cell_text(cell):
+    # BeautifulSoup の get_text(strip=True) と同じく、タグで区切った文字列ごとに前後の空白を取る
+    return "".join(html.unescape(part).strip() for part in TAG_RE.split(cell))
+
+
+def parse_table(page):
+    """10分値の表から 6:00〜21:59 の行（先頭6列）を取り出す。表がなければ None"""
+    table = TABLE_RE.search(page)
+    if table is None:
+        return None
+
+    rows = []
+    for row in ROW_RE.findall(table.group(1))[2:]:  # ヘッダーの次から
+        cells = CELL_RE.findall(row)
+        if len(cells) < 6:
+            continue
+
+        data = [cell_text(c) for c in cells[:6]]
+        try:
+            hour = int(data[0].split(":")[0])
+        except ValueError:
+            continue
+        if hour < 6 or hour > 21:
+            continue  # 6:00〜21:59 のみ
+        rows.append(data)
+    return rows
+
+
+def write_csv(csv_path, rows):
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, "w", newline="", encoding="cp932", errors="replace") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+    os.replace(tmp_path, csv_path)
+
+
+class RateLimiter:
+    """全スレッド合わせて1秒に rate 回までにする"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class WeatherDownloader:
+    def __init__(self, save_dir, base_url=JMA_BASE_URL, workers=4, rate=2.0, timeout=10,
+                 max_retries=4, backoff=1.0, store=None):
+        self.save_dir = save_dir
+        self.store = store
+        self.base_url = base_url
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(rate)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url):
+        """ページの本文を返す。やり直しても取れなければ例外"""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait()
+            try:
+                res = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as e:
+                res = None
+                error = e
+            else:
+                if res.status_code == 200:
+                    # charset の指定がなければ中身から推定する（requests は ISO-8859-1 にしてしまう）
+                    if "charset" not in res.headers.get("Content-Type", "").lower():
+                        res.encoding = res.apparent_encoding
+                    return res.text
+                error = requests.HTTPError(f"HTTP {res.status_code}", response=res)
+                if res.status_code not in RETRY_STATUS:
+                    break
+
+            if attempt < self.max_retries:
+                time.sleep(self._retry_delay(res, attempt))
+        raise error
+
+    def _retry_delay(self, res, attempt):
+        # Retry-After があればそれに従い、なければ指数バックオフ
+        if res is not None:
+            retry_after = res.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def download_day(self, date):
+        """保存した行を返す（既にあれば None、失敗したら False）"""
+        target_date_str = date.strftime("%Y%m%d")
+        csv_path = os.path.join(self.save_dir, f"{target_date_str}.csv")
+        if os.path.exists(csv_path):
+            return None
+
+        try:
+            rows = parse_table(self.fetch(day_url(date, self.base_url)))
+        except Exception as e:
+            print(f"⚠️ {target_date_str} エラー: {e}")
+            return False
+        if rows is None:
             print(f"❌ {target_date_str} のデータが見つかりませんでした。")
+            return False
+
+        write_csv(csv_path, rows)
+        print(f"✅ {target_date_str}.csv を保存しました。")
+        return rows
+
+    def download(self, start, end):
+        """start〜end（両端を含む）のうち、まだない日を取りに行く。保存できた日数を返す"""
+        os.makedirs(self.save_dir, exist_ok=True)
+        dates = []
+        current_date = start
+        while current_date <= end:
+            dates.append(current_date)
+            current_date += timedelta(days=1)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self.download_day, dates))
+        if self.store is not None:
+            self.update_store(dates, results)
+        return sum(1 for r in results if r)
+
+    def update_store(self, dates, results):
+        """ストアにない日を日付順にまとめて足す（前からある CSV も読み込む）"""
+        parts = []
+        for date, rows in zip(dates, results):
+            if rows is False or self.store.has_day(date):
+                continue
+            header = CSV_HEADER
+            if rows is None:
+                header, rows = read_csv_rows(os.path.join(self.save_dir, f"{date:%Y%m%d}.csv"))
+            if rows:
+                parts.append(parse_rows(date, header, rows))
+        if parts:
+            self.store.append(*(np.concatenate(p) for p in zip(*parts)))
+
+
+def fixture_page(date):
+    """気象庁の10分値ページに似せた HTML（動作確認用）"""
+    rows = []
+    for n in range(1, 145):
+        t = datetime(date.year, date.month, date.day) + timedelta(minutes=10 * n)
+        hm = "24:00" if n == 144 else t.strftime("%H:%M")
+        temp = "--" if n % 50 == 0 else f"{20 + n * 0.05:.1f}"
+        rows.append(f'<tr class="mtx" style="text-align:right;"><td class="data_0_0">{hm}</td>'
+                    f'<td class="data_0_0">0.0</td><td class="data_0_0">{temp}</td>'
+                    f'<td class="data_0_0">{60 + n % 30} )</td><td class="data_0_0">1.2</td>'
+                    f'<td class="data_0_0" style="text-align:center">北&nbsp;</td>'
+                    f'<td class="data_0_0">2.5</td><td class="data_0_0">×</td></tr>')
+    header = ('<tr class="mtx"><th rowspan="2">時分</th><th rowspan="2">降水量<br>(mm)</th>'
+              '<th rowspan="2">気温<br>(℃)</th></tr><tr class="mtx"><th>平均</th></tr>')
+    return ('<html><head><meta charset="UTF-8"></head><body>'
+            '<table class="data2_s" id="tablefix1">' + header + "".join(rows) +
+            "</table></body></html>")
+
+
+def selftest(days=10):
+    """ローカルの HTTP サーバーで、再試行・再開・一時ファイルの扱いを確かめる"""
+    import tempfile
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    start = datetime(2025, 7, 15)
+    missing_day = start + timedelta(days=3)  # 表のない日
+    failures = {}  # 日付 → 503 を返した回数（最初の1回は必ず失敗させる）
+    requested = []
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            q = parse_qs(urlparse(self.path).query)
+            date = datetime(int(q["year"][0]), int(q["month"][0]), int(q["day"][0]))
+            with lock:
+                requested.append(date)
+                first = failures.setdefault(date, 0) == 0
+                failures[date] += 1
+            if first:
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            page = "<html><body>データなし</body></html>" if date == missing_day else fixture_page(date)
+            body = page.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    end = start + timedelta(days=days - 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 途中で止まったときの一時ファイルが残っていても、完成したファイルとは扱わない
+        open(os.path.join(tmp, f"{start:%Y%m%d}.csv.tmp"), "w").close()
+        store = WeatherStore(os.path.join(tmp, "store"))
+        downloader = WeatherDownloader(tmp, base_url=base_url, workers=4, rate=50, backoff=0.01,
+                                       store=store)
+        t0 = time.perf_counter()
+        saved = downloader.download(start, end)
+        elapsed = time.perf_counter() - t0
+        assert saved == days - 1, saved
+
+        with open(os.path.join(tmp, f"{start:%Y%m%d}.csv"), encoding="cp932") as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == CSV_HEADER
+        assert rows[1] == ["06:00", "0.0", "21.8", "66 )", "1.2", "北"], rows[1]
+        assert rows[-1][0] == "21:50" and len(rows) == 1 + 16 * 6, (rows[-1], len(rows))
+        assert not any(f.endswith(".tmp") for f in os.listdir(tmp))
+        assert len(store) == (days - 1) * 96 and not store.has_day(missing_day)
+        first = store.query(start, start + timedelta(days=1), flags=True).iloc[0]
+        assert first["humidity"] == 66 and first["humidity_flag"] == QUALITY_QUASI, first
+
+        # 2回目は表のなかった日だけを取りに行く
+        requested.clear()
+        assert downloader.download(start, end) == 0
+        assert requested == [missing_day], requested
+
+    server.shutdown()
+
+    # 表の読み取りの速さ（BeautifulSoup があれば比べる）
+    page = fixture_page(start)
+    t0 = time.perf_counter()
+    for _ in range(50):
+        fast = parse_table(page)
+    t_fast = (time.perf_counter() - t0) / 50
+    print(f"✅ 動作確認 OK（{days}日分 {elapsed:.2f} 秒）。表の読み取り: 正規表現 {t_fast * 1000:.2f} ms/ページ")
+    try:
+        from bs4 import BeautifulSoup
+    except ImportError:
+        return
+    t0 = time.perf_counter()
+    soup = BeautifulSoup(page, "html.parser")
+    slow = []
+    for row in soup.find("table", class_="data2_s").find_all("tr")[2:]:
+        cells = row.find_all("td")
+        if len(cells) >= 6 and 6 <= int(cells[0].get_text(strip=True).split(":")[0]) <= 21:
+            slow.append([c.get_text(strip=True) for c in cells[:6]])
+    t_slow = time.perf_counter() - t0
+    assert slow == fast
+    print(f"   BeautifulSoup(html.parser) {t_slow * 1000:.2f} ms/ページ")
+
 
-    except Exception as e:
-        print(f"⚠️ {target_date_str} エラー: {e}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="気象庁の10分値を日ごとの CSV に保存する")
+    parser.add_argument("--start", default=start_date.strftime("%Y%m%d"), help="開始日 YYYYMMDD")
+    parser.add_argument("--end", default=None, help="終了日 YYYYMMDD（既定は昨日）")
+    parser.add_argument("--workers", type=int, default=4, help="同時に取りに行く数")
+    parser.add_argument("--rate", type=float, default=2.0, help="1秒あたりのリクエスト数の上限")
+    parser.add_argument("--store", default=WEATHER_STORE_DIR,
+                        help="型付きの10分値ストアの場所（'' で使わない）")
+    parser.add_argument("--selftest", action="store_true", help="ローカルの HTTP サーバーで動作確認する")
+    args = parser.parse_args()
 
-    current_date += timedelta(days=1)
+    if args.selftest:
+        selftest()
+    else:
+        yesterday = datetime.now() - timedelta(days=1)
+        end = datetime.strptime(args.end, "%Y%m%d") if args.end else yesterday
+        store = WeatherStore(args.store) if args.store else None
+        downloader = WeatherDownloader(save_dir, workers=args.workers, rate=args.rate, store=store)
+        saved = downloader.download(datetime.strptime(args.start, "%Y%m%d"), end)
+        print(f"\n✅ 完了：{saved}日分を保存しました。")
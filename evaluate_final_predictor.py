@@ -1,20 +1,21 @@
 # evaluate_final_predictor.py
 
-import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import confusion_matrix, classification_report, mean_absolute_error, mean_squared_error
 import matplotlib.pyplot as plt
 import seaborn as sns
 from tensorflow.keras.models import load_model
+from feature_store import open_feature_store
 
-# 1. データ読み込み
-df = pd.read_csv("features_dataset.csv")
+# 1. データ読み込み（特徴ストア）
+store = open_feature_store("features_dataset")
+meta = store.meta
 
-# 特徴量とラベルを分ける
-X = df.drop(columns=["label", "rain_mm"]).values
-y_class = df["label"].values
-y_reg = df["rain_mm"].values
+# 特徴量とラベルを分ける（以前の CSV で label・rain_mm 以外の列を使っていたのと同じ並び）
+X = store.features(["temperature", "humidity", "precipitation"])
+y_class = meta["label"].values
+y_reg = meta["rain_mm"].values
 
 # 訓練・テスト分割（ランダムシードは同じに）
 X_train, X_test, y_class_train, y_class_test, y_reg_train, y_reg_test = train_test_split(
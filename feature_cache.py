@@ -0,0 +1,224 @@
+# feature_cache.py
+#
+# 一度計算した ResNet50 特徴を保存しておき、同じ画像を二度と埋め込まないためのキャッシュ。
+#   - キー: 画像の絶対パス + 更新時刻 + ファイルサイズ（画像を置き換えれば別キーになる）
+#   - モデルの指紋（重みのハッシュ）と保存する型ごとにフォルダを分ける
+#     （モデルを変えたら作り直し。float16 のキャッシュを float32 で開いても別のキャッシュになる）
+#   - 特徴は float32 / float16 の memmap シャードに行として追記し、index.tsv で位置を引く
+#   - 複数のプロセス（predict_server と prepare_dataset など）が同じフォルダに書いてよい。
+#     追記は index.tsv の排他ロックを取り、他のプロセスが足した行を読んでから空いた行に書く
+#
+# フォルダ構成:
+#   feature_cache/<指紋>-float32/index.tsv         キー \t シャード番号 \t 行番号
+#   feature_cache/<指紋>-float32/shard_00000.f32   (shard_size, 2048) の生データ
+
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows ではロックなし（開発用）
+    fcntl = None
+
+FEATURE_CACHE_DIR = "feature_cache"
+FEATURE_DIM = 2048
+
+
+def model_fingerprint(model):
+    """モデルの構造と重みから短い指紋を作る"""
+    h = hashlib.sha1()
+    h.update(model.name.encode("utf-8"))
+    for w in model.get_weights():
+        h.update(str(w.shape).encode("utf-8"))
+        h.update(np.ascontiguousarray(w).tobytes())
+    return h.hexdigest()[:16]
+
+
+def file_key(path):
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+
+
+class FeatureCache:
+    def __init__(self, fingerprint, root=FEATURE_CACHE_DIR, dtype="float32", shard_size=4096,
+                 dim=FEATURE_DIM, readonly=False):
+        self.dtype = np.dtype(dtype)
+        # シャードの中身は型によって違うので、型もキーに入れる
+        self.dir = os.path.join(root, f"{fingerprint}-{self.dtype.name}")
+        self.suffix = ".f16" if self.dtype == np.float16 else ".f32"
+        self.shard_size = shard_size
+        self.dim = dim
+        # 読み出し専用（並列ビルドの子プロセス用）。追記は親プロセスだけが行う
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self.index = {}   # キー → (シャード番号, 行番号)
+        self.shards = {}  # シャード番号 → memmap
+        self.next_pos = (0, 0)
+        self.index_path = os.path.join(self.dir, "index.tsv")
+        self.index_end = 0  # index.tsv をどこ（バイト）まで読んだか
+        os.makedirs(self.dir, exist_ok=True)
+        self._read_index()
+
+    @classmethod
+    def for_model(cls, model, **kwargs):
+        return cls(model_fingerprint(model), **kwargs)
+
+    def _read_index(self):
+        """index.tsv の、前回読んだところより後の行を読む（他のプロセスが足した分も拾う）"""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self.index_end)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 書き込み途中の行
+                self.index_end += len(line)
+                key, shard, row = line[:-1].decode("utf-8").rsplit("\t", 2)
+                self.index[key] = (int(shard), int(row))
+                self.next_pos = max(self.next_pos, (int(shard), int(row) + 1))
+        shard, row = self.next_pos
+        if row >= self.shard_size:
+            self.next_pos = (shard + 1, 0)
+
+    def _shard(self, shard, create=True):
+        """シャードの memmap。create=False（読み出し）でファイルがなければ None"""
+        mm = self.shards.get(shard)
+        if mm is None:
+            path = os.path.join(self.dir, f"shard_{shard:05d}{self.suffix}")
+            if not os.path.exists(path) and (self.readonly or not create):
+                # 索引にあってもシャードがない行は、0 で埋めた新しいシャードを作らずに外れ扱い
+                return None
+            if self.readonly:
+                mode = "r"
+            else:
+                mode = "r+" if os.path.exists(path) else "w+"
+            mm = np.memmap(path, dtype=self.dtype, mode=mode, shape=(self.shard_size, self.dim))
+            self.shards[shard] = mm
+        return mm
+
+    def __len__(self):
+        return len(self.index)
+
+    def get_many(self, img_paths):
+        """(特徴 (N, dim) float32, キャッシュにあったかどうか (N,)) を返す"""
+        features = np.zeros((len(img_paths), self.dim), dtype=np.float32)
+        hit = np.zeros(len(img_paths), dtype=bool)
+        with self.lock:
+            self._read_index()
+            for i, path in enumerate(img_paths):
+                try:
+                    pos = self.index.get(file_key(path))
+                except OSError:
+                    continue
+                mm = None if pos is None else self._shard(pos[0], create=False)
+                if mm is not None:
+                    features[i] = mm[pos[1]]
+                    hit[i] = True
+        return features, hit
+
+    def put_many(self, img_paths, features):
+        if self.readonly:
+            return
+        with self.lock, open(self.index_path, "ab+") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                # ロックを取ってから他のプロセスが足した行を読み、その後ろの空いた行に書く
+                self._read_index()
+                lines = []
+                for path, feat in zip(img_paths, features):
+                    try:
+                        key = file_key(path)
+                    except OSError:
+                        continue
+                    if key in self.index:
+                        continue
+                    shard, row = self.next_pos
+                    self._shard(shard)[row] = feat
+                    self.index[key] = (shard, row)
+                    lines.append(f"{key}\t{shard}\t{row}\n".encode("utf-8"))
+                    self.next_pos = (shard, row + 1) if row + 1 < self.shard_size else (shard + 1, 0)
+                if not lines:
+                    return
+                # データを書き終えてから索引に載せる（途中で止まっても壊れた行を引かない）
+                for mm in self.shards.values():
+                    mm.flush()
+                data = b"".join(lines)
+                f.write(data)
+                f.flush()
+                self.index_end += len(data)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _stress_worker(root, paths, worker):
+    cache = FeatureCache("stress", root=root, shard_size=64, dim=4)
+    for i in range(0, len(paths), 7):
+        batch = paths[i:i + 7]
+        # 特徴の値で、どのプロセスが書いたどの画像の行かがわかるようにする
+        feats = np.array([[int(os.path.basename(p).split(".")[0]), worker, 0, 0] for p in batch],
+                         dtype=np.float32)
+        cache.put_many(batch, feats)
+
+
+if __name__ == "__main__":
+    # ストレステスト: 複数のプロセスが同じキャッシュに同時に書き、どの画像も自分の特徴を引けるか
+    #   python feature_cache.py [プロセス数] [1プロセスあたりの画像数]
+    import multiprocessing
+    import sys
+    import tempfile
+    import time
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for n in range(workers * count):
+            path = os.path.join(tmp, f"{n}.jpg")
+            open(path, "w").close()
+            paths.append(path)
+        # 半分は隣のプロセスと重なる画像（同じ画像を別のプロセスが同時に埋め込んだ場合）
+        jobs = [paths[w * count:(w + 1) * count] + paths[((w + 1) % workers) * count:][:count // 2]
+                for w in range(workers)]
+        procs = [multiprocessing.Process(target=_stress_worker, args=(tmp, jobs[w], w))
+                 for w in range(workers)]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+
+        cache = FeatureCache("stress", root=tmp, shard_size=64, dim=4)
+        feats, hit = cache.get_many(paths)
+        assert hit.all(), (~hit).sum()
+        assert (feats[:, 0] == np.arange(len(paths))).all(), "別の画像の特徴が返った"
+        positions = list(cache.index.values())
+        assert len(set(positions)) == len(positions) == len(paths), "同じ行を2つの画像が使っている"
+        with open(cache.index_path, encoding="utf-8") as f:
+            lines = sum(1 for _ in f)
+        print(f"✅ {workers}プロセスが同時に書いた {len(paths)}枚すべてが自分の特徴を引けました"
+              f"（index.tsv {lines}行・重なった画像は1回だけ、{elapsed:.2f}秒）")
+
+        # 型の違い: float16 で書いたキャッシュを float32 で開いても、0 の特徴を当たりとして返さない
+        half = FeatureCache("stress", root=tmp, dtype="float16", shard_size=64, dim=4)
+        half.put_many(paths[:5], np.ones((5, 4), dtype=np.float32))
+        assert half.get_many(paths[:5])[1].all()
+        feats, hit = FeatureCache("stress", root=tmp, shard_size=64, dim=4).get_many(paths[:5])
+        assert hit.all() and (feats[:, 0] == np.arange(5)).all(), "float16 のキャッシュを float32 として読んだ"
+        feats, hit = FeatureCache("stress", root=tmp, dtype="float16", shard_size=64, dim=4,
+                                  readonly=True).get_many(paths[:5])
+        assert hit.all() and (feats == 1).all()
+
+        # 索引にあってもシャードのファイルがない行は外れ扱いにし、0 のシャードを作らない
+        os.remove(os.path.join(half.dir, "shard_00000.f16"))
+        feats, hit = FeatureCache("stress", root=tmp, dtype="float16", shard_size=64,
+                                  dim=4).get_many(paths[:5])
+        assert not hit.any(), "なくなったシャードの行を当たりとして返した"
+        assert not os.path.exists(os.path.join(half.dir, "shard_00000.f16")), "読み出しでシャードを作った"
+        print("✅ 型の違うキャッシュ・なくなったシャードを当たりとして返しませんでした")
@@ -0,0 +1,176 @@
+# feature_extractor.py
+#
+# ResNet50（avg_pool出力, 2048次元）で画像特徴をまとめて抽出する。
+#   - JPEG の読み込み・リサイズはスレッドプールで並列に行い、先読みしておく
+#   - 決まった大きさのバッチにまとめて、モデルはバッチごとに1回だけ呼ぶ
+#     （最後の半端なバッチは0埋めして同じ形にする）
+#   - processes=True にすると読み込みをプロセスプールで行う（GIL の影響を受けない）
+#   - cache（feature_cache.FeatureCache）を渡すと、計算済みの画像は埋め込まずに読み出す
+#   - frame_store（frame_store.FrameStore）を渡すと、224x224 に縮小済みの画像を JPEG を読まずに使う
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
+from tensorflow.keras.preprocessing import image
+from tensorflow.keras.models import Model
+
+IMG_SIZE = (224, 224)
+FEATURE_DIM = 2048
+
+
+def build_feature_model(weights='imagenet'):
+    base_model = ResNet50(weights=weights, include_top=False, pooling='avg')
+    return Model(inputs=base_model.input, outputs=base_model.output)
+
+
+def load_image(img_path, target_size=IMG_SIZE):
+    """画像を読み込んで (H, W, 3) の float32 配列にする。失敗したら None"""
+    try:
+        img = image.load_img(img_path, target_size=target_size)
+        return image.img_to_array(img)
+    except Exception as e:
+        print(f"[×] 画像読み込み失敗: {img_path} → {e}")
+        return None
+
+
+class FeatureExtractor:
+    def __init__(self, feature_model=None, batch_size=32, workers=8, prefetch=2, cache=None,
+                 processes=False, frame_store=None):
+        self.feature_model = feature_model if feature_model is not None else build_feature_model()
+        self.cache = cache
+        self.frame_store = frame_store
+        self.batch_size = batch_size
+        self.workers = workers
+        self.prefetch = prefetch  # 何バッチ分を先に読み込んでおくか
+        self.processes = processes
+        self.pool = None
+
+    def iter_batches(self, img_paths):
+        """(元の並びでの添字, 画像バッチ) を返す。読み込みに失敗した画像は入らない"""
+        window = self.batch_size * (self.prefetch + 1)
+        if self.processes:
+            # プロセスの起動は重いので、プールは一度だけ作って使い回す
+            # （TensorFlow を読み込んだあとの fork は危ないので spawn で起動する）
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            yield from self._iter_batches(self.pool, img_paths, window)
+        else:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                yield from self._iter_batches(pool, img_paths, window)
+
+    def _iter_batches(self, pool, img_paths, window):
+        paths = enumerate(img_paths)
+        pending = deque()
+        indices, images = [], []
+        while True:
+            # 先読みは window 枚までにして、読み込んだ画像がたまりすぎないようにする
+            for i, path in islice(paths, window - len(pending)):
+                pending.append((i, pool.submit(load_image, path)))
+            if not pending:
+                break
+            i, future = pending.popleft()
+            img = future.result()
+            if img is None:
+                continue
+            indices.append(i)
+            images.append(img)
+            if len(images) == self.batch_size:
+                yield indices, np.stack(images)
+                indices, images = [], []
+        if images:
+            yield indices, np.stack(images)
+
+    def predict_batch(self, batch):
+        n = len(batch)
+        if n < self.batch_size:
+            # 形を揃えておくと、モデルの再トレースが起きない
+            pad = np.zeros((self.batch_size - n,) + batch.shape[1:], dtype=batch.dtype)
+            batch = np.concatenate([batch, pad])
+        feats = self.feature_model.predict_on_batch(preprocess_input(batch))
+        return np.asarray(feats)[:n]
+
+    def extract(self, img_paths):
+        """画像パスの並びから (特徴 (N, 2048), 読み込めたかどうか (N,)) を返す"""
+        img_paths = list(img_paths)
+        if self.cache is None:
+            return self._extract(img_paths)
+
+        # キャッシュにない画像だけを埋め込み、結果をキャッシュに足す
+        features, ok = self.cache.get_many(img_paths)
+        missing = np.flatnonzero(~ok)
+        if len(missing):
+            miss_paths = [img_paths[i] for i in missing]
+            miss_feats, miss_ok = self._extract(miss_paths)
+            features[missing] = miss_feats
+            ok[missing] = miss_ok
+            self.cache.put_many([p for p, good in zip(miss_paths, miss_ok) if good],
+                                miss_feats[miss_ok])
+        return features, ok
+
+    def _extract(self, img_paths):
+        features = np.zeros((len(img_paths), FEATURE_DIM), dtype=np.float32)
+        ok = np.zeros(len(img_paths), dtype=bool)
+        missing = np.arange(len(img_paths))
+        if self.frame_store is not None:
+            # 縮小済みの画像があればバッチごとに memmap から読み、ない画像だけ JPEG を読む
+            found = np.zeros(len(img_paths), dtype=bool)
+            for start in range(0, len(img_paths), self.batch_size):
+                frames, hit = self.frame_store.lookup(img_paths[start:start + self.batch_size], IMG_SIZE)
+                if hit.any():
+                    idx = start + np.flatnonzero(hit)
+                    features[idx] = self.predict_batch(frames[hit].astype(np.float32))
+                    found[idx] = True
+            ok |= found
+            missing = np.flatnonzero(~found)
+        for indices, batch in self.iter_batches([img_paths[i] for i in missing]):
+            features[missing[indices]] = self.predict_batch(batch)
+            ok[missing[indices]] = True
+        return features, ok
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+if __name__ == "__main__":
+    # ベンチマーク: バッチサイズごとの 1秒あたりの処理枚数（CPU）
+    #   python feature_extractor.py [画像フォルダ] [枚数]
+    import sys
+    import tempfile
+    import time
+
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    tmp = None
+    if len(sys.argv) > 1 and os.path.isdir(sys.argv[1]):
+        folder = sys.argv[1]
+        img_paths = sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                           if f.lower().endswith(('.jpg', '.png')))[:count]
+    else:
+        # 画像がなければ 640x480 のランダム画像を作る
+        tmp = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        img_paths = []
+        for n in range(count):
+            path = os.path.join(tmp.name, f"{n:04d}.jpg")
+            image.array_to_img(rng.integers(0, 255, (480, 640, 3))).save(path)
+            img_paths.append(path)
+
+    # 重みは速度に関係ないのでダウンロードしない
+    feature_model = build_feature_model(weights=None)
+    print(f"画像 {len(img_paths)}枚")
+    for batch_size in (1, 2, 4, 8, 16, 32, 64, 128):
+        extractor = FeatureExtractor(feature_model, batch_size=batch_size)
+        extractor.predict_batch(np.zeros((1,) + IMG_SIZE + (3,), dtype=np.float32))  # ウォームアップ
+        t0 = time.perf_counter()
+        extractor.extract(img_paths)
+        elapsed = time.perf_counter() - t0
+        print(f"batch_size={batch_size:>3}: {len(img_paths) / elapsed:7.1f} 枚/秒")
+
+    if tmp is not None:
+        tmp.cleanup()
@@ -0,0 +1,289 @@
+# feature_store.py
+#
+# features_dataset.csv の代わりに使う列指向のバイナリ特徴ストア。
+#   features_dataset/
+#     manifest.json    行数・次元・ファイル名などの説明
+#     embeddings.npy   (N, 2048) float32 の画像特徴（np.load(mmap_mode='r') でそのまま読める）
+#     meta.parquet     filename / img_time / temperature / humidity / precipitation / rain_mm / label
+# 行は img_time の順に並べてあるので、日付の範囲指定は二分探索で連続した区間を切り出すだけ
+# （特徴行列はコピーせず memmap のビューを返す）。
+#
+# 日付ごとの差分ビルド（prepare_dataset.py）では、元の CSV 1つごとに1つのストアを作る:
+#   features_dataset/partitions/A_model_YYYYMMDD/  (上と同じ3ファイル + _SUCCESS)
+# _SUCCESS（完了印）には元データの更新時刻などを書き、変わっていなければ作り直さない。
+# PartitionedFeatureStore は完了印のあるパーティションだけを必要になった時点で開いてつなげる。
+#
+# 既存の CSV からの変換とベンチマーク:
+#   python feature_store.py convert features_dataset.csv features_dataset
+#   python feature_store.py bench features_dataset.csv features_dataset
+
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+FEATURE_DIM = 2048
+MANIFEST = "manifest.json"
+EMBEDDINGS = "embeddings.npy"
+META = "meta.parquet"
+
+# 旧 CSV（0〜2047列が画像特徴、2048・2049列が気温・湿度）の列名
+LEGACY_WEATHER_COLUMNS = {str(FEATURE_DIM): "temperature", str(FEATURE_DIM + 1): "humidity"}
+
+
+def write_feature_store(path, embeddings, meta, time_column="img_time"):
+    """特徴行列とメタデータを書き出す。一時フォルダに書いてから置き換える"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    meta = meta.reset_index(drop=True)
+    if time_column in meta:
+        meta[time_column] = pd.to_datetime(meta[time_column])
+        order = np.argsort(meta[time_column].to_numpy(), kind="stable")
+        embeddings = embeddings[order]
+        meta = meta.iloc[order].reset_index(drop=True)
+    else:
+        time_column = None
+
+    tmp_path = path.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, EMBEDDINGS), embeddings)
+    meta.to_parquet(os.path.join(tmp_path, META), index=False)
+    write_manifest(tmp_path, len(meta), embeddings.shape[1], time_column)
+    replace_dir(tmp_path, path)
+
+
+def write_manifest(path, rows, feature_dim, time_column):
+    manifest = {
+        "version": 1,
+        "rows": int(rows),
+        "feature_dim": int(feature_dim),
+        "embeddings": EMBEDDINGS,
+        "meta": META,
+        "time_column": time_column,
+    }
+    with open(os.path.join(path, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def replace_dir(tmp_path, path):
+    if os.path.exists(path):
+        old_path = path.rstrip("/\\") + ".old"
+        if os.path.exists(old_path):
+            shutil.rmtree(old_path)
+        os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+
+
+class FeatureStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        self.embeddings = np.load(os.path.join(path, self.manifest["embeddings"]), mmap_mode="r")
+        self.meta = pd.read_parquet(os.path.join(path, self.manifest["meta"]))
+        self.time_column = self.manifest.get("time_column")
+        self.feature_dim = self.manifest["feature_dim"]
+
+    def __len__(self):
+        return self.manifest["rows"]
+
+    def _bounds(self, start=None, end=None):
+        if start is None and end is None:
+            return 0, len(self)
+        if not self.time_column:
+            raise ValueError("この特徴ストアには時刻列がないため、日付で切り出せません")
+        times = self.meta[self.time_column].to_numpy()
+        lo = 0 if start is None else np.searchsorted(times, np.datetime64(pd.Timestamp(start)), "left")
+        hi = len(self) if end is None else np.searchsorted(times, np.datetime64(pd.Timestamp(end)), "left")
+        return int(lo), int(hi)
+
+    def slice(self, start=None, end=None):
+        """[start, end) の時刻範囲の (特徴行列のビュー, メタデータ) を返す"""
+        lo, hi = self._bounds(start, end)
+        return self.embeddings[lo:hi], self.meta.iloc[lo:hi]
+
+    def iter_slices(self, start=None, end=None):
+        """PartitionedFeatureStore と同じ形で、1つだけの (特徴行列のビュー, メタデータ) を返す"""
+        yield self.slice(start, end)
+
+    def features(self, columns=("temperature", "humidity"), start=None, end=None):
+        """画像特徴の後ろにメタデータの列を並べた (N, 2048 + len(columns)) の float32 行列"""
+        emb, meta = self.slice(start, end)
+        extra = meta[list(columns)].to_numpy(dtype=np.float32)
+        return np.concatenate([emb, extra], axis=1)
+
+
+SUCCESS = "_SUCCESS"
+PARTITIONS = "partitions"
+
+
+def source_stamp(*paths):
+    """元データ（CSV・画像フォルダ）の更新時刻と大きさ。変わっていればパーティションを作り直す"""
+    stamp = {}
+    for p in paths:
+        st = os.stat(p)
+        stamp[os.path.basename(p)] = [st.st_mtime_ns, st.st_size]
+    return stamp
+
+
+def partition_path(root, name):
+    return os.path.join(root, PARTITIONS, name)
+
+
+def is_partition_done(root, name, stamp):
+    marker = os.path.join(partition_path(root, name), SUCCESS)
+    if not os.path.exists(marker):
+        return False
+    with open(marker, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f).get("source") == stamp
+        except ValueError:
+            return False
+
+
+def write_partition(root, name, embeddings, meta, stamp):
+    """パーティションを書き出し、最後に完了印を置く（印のないものは次回やり直す）"""
+    path = partition_path(root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_feature_store(path, embeddings, meta)
+    with open(os.path.join(path, SUCCESS), "w", encoding="utf-8") as f:
+        json.dump({"source": stamp, "rows": len(meta)}, f)
+
+
+class PartitionedFeatureStore:
+    """完了したパーティションをつなげて1つの特徴ストアとして扱う（FeatureStore と同じ使い方）"""
+
+    def __init__(self, root):
+        self.root = root
+        base = os.path.join(root, PARTITIONS)
+        names = sorted(os.listdir(base)) if os.path.isdir(base) else []
+        self.names = [n for n in names if os.path.exists(os.path.join(base, n, SUCCESS))]
+        self.stores = {}
+        self._meta = None
+
+    def store(self, name):
+        # 必要になったパーティションだけを開く（特徴行列は memmap のまま）
+        if name not in self.stores:
+            self.stores[name] = FeatureStore(partition_path(self.root, name))
+        return self.stores[name]
+
+    def _names_in(self, start=None, end=None):
+        # パーティション名の末尾 YYYYMMDD で日付範囲にかからないものは開かない
+        lo = None if start is None else pd.Timestamp(start).strftime("%Y%m%d")
+        hi = None if end is None else pd.Timestamp(end).strftime("%Y%m%d")
+        return [n for n in self.names
+                if (lo is None or n[-8:] >= lo) and (hi is None or n[-8:] <= hi)]
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            metas = [self.store(n).meta for n in self.names]
+            self._meta = pd.concat(metas, ignore_index=True) if metas else pd.DataFrame()
+        return self._meta
+
+    @property
+    def feature_dim(self):
+        return self.store(self.names[0]).feature_dim if self.names else FEATURE_DIM
+
+    def __len__(self):
+        return sum(len(self.store(n)) for n in self.names)
+
+    def iter_slices(self, start=None, end=None):
+        """パーティションごとの (特徴行列のビュー, メタデータ) を順に返す"""
+        for name in self._names_in(start, end):
+            yield self.store(name).slice(start, end)
+
+    def slice(self, start=None, end=None):
+        parts = list(self.iter_slices(start, end))
+        if not parts:
+            return np.zeros((0, FEATURE_DIM), dtype=np.float32), pd.DataFrame()
+        if len(parts) == 1:
+            return parts[0]
+        return (np.concatenate([e for e, _ in parts]),
+                pd.concat([m for _, m in parts], ignore_index=True))
+
+    def features(self, columns=("temperature", "humidity"), start=None, end=None):
+        parts = [np.concatenate([e, m[list(columns)].to_numpy(dtype=np.float32)], axis=1)
+                 for e, m in self.iter_slices(start, end)]
+        if not parts:
+            return np.zeros((0, FEATURE_DIM + len(columns)), dtype=np.float32)
+        return np.concatenate(parts)
+
+
+def open_feature_store(path):
+    """パーティション分けしたフォルダならつなげて、そうでなければ1つのストアとして開く"""
+    if os.path.isdir(os.path.join(path, PARTITIONS)):
+        return PartitionedFeatureStore(path)
+    return FeatureStore(path)
+
+
+def convert_csv(csv_path, path, chunksize=5000):
+    """旧 features_dataset.csv を少しずつ読み、特徴ストアに変換する"""
+    with open(csv_path, "r", encoding="utf-8-sig") as f:
+        rows = sum(1 for _ in f) - 1
+
+    tmp_path = path.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    embeddings = np.lib.format.open_memmap(os.path.join(tmp_path, EMBEDDINGS), mode="w+",
+                                           dtype=np.float32, shape=(rows, FEATURE_DIM))
+    metas = []
+    pos = 0
+    for chunk in pd.read_csv(csv_path, encoding="utf-8-sig", chunksize=chunksize):
+        n = len(chunk)
+        embeddings[pos:pos + n] = chunk.iloc[:, :FEATURE_DIM].to_numpy(dtype=np.float32)
+        metas.append(chunk.iloc[:, FEATURE_DIM:].rename(columns=LEGACY_WEATHER_COLUMNS))
+        pos += n
+    embeddings.flush()
+    del embeddings
+
+    meta = pd.concat(metas, ignore_index=True) if metas else pd.DataFrame()
+    meta.to_parquet(os.path.join(tmp_path, META), index=False)
+    # 旧 CSV には時刻がないので、日付での切り出しはできない
+    write_manifest(tmp_path, rows, FEATURE_DIM, None)
+    replace_dir(tmp_path, path)
+    return rows
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 4 or sys.argv[1] not in ("convert", "bench"):
+        print("使い方: python feature_store.py convert|bench <features_dataset.csv> <出力フォルダ>")
+        sys.exit(1)
+
+    command, csv_path, store_path = sys.argv[1:4]
+    if command == "convert":
+        rows = convert_csv(csv_path, store_path)
+        print(f"✅ {rows}行を変換しました → {store_path}")
+        sys.exit(0)
+
+    # ベンチマーク: 読み込み時間とディスク上の大きさを比べる
+    if not os.path.exists(store_path):
+        convert_csv(csv_path, store_path)
+
+    t0 = time.perf_counter()
+    df = pd.read_csv(csv_path, encoding="utf-8-sig")
+    X_csv = df.iloc[:, :FEATURE_DIM + 2].to_numpy(dtype=np.float32)
+    t_csv = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    X_store = FeatureStore(store_path).features()
+    t_store = time.perf_counter() - t0
+
+    assert np.array_equal(X_csv, X_store, equal_nan=True)
+    print(f"行数: {len(X_csv):,}")
+    print(f"CSV        : {t_csv:7.2f} 秒  {os.path.getsize(csv_path) / 1e6:9.1f} MB")
+    print(f"特徴ストア : {t_store:7.2f} 秒  {dir_size(store_path) / 1e6:9.1f} MB")
@@ -0,0 +1,294 @@
+# frame_store.py
+#
+# カメラ画像を日付フォルダごとに1回だけ読み込み（JPEG のデコードも1回）、
+# 使う大きさごとに縮小した uint8 の配列として保存する。
+#   frame_store/
+#     YYYYMMDD/
+#       frames_224x224.npy  (N, 224, 224, 3) uint8  ResNet50 用（np.load(mmap_mode='r') でそのまま読める）
+#       frames_64x64.npy    (N, 64, 64, 3) uint8    ConvLSTM 用
+#       frames_128x128.npy  (N, 128, 128, 3) uint8  PredNet 用
+#       index.parquet       filename / img_time（時刻順。各 frames の行と同じ並び）
+#       _SUCCESS            元の画像フォルダの更新時刻と作った大きさ（変わっていなければ作り直さない）
+# 縮小は keras の load_img（最近傍）と同じなので、JPEG から読んだ場合と同じ値になる。
+# 時刻の範囲は二分探索で連続した区間を切り出すだけで、配列はコピーせず memmap のビューを返す。
+#
+#   python frame_store.py build <画像フォルダ（YYYYMMDD サブフォルダあり）> [出力フォルダ] [--sizes 224,64,128]
+#   python frame_store.py bench <日付の画像フォルダ> [出力フォルダ]
+
+import io
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from feature_store import SUCCESS, replace_dir, source_stamp
+from label_attach import get_image_timestamp
+
+FRAME_STORE_DIR = "frame_store"
+FRAME_SIZE = (64, 64)       # ConvLSTM に入れる大きさ
+PREDNET_SIZE = (128, 128)   # PredNet に入れる大きさ
+RESNET_SIZE = (224, 224)    # ResNet50 に入れる大きさ（feature_extractor.IMG_SIZE と同じ）
+FRAME_SIZES = (RESNET_SIZE, FRAME_SIZE, PREDNET_SIZE)
+INDEX = "index.parquet"
+
+
+def frames_file(size):
+    return f"frames_{size[0]}x{size[1]}.npy"
+
+
+def list_images(img_folder):
+    """画像フォルダの (ファイル名, 時刻) を時刻順に返す。ファイル名が時刻でない画像は除く"""
+    files, times = [], []
+    for f in sorted(os.listdir(img_folder)):
+        if not f.lower().endswith(('.jpg', '.png')):
+            continue
+        try:
+            times.append(get_image_timestamp(f))
+        except ValueError:
+            continue
+        files.append(f)
+    return pd.DataFrame({'filename': files, 'img_time': pd.to_datetime(times)})
+
+
+def decode(img_path, sizes):
+    """画像を1回だけデコードし、sizes の各大きさに縮小した uint8 配列のリストにする。失敗したら None
+
+    keras の load_img(target_size=...) と同じく RGB にして最近傍で縮小する。
+    """
+    try:
+        with open(img_path, "rb") as f:
+            img = Image.open(io.BytesIO(f.read()))
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            out = []
+            for h, w in sizes:
+                resized = img if img.size == (w, h) else img.resize((w, h), Image.NEAREST)
+                out.append(np.asarray(resized, dtype=np.uint8))
+            return out
+    except Exception as e:
+        print(f"[×] 画像読み込み失敗: {img_path} → {e}")
+        return None
+
+
+def read_success(path):
+    marker = os.path.join(path, SUCCESS)
+    if not os.path.exists(marker):
+        return None
+    with open(marker, "r", encoding="utf-8") as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def build_day(img_folder, root=FRAME_STORE_DIR, sizes=FRAME_SIZES, workers=8):
+    """1日分の画像を sizes の各大きさに縮小して root/YYYYMMDD/ に書き出す。
+
+    元の画像フォルダが変わっておらず、必要な大きさがそろっていれば何もしない。
+    作り直すときは、前に作った大きさも含めて作る（デコードは1回で済む）。
+    """
+    path = os.path.join(root, os.path.basename(os.path.normpath(img_folder)))
+    stamp = source_stamp(img_folder)
+    sizes = [tuple(s) for s in sizes]
+    done = read_success(path)
+    if done is not None:
+        built = [tuple(s) for s in done.get("sizes", [])]
+        if done.get("source") == stamp and all(s in built for s in sizes):
+            return path
+        sizes += [s for s in built if s not in sizes]
+
+    index = list_images(img_folder)
+    tmp_path = path.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    arrays = [np.lib.format.open_memmap(os.path.join(tmp_path, frames_file(s)), mode="w+",
+                                        dtype=np.uint8, shape=(len(index),) + s + (3,))
+              for s in sizes]
+    ok = np.zeros(len(index), dtype=bool)
+    paths = [os.path.join(img_folder, f) for f in index['filename']]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, frames in enumerate(pool.map(lambda p: decode(p, sizes), paths)):
+            if frames is not None:
+                for array, frame in zip(arrays, frames):
+                    array[i] = frame
+                ok[i] = True
+
+    if not ok.all():
+        # 読めなかった画像は詰めて、frames と index の並びを揃える
+        for k, s in enumerate(sizes):
+            compact = np.lib.format.open_memmap(os.path.join(tmp_path, "compact.npy"), mode="w+",
+                                                dtype=np.uint8, shape=(int(ok.sum()),) + s + (3,))
+            compact[:] = arrays[k][ok]
+            compact.flush()
+            del compact
+            arrays[k] = None
+            os.replace(os.path.join(tmp_path, "compact.npy"), os.path.join(tmp_path, frames_file(s)))
+        index = index[ok].reset_index(drop=True)
+    for array in arrays:
+        if array is not None:
+            array.flush()
+    del arrays
+
+    index.to_parquet(os.path.join(tmp_path, INDEX), index=False)
+    with open(os.path.join(tmp_path, SUCCESS), "w", encoding="utf-8") as f:
+        json.dump({"source": stamp, "rows": len(index), "sizes": [list(s) for s in sizes]}, f)
+    os.makedirs(root, exist_ok=True)
+    replace_dir(tmp_path, path)
+    return path
+
+
+class DayFrames:
+    """1日分の画像（大きさごとの memmap）と、その並びの filename / img_time"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index = pd.read_parquet(os.path.join(path, INDEX))
+        self.times = self.index['img_time'].to_numpy()
+        self.sizes = [tuple(s) for s in (read_success(path) or {}).get("sizes", [])]
+        self._frames = {}
+        self._rows = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def frames(self, size=FRAME_SIZE):
+        size = tuple(size)
+        if size not in self._frames:
+            if size not in self.sizes:
+                raise KeyError(f"{self.path} に {size[0]}x{size[1]} の画像はありません"
+                               f"（python frame_store.py build で --sizes に足してください）")
+            self._frames[size] = np.load(os.path.join(self.path, frames_file(size)), mmap_mode="r")
+        return self._frames[size]
+
+    def rows(self, filenames):
+        """ファイル名に対応する行番号（なければ -1）"""
+        if self._rows is None:
+            self._rows = {f: i for i, f in enumerate(self.index['filename'])}
+        return np.array([self._rows.get(f, -1) for f in filenames], dtype=np.int64)
+
+    def slice(self, start=None, end=None, size=FRAME_SIZE):
+        """[start, end) の時刻範囲の (画像のビュー, index) を返す（コピーしない）"""
+        lo = 0 if start is None else np.searchsorted(self.times, np.datetime64(pd.Timestamp(start)), "left")
+        hi = len(self) if end is None else np.searchsorted(self.times, np.datetime64(pd.Timestamp(end)), "left")
+        return self.frames(size)[lo:hi], self.index.iloc[lo:hi]
+
+
+def open_day(date_str, root=FRAME_STORE_DIR):
+    """root/YYYYMMDD/ が完成していれば DayFrames、なければ None"""
+    path = os.path.join(root, date_str)
+    if read_success(path) is None:
+        return None
+    return DayFrames(path)
+
+
+class FrameStore:
+    """日付ごとの DayFrames をまとめて、時刻の範囲や画像のパスで引けるようにする"""
+
+    def __init__(self, root=FRAME_STORE_DIR):
+        self.root = root
+        self.days = {}
+
+    def day(self, date_str):
+        # 必要になった日だけを開く。まだ作られていない日は毎回確かめる（あとから作られることがある）
+        if self.days.get(date_str) is None:
+            self.days[date_str] = open_day(date_str, self.root)
+        return self.days[date_str]
+
+    def iter_slices(self, start, end, size=FRAME_SIZE):
+        """[start, end) にかかる日ごとの (画像のビュー, index) を順に返す"""
+        for date in pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end), freq="D"):
+            day = self.day(date.strftime("%Y%m%d"))
+            if day is not None and tuple(size) in day.sizes:
+                frames, index = day.slice(start, end, size)
+                if len(index):
+                    yield frames, index
+
+    def lookup(self, img_paths, size=FRAME_SIZE):
+        """画像のパス（…/YYYYMMDD/ファイル名）から (画像 (N, H, W, 3) uint8, 見つかったかどうか (N,))"""
+        frames = np.zeros((len(img_paths),) + tuple(size) + (3,), dtype=np.uint8)
+        found = np.zeros(len(img_paths), dtype=bool)
+        by_day = {}
+        for i, p in enumerate(img_paths):
+            by_day.setdefault(os.path.basename(os.path.dirname(os.path.abspath(p))), []).append(i)
+        for date_str, idx in by_day.items():
+            day = self.day(date_str)
+            if day is None or tuple(size) not in day.sizes:
+                continue
+            rows = day.rows([os.path.basename(img_paths[i]) for i in idx])
+            hit = rows >= 0
+            idx = np.asarray(idx)[hit]
+            frames[idx] = day.frames(size)[rows[hit]]
+            found[idx] = True
+        return frames, found
+
+
+def bench(img_folder, root):
+    """1日分について、JPEG を毎回読む場合と frame_store から読む場合を比べる"""
+    import time
+
+    from feature_extractor import IMG_SIZE, load_image
+
+    paths = [os.path.join(img_folder, f) for f in list_images(img_folder)['filename']]
+    if not paths:
+        print(f"画像がありません: {img_folder}")
+        return
+
+    t0 = time.perf_counter()
+    build_day(img_folder, root)
+    t_build = time.perf_counter() - t0
+
+    store = FrameStore(root)
+    for size in (IMG_SIZE, FRAME_SIZE):
+        t0 = time.perf_counter()
+        per_file = [load_image(p, size) for p in paths]
+        t_files = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        frames, found = store.lookup(paths, size)
+        t_lookup = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        day = store.day(os.path.basename(os.path.normpath(img_folder)))
+        view, _ = day.slice(size=size)
+        checksum = int(view[:, 0, 0, 0].sum())  # ビューを実際に触る
+        t_slice = time.perf_counter() - t0
+
+        # 読めない画像は frame_store にも入っていないこと
+        same = all((not hit) if img is None else (hit and np.array_equal(img.astype(np.uint8), f))
+                   for img, f, hit in zip(per_file, frames, found))
+        print(f"[{size[0]}x{size[1]}] {len(paths)} 枚")
+        print(f"  画像ファイルを1枚ずつ読む : {t_files * 1000:9.1f} ms")
+        print(f"  frame_store（パスで引く） : {t_lookup * 1000:9.1f} ms")
+        print(f"  frame_store（時刻で切る） : {t_slice * 1000:9.3f} ms（checksum {checksum}）")
+        print(f"  同じ値か: {'✅' if same else '❌'}")
+    print(f"作成（{len(FRAME_SIZES)} 種類の大きさ。作成済みなら確かめるだけ）: {t_build * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from tqdm import tqdm
+
+    parser = argparse.ArgumentParser(description="日付ごとの画像の配列を作る・測る")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("img_dir", help="build: YYYYMMDD サブフォルダのある画像フォルダ / bench: 1日分の画像フォルダ")
+    parser.add_argument("root", nargs="?", default=FRAME_STORE_DIR)
+    parser.add_argument("--sizes", default=",".join(str(s[0]) for s in FRAME_SIZES),
+                        help="作る大きさ（正方形の1辺、カンマ区切り）")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.img_dir, args.root)
+    else:
+        sizes = [(int(s), int(s)) for s in args.sizes.split(",")]
+        days = sorted(d for d in os.listdir(args.img_dir)
+                      if os.path.isdir(os.path.join(args.img_dir, d)))
+        for d in tqdm(days, desc="画像の縮小"):
+            build_day(os.path.join(args.img_dir, d), args.root, sizes, args.workers)
+        print(f"✅ {len(days)}日分を {args.root} に書き出しました。")
@@ -1,29 +1,120 @@
 # label_attach.py
 
 import os
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from weather_store import COLUMNS, WeatherStore
 
 def get_image_timestamp(filename):
     base = os.path.splitext(filename)[0]
     return datetime.strptime(base, '%Y%m%d%H%M')
 
-def label_images(image_folder, weather_csv, mode='A', save_dir=None):
+# 画像を割り当てる時間窓（天気の時刻 t からの相対。両端を含む）
+WINDOWS = {
+    'A': (timedelta(minutes=0), timedelta(minutes=9)),   # [t, t+9分]
+    'B': (timedelta(minutes=-5), timedelta(minutes=4)),  # [t-5分, t+4分]
+}
+
+LABEL_COLUMNS = ['filename', 'img_time', 'label_time', 'temperature', 'humidity', 'pressure']
+
+
+def window_join(times, starts, ends):
+    """昇順の times について、各窓 [starts[k], ends[k]] に入る添字を
+    (窓の番号, times の添字) の組として窓順・時刻順に返す"""
+    lo = np.searchsorted(times, starts, side='left')
+    hi = np.searchsorted(times, ends, side='right')
+    counts = np.maximum(hi - lo, 0)
+    window_idx = np.repeat(np.arange(len(starts)), counts)
+    # 窓ごとの連番 0,1,2,... に各窓の先頭 lo を足すと times の添字になる
+    offsets = np.cumsum(counts) - counts
+    time_idx = np.arange(counts.sum()) - np.repeat(offsets, counts) + np.repeat(lo, counts)
+    return window_idx, time_idx
+
+
+def label_rows(df_weather, df_images, mode='A', windows=WINDOWS):
+    """天気の各行の時間窓に入る画像を並べたラベル表を作る（天気の行順、その中は画像の時刻順）"""
+    if mode not in windows:
+        raise ValueError(f"mode must be one of {', '.join(windows)}")
+    before, after = windows[mode]
+
+    # 画像はファイル名（= 時刻）順。同じ時刻の画像はファイル名順のまま残す
+    img_time = pd.to_datetime(df_images['img_time'])
+    order = np.argsort(img_time.to_numpy(), kind='stable')
+    img_times = img_time.to_numpy()[order]
+    wt = df_weather['timestamp']
+    w_idx, i_idx = window_join(img_times, (wt + before).to_numpy(), (wt + after).to_numpy())
+    i_idx = order[i_idx]
+
+    def weather_column(name):
+        if name not in df_weather:
+            return None
+        return df_weather[name].to_numpy()[w_idx]
+
+    return pd.DataFrame({
+        'filename': df_images['filename'].to_numpy()[i_idx],
+        'img_time': img_time.iloc[i_idx].dt.strftime('%Y-%m-%d %H:%M').to_numpy(),
+        'label_time': wt.iloc[w_idx].dt.strftime('%Y-%m-%d %H:%M').to_numpy(),
+        'temperature': weather_column('気温 (℃)'),
+        'humidity': weather_column('相対湿度 (%)'),
+        'pressure': None  # 気圧があれば追加可能
+    }, columns=LABEL_COLUMNS)
+
+
+def parse_window(spec):
+    """'C=-10:10' のような指定を ('C', (-10分, +10分)) にする"""
+    name, _, span = spec.partition('=')
+    start, _, end = span.partition(':')
     try:
-        df_weather = pd.read_csv(weather_csv, encoding='cp932')
-    except Exception as e:
-        print(f"[×] CSV読込エラー: {weather_csv} -> {e}")
-        return
+        window = (timedelta(minutes=float(start)), timedelta(minutes=float(end)))
+    except ValueError:
+        raise ValueError(f"時間窓の指定が読めません: {spec}（例: C=-10:10）")
+    if not name or window[0] > window[1]:
+        raise ValueError(f"時間窓の指定が読めません: {spec}（例: C=-10:10）")
+    return name, window
+
+
+def output_csv(save_dir, mode, date_str):
+    return os.path.join(save_dir, f"{mode}_model_{date_str}.csv")
+
+
+def read_weather_store(weather_store, date_str):
+    """weather_store（weather_store.py）から1日分を読み、CSV と同じ列名の表にする"""
+    day = pd.Timestamp(date_str)
+    df_weather = WeatherStore(weather_store).query(day, day + timedelta(days=1))
+    if df_weather.empty:
+        print(f"[×] 天気ストアにデータなし: {date_str}")
+        return None
+    return df_weather.rename(columns={v: k for k, v in COLUMNS.items()}).reset_index()
+
+
+def read_day(image_folder, weather_csv, weather_store=None):
+    """1日分の天気と画像一覧を読む。読めなければ None
 
+    weather_store を渡すと、CSV を読み直さずに型付きのストアから天気を取る
+    （値は float32 になり、'--' などの記号は NaN として空欄で出力される）。
+    """
     date_str = os.path.basename(weather_csv)[:8]
-    try:
-        df_weather['timestamp'] = pd.to_datetime(
-            df_weather['時分'].apply(lambda t: date_str + ' ' + t),
-            format='%Y%m%d %H:%M'
-        )
-    except Exception as e:
-        print(f"[×] '時分'列の変換失敗: {weather_csv} -> {e}")
-        return
+    if weather_store is not None:
+        df_weather = read_weather_store(weather_store, date_str)
+        if df_weather is None:
+            return None
+    else:
+        try:
+            df_weather = pd.read_csv(weather_csv, encoding='cp932')
+        except Exception as e:
+            print(f"[×] CSV読込エラー: {weather_csv} -> {e}")
+            return None
+
+        try:
+            df_weather['timestamp'] = pd.to_datetime(
+                date_str + ' ' + df_weather['時分'],
+                format='%Y%m%d %H:%M'
+            )
+        except Exception as e:
+            print(f"[×] '時分'列の変換失敗: {weather_csv} -> {e}")
+            return None
 
     try:
         image_files = sorted([
@@ -35,20 +126,102 @@ def label_images(image_folder, weather_csv, mode='A', save_dir=None):
         })
     except Exception as e:
         print(f"[×] 画像フォルダ読込失敗: {image_folder} -> {e}")
-        return
+        return None
+    return df_weather, df_images
+
+
+def label_day(image_folder, weather_csv, modes=('A', 'B'), save_dir=None, windows=WINDOWS,
+              weather_store=None):
+    """1日分の入力を1回だけ読み、まだ出力のない各モードのラベル CSV を書く。
+
+    書き出しは一時ファイルから置き換えるので、途中で止まっても「済み」とは扱われない。
+    """
+    date_str = os.path.basename(weather_csv)[:8]
+    modes = [m for m in modes if not os.path.exists(output_csv(save_dir, m, date_str))]
+    if not modes:
+        return 0
+
+    day = read_day(image_folder, weather_csv, weather_store)
+    if day is None:
+        return 0
+    df_weather, df_images = day
+
+    written = 0
+    os.makedirs(save_dir, exist_ok=True)
+    for mode in modes:
+        labeled = label_rows(df_weather, df_images, mode, windows)
+        if labeled.empty:
+            print(f"[△] {date_str} - mode {mode}：ラベル付け対象なし")
+            continue
+
+        output_path = output_csv(save_dir, mode, date_str)
+        labeled.to_csv(output_path + '.tmp', index=False, encoding='utf-8-sig')
+        os.replace(output_path + '.tmp', output_path)
+        written += 1
+        print(f"[✔] {date_str} - mode {mode}: {len(labeled)}件 → {output_path}")
+    return written
 
+
+def label_images(image_folder, weather_csv, mode='A', save_dir=None):
+    label_day(image_folder, weather_csv, modes=[mode], save_dir=save_dir)
+
+
+def find_days(img_root, weather_root, output_root, modes, weather_store=None):
+    """(画像フォルダ, 天気 CSV) のうち、まだ出力のそろっていない日を返す"""
+    store = WeatherStore(weather_store) if weather_store is not None else None
+    days = []
+    for folder_name in sorted(os.listdir(img_root)):
+        if not folder_name.isdigit() or len(folder_name) != 8:
+            continue
+
+        image_folder = os.path.join(img_root, folder_name)
+        weather_csv = os.path.join(weather_root, f"{folder_name}.csv")
+
+        if not os.path.isdir(image_folder):
+            print(f"[×] 画像フォルダなし: {image_folder}")
+            continue
+        if store is not None:
+            if not store.has_day(folder_name):
+                print(f"[×] 天気ストアにデータなし: {folder_name}")
+                continue
+        elif not os.path.exists(weather_csv):
+            print(f"[×] 天気CSVなし: {weather_csv}")
+            continue
+        if all(os.path.exists(output_csv(output_root, m, folder_name)) for m in modes):
+            print(f"[→] {folder_name} - mode {'/'.join(modes)}: 既に存在、スキップ")
+            continue
+        days.append((image_folder, weather_csv))
+    return days
+
+
+def label_all(img_root, weather_root, output_root, modes=('A', 'B'), windows=WINDOWS,
+              workers=None, weather_store=None):
+    """日付フォルダごとの処理をプロセスプールで並列に行う"""
+    os.makedirs(output_root, exist_ok=True)
+    days = find_days(img_root, weather_root, output_root, modes, weather_store)
+    if workers == 1:
+        return sum(label_day(img, csv, modes, output_root, windows, weather_store)
+                   for img, csv in days)
+
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(label_day, img, csv, modes, output_root, windows, weather_store)
+                   for img, csv in days]
+        for (img, csv), future in zip(days, futures):
+            try:
+                written += future.result()
+            except Exception as e:
+                print(f"[×] {os.path.basename(csv)[:8]} の処理に失敗しました: {e}")
+    return written
+
+
+def label_rows_iterrows(df_weather, df_images, mode='A'):
+    """以前の1行ずつの実装（label_rows と結果が同じか確かめるためだけに残している）"""
     labeled = []
     for _, w in df_weather.iterrows():
         wt = w['timestamp']
-        if mode == 'A':
-            start, end = wt, wt + timedelta(minutes=9)
-        elif mode == 'B':
-            start, end = wt - timedelta(minutes=5), wt + timedelta(minutes=4)
-        else:
-            raise ValueError("mode must be 'A' or 'B'")
-
+        start, end = wt + WINDOWS[mode][0], wt + WINDOWS[mode][1]
         subset = df_images[(df_images['img_time'] >= start) & (df_images['img_time'] <= end)]
-
         for _, img in subset.iterrows():
             labeled.append({
                 'filename': img['filename'],
@@ -56,52 +229,82 @@ def label_images(image_folder, weather_csv, mode='A', save_dir=None):
                 'label_time': wt.strftime('%Y-%m-%d %H:%M'),
                 'temperature': w.get('気温 (℃)', None),
                 'humidity': w.get('相対湿度 (%)', None),
-                'pressure': None  # 気圧があれば追加可能
+                'pressure': None
             })
+    return pd.DataFrame(labeled)
 
-    if not labeled:
-        print(f"[△] {date_str} - mode {mode}：ラベル付け対象なし")
-        return
 
-    os.makedirs(save_dir, exist_ok=True)
-    output_path = os.path.join(save_dir, f"{mode}_model_{date_str}.csv")
-    pd.DataFrame(labeled).to_csv(output_path, index=False, encoding='utf-8-sig')
+def bench(n_images=5000, seed=0):
+    """1日分の合成データで、旧実装と CSV が一致するかと処理時間を比べる"""
+    import time
+    rng = np.random.default_rng(seed)
+    date_str = '20250701'
+    day = pd.Timestamp(date_str)
+
+    # 気象庁の10分値と同じ形（欠測の '--' や文字の混じった列もある）
+    times = pd.date_range(day + timedelta(minutes=10), periods=144, freq='10min')
+    temperature = np.round(rng.normal(25, 3, len(times)), 1).astype(object)
+    temperature[rng.choice(len(times), 5, replace=False)] = '--'
+    df_weather = pd.DataFrame({
+        '時分': [t.strftime('%H:%M') if t.day == day.day else '24:00' for t in times],
+        '気温 (℃)': temperature,
+        '相対湿度 (%)': rng.integers(40, 100, len(times)),
+    })
+    df_weather['timestamp'] = times
+
+    # 1分ごとの撮影時刻に、同じ時刻の .jpg / .png が並ぶこともある
+    minutes = np.sort(rng.integers(0, 24 * 60, n_images))
+    image_files = sorted({(day + timedelta(minutes=int(m))).strftime('%Y%m%d%H%M') + ext
+                          for m, ext in zip(minutes, rng.choice(['.jpg', '.png'], n_images))})
+    df_images = pd.DataFrame({
+        'filename': image_files,
+        'img_time': [get_image_timestamp(f) for f in image_files]
+    })
 
-    print(f"[✔] {date_str} - mode {mode}: {len(labeled)}件 → {output_path}")
+    print(f"天気 {len(df_weather)}行, 画像 {len(df_images)}枚")
+    for mode in WINDOWS:
+        t0 = time.perf_counter()
+        old = label_rows_iterrows(df_weather, df_images, mode)
+        t_old = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = label_rows(df_weather, df_images, mode)
+        t_new = time.perf_counter() - t0
+        assert old.to_csv(index=False) == new.to_csv(index=False), f"mode {mode}: CSV が一致しません"
+        print(f"mode {mode}: {len(new)}件  iterrows {t_old * 1000:8.1f} ms  "
+              f"searchsorted {t_new * 1000:7.1f} ms  ({t_old / t_new:5.0f}倍)")
 
 
 if __name__ == '__main__':
+    import argparse
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        # 旧実装との一致確認とベンチマーク: python label_attach.py bench [画像枚数]
+        bench(int(sys.argv[2]) if len(sys.argv) > 2 else 5000)
+        sys.exit(0)
+
     # パス設定
     img_root = r'\\150.89.226.195\Private\6期生\小畑\img_data'
     weather_root = r'\\150.89.226.195\Private\7期生\西山\weather_data'
     output_root = r'\\150.89.226.195\Private\7期生\西山\Attached_WeatherData'
 
-    os.makedirs(output_root, exist_ok=True)
+    # 例: python label_attach.py --workers 8 --window C=-10:10 --modes A B C
+    parser = argparse.ArgumentParser(description="画像に10分値の天気ラベルを付ける")
+    parser.add_argument('--modes', nargs='+', default=['A', 'B'], help="出力するモード")
+    parser.add_argument('--window', action='append', default=[], metavar='NAME=START:END',
+                        help="追加の時間窓（天気の時刻からの分。両端を含む）")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="並列に処理するプロセス数（既定は CPU の数）")
+    parser.add_argument('--weather-store', default=None,
+                        help="日ごとの CSV の代わりに使う天気ストア（weather_store.py）")
+    args = parser.parse_args()
 
-    for folder_name in sorted(os.listdir(img_root)):
-        if not folder_name.isdigit() or len(folder_name) != 8:
-            continue
-
-        image_folder = os.path.join(img_root, folder_name)
-        weather_csv = os.path.join(weather_root, f"{folder_name}.csv")
-
-        if not os.path.exists(image_folder):
-            print(f"[×] 画像フォルダなし: {image_folder}")
-            continue
-        if not os.path.exists(weather_csv):
-            print(f"[×] 天気CSVなし: {weather_csv}")
-            continue
+    windows = dict(WINDOWS)
+    windows.update(parse_window(spec) for spec in args.window)
+    for mode in args.modes:
+        if mode not in windows:
+            parser.error(f"mode {mode} の時間窓がありません（--window {mode}=START:END で指定）")
 
-        # Aモードの出力CSVが存在するか？
-        a_output_csv = os.path.join(output_root, f"A_model_{folder_name}.csv")
-        if os.path.exists(a_output_csv):
-            print(f"[→] {folder_name} - mode A: 既に存在、スキップ")
-        else:
-            label_images(image_folder, weather_csv, mode='A', save_dir=output_root)
-
-        # Bモードの出力CSVが存在するか？
-        b_output_csv = os.path.join(output_root, f"B_model_{folder_name}.csv")
-        if os.path.exists(b_output_csv):
-            print(f"[→] {folder_name} - mode B: 既に存在、スキップ")
-        else:
-            label_images(image_folder, weather_csv, mode='B', save_dir=output_root)
+    written = label_all(img_root, weather_root, output_root, args.modes, windows, args.workers,
+                        args.weather_store)
+    print(f"\n✅ 完了：{written}件の CSV を書き出しました。")
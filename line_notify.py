@@ -0,0 +1,266 @@
+# line_notify.py
+#
+# LINE 通知をリクエスト処理から切り離して送るためのディスパッチャ。
+# /generate はキューに積むだけで返り、送信はバックグラウンドのワーカーが行う。
+#   - 宛先は multicast で最大500件ずつまとめて送る（1件だけなら push）
+#   - HTTP セッションは1つを使い回す（コネクションプール）
+#   - 429 / 5xx は指数バックオフで再送する（Retry-After があればそれに従う）
+#
+#   python line_notify.py --selftest    ローカルの HTTP サーバーで動作確認
+
+import argparse
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+LINE_API_BASE = "https://api.line.me/v2/bot/message"
+MULTICAST_MAX = 500  # LINE multicast の1回あたり宛先上限
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def chunks(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class LineNotifier:
+    def __init__(self, token, api_base=LINE_API_BASE, workers=4, queue_size=1000,
+                 timeout=5.0, max_retries=4, backoff=0.5):
+        self.token = token
+        self.api_base = api_base.rstrip("/")
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}"
+        })
+
+    # --------------------
+    # 受付（リクエスト処理側）
+    # --------------------
+    def submit(self, user_ids, message):
+        """送信をキューに積むだけで返る。キューが一杯なら待たずに諦める
+
+        user_ids は宛先の並びか、宛先リストを少しずつ返す iterable（iter_batches など）。
+        実際に読み出すのは送信ワーカー側なので、宛先が多くても呼び出し側は待たない。
+        """
+        self._start()
+        try:
+            self.queue.put_nowait((user_ids, message))
+            return True
+        except queue.Full:
+            logger.error("LINE通知キューが一杯のため破棄しました")
+            return False
+
+    def _start(self):
+        # gunicorn の fork 後に各ワーカープロセスで初めて使われたときに起動する
+        with self.lock:
+            if self.threads:
+                return
+            for n in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"line-notify-{n}", daemon=True)
+                t.start()
+                self.threads.append(t)
+
+    def join(self):
+        """キューに積んだ分がすべて送り終わるまで待つ"""
+        self.queue.join()
+
+    # --------------------
+    # 送信（ワーカー側）
+    # --------------------
+    def _worker(self):
+        while True:
+            user_ids, message = self.queue.get()
+            try:
+                for batch in self._batches(user_ids):
+                    self.send(batch, message)
+            except Exception as e:
+                logger.error(f"LINE通知失敗: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _batches(self, user_ids):
+        # 宛先リストのまとまりが渡されたときは、まとまりごとに multicast 上限で切り直す
+        items = iter(user_ids)
+        first = next(items, None)
+        if first is None:
+            return
+        items = itertools.chain([first], items)
+        if isinstance(first, (list, tuple)):
+            for group in items:
+                yield from chunks(group, MULTICAST_MAX)
+        else:
+            yield from chunks(items, MULTICAST_MAX)
+
+    def send(self, user_ids, message):
+        messages = [{"type": "text", "text": message}]
+        if len(user_ids) == 1:
+            url = f"{self.api_base}/push"
+            payload = {"to": user_ids[0], "messages": messages}
+        else:
+            url = f"{self.api_base}/multicast"
+            payload = {"to": list(user_ids), "messages": messages}
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                res = self.session.post(url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                res = None
+                error = str(e)
+            else:
+                if res.status_code == 200:
+                    return True
+                error = res.text
+                if res.status_code not in RETRY_STATUS:
+                    break
+
+            if attempt < self.max_retries:
+                time.sleep(self._retry_delay(res, attempt))
+
+        logger.error(f"LINE通知失敗: {error}")
+        return False
+
+    def _retry_delay(self, res, attempt):
+        # Retry-After があればそれに従い、なければ指数バックオフ
+        if res is not None:
+            retry_after = res.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+
+def selftest():
+    """ローカルの HTTP サーバーを LINE API の代わりにして、宛先の分け方と再送を確かめる"""
+    import json
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received = []   # (エンドポイント, 宛先, 本文)
+    attempts = {}   # 本文 → 届いた回数
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            text = body["messages"][0]["text"]
+            with lock:
+                attempts[text] = attempts.get(text, 0) + 1
+                n = attempts[text]
+            if text == "混雑" and n == 1:
+                # 最初の1回だけ 429 を返し、1秒後に来るよう指示する
+                status, headers = 429, {"Retry-After": "1"}
+            elif text == "障害" or (text == "一時障害" and n == 1):
+                status, headers = 500, {}
+            else:
+                status, headers = 200, {}
+            if status == 200:
+                with lock:
+                    received.append((self.path.rsplit("/", 1)[-1], body["to"], text))
+            data = b"{}"
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    notifier = LineNotifier("dummy", api_base=f"http://127.0.0.1:{server.server_port}",
+                            workers=1, max_retries=2, backoff=0.01)
+
+    def sent(text):
+        return [(endpoint, to) for endpoint, to, t in received if t == text]
+
+    def sizes(text):
+        return [len(to) if endpoint == "multicast" else 1 for endpoint, to in sent(text)]
+
+    # 宛先は500件ずつの multicast に分ける
+    notifier.submit([f"U{i}" for i in range(1201)], "一斉")
+    notifier.join()
+    assert sizes("一斉") == [500, 500, 201], sizes("一斉")
+    assert all(endpoint == "multicast" for endpoint, _ in sent("一斉"))
+    assert [u for _, to in sent("一斉") for u in to] == [f"U{i}" for i in range(1201)]
+
+    # 宛先リストのまとまりを渡したときは、まとまりごとに500件で切り直す
+    groups = iter([[f"A{i}" for i in range(700)], [f"B{i}" for i in range(501)]])
+    notifier.submit(groups, "分割")
+    notifier.join()
+    assert sizes("分割") == [500, 200, 500, 1], sizes("分割")
+    assert sent("分割")[-1] == ("push", "B500")
+
+    # 宛先が1件なら push
+    notifier.submit(["U1"], "ひとり")
+    notifier.join()
+    assert sent("ひとり") == [("push", "U1")], sent("ひとり")
+
+    # 429 は Retry-After の秒数だけ待ってから、5xx は指数バックオフで送り直す
+    t0 = time.perf_counter()
+    notifier.submit(["U1", "U2"], "混雑")
+    notifier.join()
+    waited = time.perf_counter() - t0
+    assert attempts["混雑"] == 2 and len(sent("混雑")) == 1, attempts
+    assert waited >= 1.0, waited
+    notifier.submit(["U1"], "一時障害")
+    notifier.join()
+    assert attempts["一時障害"] == 2 and len(sent("一時障害")) == 1, attempts
+
+    # 失敗し続ける送信は max_retries 回送り直したら諦める。ワーカーは止まらずに次を送る
+    logger.disabled = True  # わざと失敗させるので、エラーのログは出さない
+    try:
+        notifier.submit(["U1"], "障害")
+
+        def broken():
+            yield ["U1"]
+            raise RuntimeError("宛先の読み出しに失敗")
+
+        notifier.submit(broken(), "途中で失敗")
+        notifier.submit(["U1"], "その後")
+        notifier.join()
+    finally:
+        logger.disabled = False
+    assert attempts["障害"] == 1 + notifier.max_retries and not sent("障害"), attempts
+    assert sent("途中で失敗") == [("push", "U1")]
+    assert sent("その後") == [("push", "U1")]
+    assert len(notifier.threads) == 1 and notifier.threads[0].is_alive()
+
+    server.shutdown()
+    print(f"✅ 動作確認 OK（500件ずつの multicast / push / 429・5xx の再送"
+          f"（Retry-After {waited:.1f} 秒待機）/ 諦めたあともワーカーが動き続けることを確認）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LINE 通知のディスパッチャ")
+    parser.add_argument("--selftest", action="store_true", help="ローカルの HTTP サーバーで動作確認する")
+    args = parser.parse_args()
+
+    if args.selftest:
+        selftest()
+    else:
+        parser.print_help()
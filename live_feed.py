@@ -0,0 +1,328 @@
+# live_feed.py
+#
+# /logs/stream（Server-Sent Events）で新しい記録を見ている人に届けるための配信役。
+#   - ログストアの末尾を見張るスレッドが1本だけあり、新しい記録を見つけたら全購読者に配る
+#     （他の gunicorn ワーカーが書いた記録も拾える。自分のワーカーで書いたときは notify() ですぐ起こす）
+#   - 購読者ごとに上限つきのキューを持ち、あふれた購読者には "reload" を送って切る
+#     （遅い閲覧者のせいで書き込み側が待たされることはない）
+#   - 購読者は after（/logs のページに描いた最新の記録）より後の記録だけを受け取る。
+#     誰も見ていない間は読み進めないので、最初の購読者の after から読み始める
+#
+# /logs/stream の接続は開いている間ずっとリクエストワーカー（gunicorn のスレッド）を1つ使う。
+#   python live_feed.py [同時接続数] [記録数] [ワーカーのスレッド数]   HTTP 越しの負荷テスト
+
+import json
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+RELOAD = object()  # キューがあふれたときの合図
+
+
+def matches(log, filter_color=None, keyword=None, date=None):
+    """load_logs と同じ色・キーワード・日付の条件"""
+    if filter_color and log["color"] != filter_color:
+        return False
+    if keyword and keyword not in log["user_input"]:
+        return False
+    if date and not log["created_at"].startswith(date):
+        return False
+    return True
+
+
+class Subscriber:
+    def __init__(self, filters, buffer_size, after=-1):
+        self.filters = filters
+        self.after = after  # これ以前の記録はページに載っているので送らない
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.overflowed = False
+
+    def offer(self, log):
+        if self.overflowed or log["offset"] <= self.after or not matches(log, **self.filters):
+            return
+        try:
+            self.queue.put_nowait(log)
+        except queue.Full:
+            # 遅すぎる購読者は取りこぼすので、読み直してもらう
+            self.overflowed = True
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(RELOAD)
+
+
+class LiveFeed:
+    def __init__(self, log_store, buffer_size=100, poll_interval=1.0, heartbeat=15.0):
+        self.log_store = log_store
+        self.buffer_size = buffer_size
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.subscribers = set()
+        self.thread = None
+        self.last_offset = None
+
+    # --------------------
+    # 配信
+    # --------------------
+    def notify(self):
+        """記録を書いた直後に呼ぶと、見張りスレッドがすぐに読みに行く"""
+        self.wakeup.set()
+
+    def _start(self):
+        # fork 後の各ワーカーで最初の購読者が来たときに起動する
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._watch, name="live-feed", daemon=True)
+            self.thread.start()
+
+    def _watch(self):
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            # 読んで配る間は購読の出入りを待たせる（読み始めの位置がずれないように）
+            with self.lock:
+                if not self.subscribers:
+                    continue
+                try:
+                    for log in self.log_store.logs_after(self.last_offset):
+                        self.last_offset = log["offset"]
+                        for subscriber in self.subscribers:
+                            subscriber.offer(log)
+                except Exception as e:
+                    logger.error(f"ライブ配信の読み込み失敗: {e}")
+
+    # --------------------
+    # 購読（/logs/stream）
+    # --------------------
+    def subscribe(self, filter_color=None, keyword=None, date=None, after=None):
+        """after はページに描いた最新の記録のオフセット。なければ今の最新の記録から"""
+        with self.lock:
+            self._start()
+            latest = self.log_store.latest_offset()
+            after = latest if after is None else min(after, latest)
+            subscriber = Subscriber(
+                {"filter_color": filter_color, "keyword": keyword, "date": date},
+                self.buffer_size, after
+            )
+            if not self.subscribers:
+                # 誰も見ていない間に書かれた記録は読み飛ばす（ページにもう載っている）
+                self.last_offset = after
+            elif after < self.last_offset:
+                # ページを描いてから接続するまでに他の購読者へ配った分は、ここで送る
+                for log in self.log_store.logs_after(after):
+                    if log["offset"] > self.last_offset:
+                        break
+                    subscriber.offer(log)
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def stream(self, subscriber):
+        """SSE のテキストを少しずつ返すジェネレーター（切断時に購読を外す）"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    log = subscriber.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # 接続が生きているかの確認も兼ねたコメント行
+                    yield ": ping\n\n"
+                    continue
+                if log is RELOAD:
+                    yield "event: reload\ndata: {}\n\n"
+                    return
+                # id はブラウザが再接続するときに Last-Event-ID として送り返す
+                yield f"id: {log['offset']}\ndata: {json.dumps(log, ensure_ascii=False)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+class _PooledWSGIServer:
+    """負荷テスト用: gunicorn の gthread のように、同時に処理できるリクエストが slots 個のサーバー"""
+
+    def __init__(self, app, slots):
+        from concurrent.futures import ThreadPoolExecutor
+        from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+        class Handler(WSGIRequestHandler):
+            protocol_version = "HTTP/1.0"  # keep-alive でワーカーを持ち続けないように
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        pool = ThreadPoolExecutor(slots)
+        self.busy = 0
+        busy_lock = threading.Lock()
+        outer = self
+
+        class Server(BaseWSGIServer):
+            def process_request(self, request, client_address):
+                pool.submit(self._handle, request, client_address)
+
+            def _handle(self, request, client_address):
+                with busy_lock:
+                    outer.busy += 1
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+                    with busy_lock:
+                        outer.busy -= 1
+
+        self.server = Server("127.0.0.1", 0, app, handler=Handler)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+if __name__ == "__main__":
+    # 負荷テスト: 実際の main.py のアプリを立て、HTTP 越しに多数の /logs/stream を同時に開いて
+    #   - 誰も見ていない間の記録が、あとから接続した閲覧者に重ねて届かないか
+    #   - 記録が届くまでの時間
+    #   - 開いたままの接続がリクエストワーカーをどれだけふさぐか
+    # を確かめる（gunicorn の代わりに、同時に処理できる数が決まったサーバーで動かす）。
+    #   python live_feed.py [同時接続数] [記録数] [ワーカーのスレッド数]
+    import http.client
+    import os
+    import re
+    import sys
+    import tempfile
+    import time
+    from urllib.parse import urlencode
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    slots = int(sys.argv[3]) if len(sys.argv) > 3 else clients + 4
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    os.chdir(tempfile.mkdtemp())  # logs_local.txt などを一時ディレクトリに作る
+    os.environ["LOG_BACKEND"] = "file"
+    logging.disable(logging.WARNING)
+    import main
+
+    main.live_feed.heartbeat = 1.0  # 切断した接続に早く気づくように
+    server = _PooledWSGIServer(main.app, slots)
+
+    def request(method, path, body=None, timeout=10):
+        conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=timeout)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"} if body else {}
+        conn.request(method, path, body=body, headers=headers)
+        res = conn.getresponse()
+        data = res.read()
+        conn.close()
+        return res.status, data.decode("utf-8")
+
+    sent_at = {}
+
+    def post(color, text):
+        sent_at[text] = time.perf_counter()
+        status, _ = request("POST", "/generate", urlencode({"color": color, "user_input": text}))
+        assert status == 200, status
+
+    def open_stream(params):
+        conn = http.client.HTTPConnection("127.0.0.1", server.port, timeout=30)
+        conn.request("GET", "/logs/stream?" + urlencode(params))
+        res = conn.getresponse()
+        assert res.status == 200 and res.readline() == b"retry: 3000\n"
+        res.readline()
+        return conn, res
+
+    def close_stream(stream):
+        conn, res = stream
+        res.close()
+        conn.close()
+
+    # 一度だれかが見てから閉じ、誰も見ていない間に記録を書く（この分はページに載る）
+    close_stream(open_stream({}))
+    while main.live_feed.subscribers:
+        time.sleep(0.05)
+    for n in range(5):
+        post("blue", f"idle{n}")
+    time.sleep(main.live_feed.poll_interval * 2)
+
+    received = [[] for _ in range(clients)]
+    latencies = []
+    ready = threading.Barrier(clients + 1)
+
+    def client(i):
+        color = "pink" if i % 3 == 0 else None
+        params = {"color": color} if color else {}
+        if i % 2 == 0:
+            # ブラウザと同じく、ページに描いた最新の記録の after を付けて開く
+            _, page = request("GET", "/logs?" + urlencode(params))
+            params["after"] = re.search(r'params\.set\("after", (-?\d+)\)', page).group(1)
+        stream = open_stream(params)
+        res = stream[1]
+        ready.wait()
+        expected = count if color is None else (count + 1) // 2
+        while len(received[i]) < expected:
+            line = res.readline().decode("utf-8")
+            if line.startswith("data: "):
+                text = json.loads(line[6:])["user_input"]
+                received[i].append(text)
+                latencies.append(time.perf_counter() - sent_at[text])
+            elif line.startswith("event: reload") or not line:
+                break
+        close_stream(stream)
+
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    for t in threads:
+        t.start()
+    ready.wait()
+    while server.busy > len(main.live_feed.subscribers):
+        time.sleep(0.01)  # /logs を返し終えたワーカーが空くのを待つ
+    busy_streams = server.busy
+
+    # ワーカーが残っていれば普通のページはすぐ返る。全部ふさがると返らない
+    t0 = time.perf_counter()
+    request("GET", "/")
+    free_latency = time.perf_counter() - t0
+    extra = [open_stream({}) for _ in range(slots - len(main.live_feed.subscribers))]
+    t0 = time.perf_counter()
+    try:
+        request("GET", "/", timeout=2)
+        blocked = None
+    except (TimeoutError, OSError):
+        blocked = time.perf_counter() - t0
+    for stream in extra:
+        close_stream(stream)
+    # 閉じた接続のワーカーは、次の ping を書こうとして切断に気づくまで空かない
+    t0 = time.perf_counter()
+    while server.busy > busy_streams:
+        time.sleep(0.01)
+    release = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for n in range(count):
+        post("pink" if n % 2 == 0 else "blue", f"msg{n}")
+    for t in threads:
+        t.join(timeout=30)
+    elapsed = time.perf_counter() - t0
+
+    for i, texts in enumerate(received):
+        color = "pink" if i % 3 == 0 else None
+        expected = [f"msg{n}" for n in range(count) if color is None or n % 2 == 0]
+        # 誰も見ていない間の idle* は届かず、新しい記録だけが順に1回ずつ届く
+        assert texts == expected, (i, texts[:8])
+
+    latencies.sort()
+    print(f"✅ HTTP の /logs/stream {clients}本 × 記録 {count}件: "
+          f"配信 {sum(map(len, received)):,}件 / {elapsed:.2f}秒（重複・取りこぼしなし）")
+    print(f"   遅延 p50 {latencies[len(latencies) // 2] * 1000:.1f} ms"
+          f" / p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+    print(f"   ワーカー {slots}個のうち {busy_streams}個が開いたままの /logs/stream で使用中。"
+          f"残りがあれば / は {free_latency * 1000:.1f} ms")
+    if blocked is not None:
+        print(f"   全 {slots}個がふさがると / は {blocked:.1f} 秒待っても返らない"
+              f"（開いている /logs のタブの数だけワーカーが要る）")
+    print(f"   タブを閉じてからワーカーが空くまで {release:.1f} 秒（ping の間隔 {main.live_feed.heartbeat:.0f} 秒）")
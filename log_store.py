@@ -0,0 +1,442 @@
+# log_store.py
+#
+# logs_local.txt（タブ区切り・追記のみ）の横にオフセット索引（.idx）を置き、
+# 全件を読み直さずに新しい順・色・日付で記録を取り出すためのストア。
+#
+# 索引ファイルの1行 = 1記録:
+#   開始オフセット \t 終了オフセット \t タイムスタンプ \t 色
+# 同じ開始オフセットの行が複数あるときは後の行を優先する（継続行で記録が伸びた場合）。
+# どのワーカーも同じ新しい記録を見つけるので、追記は排他ロックを取り、
+# ファイルの最後の行より後の記録だけを書く（同じ記録がワーカーの数だけ重ならない）。
+
+import bisect
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows ではロックなし（開発用）
+    fcntl = None
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def normalize_newlines(text):
+    """改行（CRLF / CR）を LF にそろえる（保存する本文とキーワードの両方に使う）"""
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def parse_record(data):
+    """1記録分のバイト列を load_logs と同じ形の dict に変換する"""
+    lines = data.decode("utf-8").split("\n")
+    parts = lines[0].rstrip("\r").split("\t", 3)
+    if len(parts) < 4:
+        return None
+    timestamp, color, emotion_label, user_input = parts
+    for line in lines[1:]:
+        line = line.rstrip("\r")
+        # 空行・壊れたタブ行は従来どおり読み飛ばす
+        if not line or "\t" in line:
+            continue
+        user_input += "\n" + line
+    return {
+        "created_at": timestamp,
+        "color": color,
+        "emotion_label": emotion_label,
+        "user_input": user_input
+    }
+
+
+def is_record_head(line):
+    """タブ3つ以上を含む行 = 新しい記録の先頭行"""
+    return line.count(b"\t") >= 3
+
+
+def iter_file_records(path):
+    """ログファイルを先頭から1記録ずつ読む（索引を使わない・移行用）"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        record = b""
+        for line in f:
+            if is_record_head(line):
+                if record:
+                    log = parse_record(record)
+                    if log is not None:
+                        yield log
+                record = line
+            elif record:
+                # 継続行は直前の記録に含める
+                record += line
+        if record:
+            log = parse_record(record)
+            if log is not None:
+                yield log
+
+
+def lock_file(f, exclusive):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def last_line(f, block_size=4096):
+    """バイナリで開いたファイルの最後の（改行で終わる）行と、ファイルが改行で終わっているかを返す
+
+    末尾から block_size ずつさかのぼって読むので、ファイルが大きくても読む量は最後の行の分だけ。
+    """
+    f.seek(0, os.SEEK_END)
+    pos = f.tell()
+    if pos == 0:
+        return b"", True
+    f.seek(pos - 1)
+    complete = f.read(1) == b"\n"
+    tail = b""
+    while pos > 0:
+        step = min(block_size, pos)
+        pos -= step
+        f.seek(pos)
+        tail = f.read(step) + tail
+        end = tail.rfind(b"\n")
+        if end < 0:
+            continue
+        start = tail.rfind(b"\n", 0, end)
+        if start >= 0 or pos == 0:
+            return tail[start + 1:end + 1], complete
+    return b"", complete
+
+
+class LogWriter:
+    """gunicorn の複数ワーカーから安全に追記するためのライター
+
+    - 書き込みは fcntl の排他ロックを取り、バッファをまとめて1回の write で書く
+      （複数行の記録も他プロセスの記録と混ざらない）
+    - 同じプロセス内で max_delay 秒以内に来た記録はまとめて書く（グループコミット）。
+      max_bytes を超えたらすぐ書く
+    - fsync: "always" = 書くたび / "interval" = fsync_interval 秒に1回まで / "never" = OS任せ
+    write() は自分の記録がファイルに書かれるまで待ってから返る。
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024, max_delay=0.005, fsync="always",
+                 fsync_interval=1.0):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.cond = threading.Condition()
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.queued = 0    # バッファに積んだ記録の通し番号
+        self.written = 0   # ここまでの通し番号はファイルに書き終わった
+        self.flushing = False
+        self.last_fsync = 0.0
+
+    def write(self, data):
+        with self.cond:
+            self.buffer.append(data)
+            self.buffer_bytes += len(data)
+            self.queued += 1
+            seq = self.queued
+            deadline = time.monotonic() + self.max_delay
+            while self.written < seq:
+                if self.flushing:
+                    # 他のスレッドが書いている間に次のまとまりを貯める
+                    self.cond.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if self.buffer_bytes < self.max_bytes and remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                self._flush_locked()
+
+    def flush(self):
+        with self.cond:
+            while self.flushing:
+                self.cond.wait()
+            if self.buffer:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        # バッファを取り出し、書き込み中はロックを外して他のスレッドが積めるようにする
+        data = b"".join(self.buffer)
+        upto = self.queued
+        self.buffer = []
+        self.buffer_bytes = 0
+        self.flushing = True
+        self.cond.release()
+        try:
+            self._write_file(data)
+        finally:
+            self.cond.acquire()
+            self.flushing = False
+            self.written = upto
+            self.cond.notify_all()
+
+    def _write_file(self, data):
+        with open(self.path, "ab") as f:
+            lock_file(f, exclusive=True)
+            try:
+                f.write(data)
+                f.flush()
+                now = time.monotonic()
+                if self.fsync == "always" or (
+                        self.fsync == "interval" and now - self.last_fsync >= self.fsync_interval):
+                    os.fsync(f.fileno())
+                    self.last_fsync = now
+            finally:
+                unlock_file(f)
+
+
+class LogStore:
+    def __init__(self, path, index_path=None, **writer_options):
+        self.path = path
+        self.index_path = index_path or path + ".idx"
+        self.lock = threading.Lock()
+        self.writer = LogWriter(path, **writer_options)
+        # (開始オフセット, 終了オフセット, タイムスタンプ, 色) を古い順に保持
+        self.entries = []
+        self.indexed_end = 0
+        self._load_index()
+        self.refresh()
+
+    # --------------------
+    # 索引の読み込み・追いつき
+    # --------------------
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        latest = {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 4:
+                    continue
+                try:
+                    start, end = int(parts[0]), int(parts[1])
+                except ValueError:
+                    continue
+                latest[start] = (start, end, parts[2], parts[3])
+        self.entries = sorted(latest.values())
+        if self.entries:
+            self.indexed_end = self.entries[-1][1]
+
+        # ログが作り直された・短くなった場合は最初から作り直す
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size < self.indexed_end:
+            self.entries = []
+            self.indexed_end = 0
+            os.remove(self.index_path)
+
+    def refresh(self):
+        """前回索引を付けた位置からファイル末尾までだけを読み、索引に追加する"""
+        with self.lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        if not os.path.exists(self.path):
+            return
+        size = os.path.getsize(self.path)
+        if size <= self.indexed_end:
+            return
+
+        new_lines = []
+        with open(self.path, "rb") as f:
+            # 書き込み中の記録を途中まで読まないよう共有ロックを取る
+            lock_file(f, exclusive=False)
+            f.seek(self.indexed_end)
+            pos = self.indexed_end
+            for line in f:
+                line_end = pos + len(line)
+                # 書き込み途中（改行なし）の行は次回に回す
+                if not line.endswith(b"\n"):
+                    break
+                if is_record_head(line):
+                    head = line.decode("utf-8").split("\t", 2)
+                    self.entries.append((pos, line_end, head[0], head[1]))
+                    new_lines.append(self.entries[-1])
+                elif self.entries:
+                    # 継続行は直前の記録に含める
+                    start, _, timestamp, color = self.entries[-1]
+                    self.entries[-1] = (start, line_end, timestamp, color)
+                    if new_lines and new_lines[-1][0] == start:
+                        new_lines[-1] = self.entries[-1]
+                    else:
+                        new_lines.append(self.entries[-1])
+                pos = line_end
+        self.indexed_end = pos
+
+        if new_lines:
+            self._append_index(new_lines)
+
+    def _append_index(self, entries):
+        """索引ファイルに追記する。どのプロセスも同じ記録を見つけるので、
+        排他ロックを取って最後の行を読み、それより後の記録だけを書く"""
+        with open(self.index_path, "ab+") as f:
+            lock_file(f, exclusive=True)
+            try:
+                line, complete = last_line(f)
+                last = (-1, -1)
+                parts = line.split(b"\t")
+                if len(parts) == 4:
+                    try:
+                        last = (int(parts[0]), int(parts[1]))
+                    except ValueError:
+                        pass
+                data = "".join(f"{s}\t{e}\t{t}\t{c}\n"
+                               for s, e, t, c in entries if (s, e) > last)
+                if data:
+                    # 書き込み途中で止まった行があれば、そこで区切ってから書く
+                    f.write((data if complete else "\n" + data).encode("utf-8"))
+                    f.flush()
+            finally:
+                unlock_file(f)
+
+    # --------------------
+    # 書き込み
+    # --------------------
+    def append(self, timestamp, color, emotion_label, user_input):
+        line = f"{timestamp}\t{color}\t{emotion_label}\t{user_input}\n"
+        self.writer.write(line.encode("utf-8"))
+        self.refresh()
+
+    # --------------------
+    # 読み出し
+    # --------------------
+    def find(self, filter_color=None, date=None, before=None, offsets=None):
+        """索引だけで色・日付を絞り込み、該当記録の位置を新しい順に返す（遅延評価）
+
+        before を渡すとその開始オフセットより前の記録だけを返す（ページ送り用）。
+        offsets（昇順の開始オフセット）を渡すと、その記録だけを候補にする（全文検索用）。
+        """
+        self.refresh()
+        with self.lock:
+            count = len(self.entries)
+            if before is not None:
+                count = bisect.bisect_left(self.entries, (before,), hi=count)
+        if offsets is None:
+            # 記録は追記されるだけなので、先に決めた件数より前は並びが変わらない
+            indices = range(count - 1, -1, -1)
+        else:
+            indices = self._indices_of(offsets, count)
+        for i in indices:
+            start, end, timestamp, color = self.entries[i]
+            if filter_color and color != filter_color:
+                continue
+            if date and not timestamp.startswith(date):
+                continue
+            yield start, end
+
+    def _indices_of(self, offsets, count):
+        """昇順の開始オフセットを、新しい順の entries 添字に変換する"""
+        hi = count
+        for offset in reversed(offsets):
+            i = bisect.bisect_left(self.entries, (offset,), hi=hi)
+            if i < hi and self.entries[i][0] == offset:
+                yield i
+                hi = i
+
+    def latest_offset(self):
+        """いちばん新しい記録の開始オフセット（記録がなければ -1。ライブ配信の読み始め）"""
+        self.refresh()
+        with self.lock:
+            return self.entries[-1][0] if self.entries else -1
+
+    def positions_after(self, offset):
+        """開始オフセットが offset より後の記録の位置を古い順に返す"""
+        self.refresh()
+        with self.lock:
+            i = bisect.bisect_right(self.entries, (offset, float("inf")))
+            return [(start, end) for start, end, _, _ in self.entries[i:]]
+
+    def entries_from(self, offset):
+        """開始オフセットが offset 以降の索引エントリを古い順に返す"""
+        self.refresh()
+        with self.lock:
+            i = bisect.bisect_left(self.entries, (offset,))
+            return self.entries[i:]
+
+    def logs_after(self, offset):
+        """開始オフセットが offset より後の記録を古い順に返す（ライブ配信用）"""
+        return list(self.read(self.positions_after(offset)))
+
+    def read(self, positions):
+        """(開始, 終了) の並びどおりに記録を読み出す"""
+        if not os.path.exists(self.path):
+            return  # まだ1件も書かれていない
+        with open(self.path, "rb") as f:
+            for start, end in positions:
+                f.seek(start)
+                log = parse_record(f.read(end - start))
+                if log is not None:
+                    log["offset"] = start
+                    yield log
+
+    def iter_logs(self, filter_color=None, keyword=None, date=None, before=None, limit=None,
+                  offsets=None):
+        """新しい順に記録を返す。limit 件そろった時点で読むのをやめる"""
+        if not os.path.exists(self.path):
+            return
+        positions = self.find(filter_color=filter_color, date=date, before=before, offsets=offsets)
+        found = 0
+        for log in self.read(positions):
+            if keyword and keyword not in log["user_input"]:
+                continue
+            yield log
+            found += 1
+            if limit is not None and found >= limit:
+                return
+
+
+def _stress_worker(path, worker, count):
+    store = LogStore(path)
+    for n in range(count):
+        # 複数行の記録も混ぜる
+        text = f"w{worker}-{n}" + "".join(f"\n行{k}" for k in range(n % 4))
+        store.append("2025-01-01 00:00:00", "pink", "😄 うれしい", text)
+
+
+if __name__ == "__main__":
+    # ストレステスト: 多数のプロセスから同時に追記し、全記録が壊れずに読めるか確認する
+    #   python log_store.py [プロセス数] [1プロセスあたりの件数]
+    import multiprocessing
+    import sys
+    import tempfile
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress_logs.txt")
+        open(path, "w").close()
+        procs = [multiprocessing.Process(target=_stress_worker, args=(path, w, count))
+                 for w in range(workers)]
+        t0 = time.perf_counter()
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        elapsed = time.perf_counter() - t0
+
+        logs = list(LogStore(path).iter_logs())
+        seen = set()
+        for log in logs:
+            head, *rest = log["user_input"].split("\n")
+            n = int(head.split("-")[1])
+            assert rest == [f"行{k}" for k in range(n % 4)], log
+            seen.add(head)
+        expected = workers * count
+        assert len(logs) == expected and len(seen) == expected, (len(logs), len(seen), expected)
+        # 索引は記録1件につき1行（各プロセスが同じ記録を重ねて書いていない）
+        with open(path + ".idx", encoding="utf-8") as f:
+            index_lines = sum(1 for _ in f)
+        assert index_lines == expected, (index_lines, expected)
+        print(f"✅ {workers}プロセス × {count}件 = {expected}件 すべて正常に読めました（索引 {index_lines}行）")
+        print(f"書き込み: {elapsed:.2f}秒（{expected / elapsed:,.0f} 件/秒）")
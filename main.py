@@ -1,10 +1,16 @@
-from flask import Flask, render_template, request, abort
+from flask import Flask, Response, stream_template, request, abort, jsonify
 import os
 import logging
 from datetime import datetime, timezone, timedelta
-import json
-import requests
 from dotenv import load_dotenv
+from log_store import LogStore, normalize_newlines
+from sql_log_store import SqlLogStore
+from search_index import NgramIndex
+from mood_stats import MoodStats, GRANULARITIES, parse_day
+from live_feed import LiveFeed
+from page_cache import PageCache
+from line_notify import LineNotifier
+from subscribers import SubscriberStore
 
 # --------------------
 # 設定
@@ -12,7 +18,12 @@ from dotenv import load_dotenv
 load_dotenv()
 LINE_CHANNEL_TOKEN = os.getenv("LINE_CHANNEL_TOKEN")
 LOG_FILE = "logs_local.txt"
+LOG_FSYNC = os.getenv("LOG_FSYNC", "always")  # always / interval / never
+LOG_BACKEND = os.getenv("LOG_BACKEND", "file")  # file / sqlite / postgres
+LOG_DB = os.getenv("LOG_DB", "emotion_logs.db")  # sqlite のときのDBファイル
+DATABASE_URL = os.getenv("DATABASE_URL")         # postgres のときの接続先
 USERS_FILE = "users.json"
+SUBSCRIBERS_DB = "users.db"
 
 # 日本標準時 (JST)
 JST = timezone(timedelta(hours=9))
@@ -43,6 +54,10 @@ THEME_COLORS = {
 
 FIXED_MESSAGE = "おしえてくれて ありがとう😊"
 
+# /logs の1ページあたりの件数
+LOGS_PAGE_SIZE = 50
+LOGS_PAGE_SIZE_MAX = 200
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -61,102 +76,109 @@ def nl2br(value):
 # --------------------
 # ユーザー管理
 # --------------------
-def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            try:
-                data = json.load(f)
-                return set(data)
-            except json.JSONDecodeError:
-                return set()
-    return set()
-
-def save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(users), f, ensure_ascii=False, indent=2)
-
-users = load_users()
+# 以前の users.json は初回だけ取り込む
+subscribers = SubscriberStore(SUBSCRIBERS_DB, legacy_json=USERS_FILE)
 
 # --------------------
 # ログ管理
 # --------------------
+if LOG_BACKEND == "file":
+    log_store = LogStore(LOG_FILE, fsync=LOG_FSYNC)
+    search_index = NgramIndex(LOG_FILE + ".ngram")
+    search_index.update(log_store)
+    stats_path = LOG_FILE + ".stats.json"
+else:
+    # SQL バックエンドはキーワード検索もDBの全文検索索引で行う
+    if LOG_BACKEND == "postgres":
+        # PostgreSQL は試験的（SQL は python sql_log_store.py --check で組み立てまでしか
+        # 確かめていない。使う前に --check <DATABASE_URL> で実際のDBに対して確かめること）
+        logger.warning("LOG_BACKEND=postgres は試験的です（python sql_log_store.py --check で確認してください）")
+        log_store = SqlLogStore.postgres(DATABASE_URL)
+        stats_path = "emotion_logs_postgres.stats.json"
+    else:
+        log_store = SqlLogStore.sqlite(LOG_DB)
+        stats_path = LOG_DB + ".stats.json"
+    search_index = None
+mood_stats = MoodStats(stats_path)
+mood_stats.update(log_store)
+live_feed = LiveFeed(log_store)
+
 def save_log(color, emotion_label, user_input):
     if not user_input.strip():
         user_input = "-"
     # 改行を統一してそのまま保存
-    user_input_clean = user_input.replace("\r\n", "\n").replace("\r", "\n")
+    user_input_clean = normalize_newlines(user_input)
     timestamp = now_jst().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"{timestamp}\t{color}\t{emotion_label}\t{user_input_clean}\n"
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line)
+    log_store.append(timestamp, color, emotion_label, user_input_clean)
+    if search_index:
+        search_index.update(log_store)
+    mood_stats.update(log_store)
+    live_feed.notify()
+
+def keyword_candidates(keyword):
+    # キーワードがあれば 2-gram 索引で候補の記録を絞り込む（他ワーカーの書き込みも反映）
+    if not keyword or search_index is None:
+        return None
+    search_index.update(log_store)
+    return search_index.search(keyword)
 
 def load_logs(filter_color=None, keyword=None, date=None):
-    logs = []
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            current_log = None
-            for line in f:
-                line = line.rstrip("\n")
-                if not line:
-                    continue
-
-                if "\t" in line:
-                    # タブ3つで分割（最初の3つのタブ）
-                    parts = line.split("\t", 3)
-                    if len(parts) < 4:
-                        continue
-                    timestamp, color, emotion_label, user_input = parts
-
-                    # フィルター
-                    if filter_color and color != filter_color:
-                        continue
-                    if keyword and keyword not in user_input:
-                        continue
-                    if date and not timestamp.startswith(date):
-                        continue
-
-                    current_log = {
-                        "created_at": timestamp,
-                        "color": color,
-                        "emotion_label": emotion_label,
-                        "user_input": user_input
-                    }
-                    logs.append(current_log)
-                else:
-                    # タブなし行は直前のログの最後に追加
-                    if current_log:
-                        current_log["user_input"] += "\n" + line
-
-    # ここで最新のログを先頭に持ってくる
-    logs.reverse()
-    return logs
+    # 索引で色・日付・キーワードを絞り込み、該当記録だけを新しい順に読む
+    return list(log_store.iter_logs(filter_color=filter_color, keyword=keyword, date=date,
+                                    offsets=keyword_candidates(keyword)))
+
+def iter_log_page(filter_color=None, keyword=None, date=None, before=None, limit=LOGS_PAGE_SIZE):
+    # 1ページ分だけを新しい順に返す（before は前ページ最後の記録のオフセット）
+    return log_store.iter_logs(filter_color=filter_color, keyword=keyword, date=date,
+                               before=before, limit=limit, offsets=keyword_candidates(keyword))
 
 
 
 # --------------------
 # LINE通知
 # --------------------
+line_notifier = LineNotifier(LINE_CHANNEL_TOKEN)
+
 def send_line_notify(user_ids, message):
-    url = "https://api.line.me/v2/bot/message/push"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LINE_CHANNEL_TOKEN}"
-    }
-    for user_id in user_ids:
-        payload = {
-            "to": user_id,
-            "messages": [{"type": "text", "text": message}]
-        }
-        res = requests.post(url, headers=headers, json=payload)
-        if res.status_code != 200:
-            logger.error(f"LINE通知失敗: {res.text}")
+    # 送信はバックグラウンドで行い、ここではキューに積むだけ
+    line_notifier.submit(user_ids, message)
 
 # --------------------
 # Flask ルート
 # --------------------
+# 入力が決まっているページは描画済みのものを返す
+page_cache = PageCache()
+
+def input_context(color):
+    theme = THEME_COLORS[color]
+    return dict(
+        color=color,
+        emotion_label=COLOR_LABELS[color],
+        bg_color=theme["bg"],
+        main_color=theme["main"]
+    )
+
+def result_context(color):
+    theme = THEME_COLORS[color]
+    return dict(
+        color=color,
+        emotion_label=COLOR_LABELS[color],
+        message=FIXED_MESSAGE,
+        bg_color=theme["bg"],
+        main_color=theme["main"]
+    )
+
+def prerender_pages():
+    # 起動時にトップ・入力・結果ページをすべて描画しておく
+    with app.test_request_context():
+        page_cache.get("index.html", colors=COLOR_LABELS)
+        for color in COLOR_LABELS:
+            page_cache.get("input.html", **input_context(color))
+            page_cache.get("result.html", **result_context(color))
+
 @app.route("/")
 def index():
-    return render_template("index.html", colors=COLOR_LABELS)
+    return page_cache.render("index.html", colors=COLOR_LABELS)
 
 @app.route("/manifest.json")
 def manifest():
@@ -166,14 +188,7 @@ def manifest():
 def input_form(color):
     if color not in COLOR_LABELS:
         return "色が無効です", 400
-    theme = THEME_COLORS[color]
-    return render_template(
-        "input.html",
-        color=color,
-        emotion_label=COLOR_LABELS[color],
-        bg_color=theme["bg"],
-        main_color=theme["main"]
-    )
+    return page_cache.render("input.html", **input_context(color))
 
 @app.route("/generate", methods=["POST"])
 def generate():
@@ -186,33 +201,70 @@ def generate():
     save_log(color, emotion_label, user_input)
 
     message = f"💌 {emotion_label} が入力されました！\n内容: {user_input if user_input else '-'}"
-    send_line_notify(users, message)
+    send_line_notify(subscribers.iter_batches(), message)
 
-    theme = THEME_COLORS[color]
-
-    return render_template(
-        "result.html",
-        color=color,
-        emotion_label=emotion_label,
-        message=FIXED_MESSAGE,
-        bg_color=theme["bg"],
-        main_color=theme["main"]
-    )
+    return page_cache.render("result.html", conditional=False, **result_context(color))
 
 @app.route("/logs")
 def logs():
     filter_color = request.args.get("color")
     date = request.args.get("date")
-    keyword = request.args.get("keyword")
-    logs_data = load_logs(filter_color=filter_color, keyword=keyword, date=date)
-    return render_template(
+    keyword = normalize_newlines(request.args.get("keyword") or "") or None
+    before = request.args.get("before", type=int)
+    limit = request.args.get("limit", LOGS_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, LOGS_PAGE_SIZE_MAX))
+    # ページに記録が1件もないときに、ライブ配信をどこから始めるか（ページを描く前に決める）
+    live_after = log_store.latest_offset() if before is None else None
+    logs_page = iter_log_page(filter_color=filter_color, keyword=keyword, date=date,
+                              before=before, limit=limit)
+    # 読み出しながら少しずつ返す（全件をメモリに載せない）
+    return stream_template(
         "logs.html",
-        logs=logs_data,
+        logs=logs_page,
+        limit=limit,
+        before=before,
         colors=COLOR_LABELS,
         THEME_COLORS=THEME_COLORS,
         filter_color=filter_color,
         filter_date=date,
-        keyword=keyword
+        keyword=keyword,
+        live_after=live_after
+    )
+
+@app.route("/logs/stream")
+def logs_stream():
+    # 新しい記録を Server-Sent Events で届ける（条件は /logs と同じ）
+    # after はページに描いた最新の記録。再接続のときはブラウザが最後に受け取った id を送ってくる
+    after = request.headers.get("Last-Event-ID", type=int)
+    if after is None:
+        after = request.args.get("after", type=int)
+    subscriber = live_feed.subscribe(
+        filter_color=request.args.get("color"),
+        keyword=normalize_newlines(request.args.get("keyword") or "") or None,
+        date=request.args.get("date"),
+        after=after
+    )
+    return Response(
+        live_feed.stream(subscriber),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.route("/stats")
+def stats():
+    date_from = request.args.get("from")
+    date_to = request.args.get("to")
+    granularity = request.args.get("granularity", "day")
+    if granularity not in GRANULARITIES:
+        return "集計単位が無効です", 400
+    if any(d and parse_day(d) is None for d in (date_from, date_to)):
+        return "日付が無効です（YYYY-MM-DD）", 400
+    # 他のワーカーが書いた分も数え足してから返す
+    mood_stats.update(log_store)
+    return jsonify(
+        granularity=granularity,
+        colors=COLOR_LABELS,
+        stats=mood_stats.query(date_from=date_from, date_to=date_to, granularity=granularity)
     )
 
 # --------------------
@@ -224,11 +276,16 @@ def webhook():
     for event in data.get("events", []):
         if event["type"] == "follow":
             user_id = event["source"]["userId"]
-            users.add(user_id)
-            save_users(users)
+            subscribers.add(user_id)
             logger.info(f"新しいユーザー登録: {user_id}")
+        elif event["type"] == "unfollow":
+            user_id = event["source"]["userId"]
+            subscribers.remove(user_id)
+            logger.info(f"ユーザー登録解除: {user_id}")
     return "OK"
 
+prerender_pages()
+
 # --------------------
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
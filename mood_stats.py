@@ -0,0 +1,100 @@
+# mood_stats.py
+#
+# きもちの集計（日ごと・色ごとの件数）を持っておくためのロールアップ。
+# 件数はオフセット索引の（タイムスタンプ, 色）だけから数えるので本文は読まない。
+#   - save_log のたびに、増えた記録の分だけ数え足す
+#   - logs_local.txt.stats.json にスナップショットを保存する
+#   - スナップショットがない・ログより先に進んでいる（ログが作り直された）ときだけ数え直す
+#   - タイムスタンプの先頭が日付として読めない記録（古い形式・壊れた行）は数えない
+
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+GRANULARITIES = ("day", "week", "month")
+
+
+def parse_day(text):
+    """YYYY-MM-DD として読めればその文字列、読めなければ None"""
+    if not isinstance(text, str) or len(text) != 10:
+        return None
+    try:
+        d = date.fromisoformat(text)
+    except ValueError:
+        return None
+    return text if d.isoformat() == text else None
+
+
+def period_of(day, granularity):
+    """YYYY-MM-DD を集計単位の見出しに変換する（週は月曜日の日付）"""
+    if granularity == "day":
+        return day
+    if granularity == "month":
+        return day[:7]
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+class MoodStats:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.days = {}  # {"YYYY-MM-DD": {"pink": 件数, ...}}
+        self.end = 0    # ここまでのオフセットの記録を数えた
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            # 以前の版が数えてしまった、日付として読めない見出しは捨てる
+            self.days = {d: c for d, c in snapshot["days"].items() if parse_day(d)}
+            self.end = snapshot["end"]
+        except (ValueError, KeyError):
+            self.days = {}
+            self.end = 0
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"end": self.end, "days": self.days}, f, ensure_ascii=False,
+                      separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def update(self, log_store):
+        """ログに追記された記録の分だけ件数を数え足す"""
+        with self.lock:
+            if self.end > log_store.indexed_end:
+                self.days = {}
+                self.end = 0
+            entries = log_store.entries_from(self.end)
+            if not entries:
+                return
+            for _, end, timestamp, color in entries:
+                self.end = end
+                day = parse_day(timestamp[:10] if isinstance(timestamp, str) else None)
+                if day is None:
+                    continue
+                counts = self.days.setdefault(day, {})
+                counts[color] = counts.get(color, 0) + 1
+            self._save()
+
+    def query(self, date_from=None, date_to=None, granularity="day"):
+        """期間内の件数を集計単位ごとにまとめて返す（日数に比例する処理量）"""
+        with self.lock:
+            days = sorted(
+                d for d in self.days
+                if (not date_from or d >= date_from) and (not date_to or d <= date_to)
+            )
+            buckets = {}
+            for day in days:
+                counts = buckets.setdefault(period_of(day, granularity), {})
+                for color, n in self.days[day].items():
+                    counts[color] = counts.get(color, 0) + n
+        return [
+            {"period": period, "counts": counts, "total": sum(counts.values())}
+            for period, counts in buckets.items()
+        ]
@@ -0,0 +1,91 @@
+# nowcast.py
+#
+# 5分後〜30分後（5分刻み）の降水を、1回の順伝播でまとめて予測するモデルとその材料。
+#   入力: 直近 T 枚の画像特徴 (T, 2048) と、いまの気温・湿度 (2,)
+#   出力: class_output (len(HORIZONS),) 各時間に雨が降る確率
+#         reg_output   (len(HORIZONS),) 各時間の10分間降水量 (mm)
+# 正解は weather_store.py の10分値から作る。気象庁の10分値の時刻は区間の終わりを表すので
+# （10:10 の降水量は 10:00〜10:10 の量）、t + h 分を含む区間の降水量を h 分後の正解にする。
+
+import os
+
+import numpy as np
+from tensorflow.keras import Input, layers, models
+
+HORIZONS = (5, 10, 15, 20, 25, 30)  # 分
+SEQUENCE_LENGTH = 6                 # 直近何枚の画像を使うか
+MAX_GAP = np.timedelta64(30, "m")   # これ以上間があいたら別の並び（夜の間など）とみなす
+NOWCAST_MODEL_PATH = "nowcast_model.h5"
+
+
+def horizon_targets(weather, img_times, horizons=HORIZONS):
+    """各画像の時刻から h 分後の10分間降水量 (N, len(horizons))。値がなければ NaN"""
+    times = np.asarray(img_times, dtype="datetime64[ns]")
+    w_times = np.asarray(weather.times)
+    precipitation = np.asarray(weather.values[:, weather.columns.index("precipitation")])
+    targets = np.full((len(times), len(horizons)), np.nan, dtype=np.float32)
+    if len(w_times) == 0:
+        return targets
+
+    for k, h in enumerate(horizons):
+        target = times + np.timedelta64(h, "m")
+        idx = np.searchsorted(w_times, target, side="left")  # target を含む区間の終わり
+        found = idx < len(w_times)
+        idx = np.minimum(idx, len(w_times) - 1)
+        found &= (w_times[idx] - target) < np.timedelta64(10, "m")
+        targets[found, k] = precipitation[idx[found]]
+    return targets
+
+
+def sequence_index(times, length=SEQUENCE_LENGTH, max_gap=MAX_GAP):
+    """各行について直前 length 枚の添字 (N, length)（古い順、最後が自分）。
+
+    時刻順に並んだ times を、間が max_gap より大きいところで区切り、
+    区切りをまたがないようにする。足りない分はその並びの最初の画像で埋める。
+    """
+    times = np.asarray(times, dtype="datetime64[ns]")
+    n = len(times)
+    breaks = np.ones(n, dtype=bool)
+    gaps = np.diff(times)
+    # 時刻が戻るところ（別のパーティションの始まり）でも区切る
+    breaks[1:] = (gaps > max_gap) | (gaps < np.timedelta64(0, "ns"))
+    seg_start = np.maximum.accumulate(np.where(breaks, np.arange(n), 0))
+    idx = np.arange(n)[:, None] - np.arange(length - 1, -1, -1)[None, :]
+    return np.maximum(idx, seg_start[:, None])
+
+
+def build_nowcast_model(length=SEQUENCE_LENGTH, feature_dim=2048, horizons=HORIZONS):
+    frames = Input(shape=(length, feature_dim), name="frames")
+    weather_input = Input(shape=(2,), name="weather_input")
+
+    x = layers.TimeDistributed(layers.Dense(256, activation="relu"))(frames)
+    x = layers.LSTM(128)(x)
+    combined = layers.concatenate([x, weather_input])
+    dense = layers.Dense(64, activation="relu")(combined)
+
+    # 全部の時間を1つの出力にまとめて、1回の呼び出しで返す
+    output_class = layers.Dense(len(horizons), activation="sigmoid", name="class_output")(dense)
+    output_reg = layers.Dense(len(horizons), activation="linear", name="reg_output")(dense)
+    return models.Model(inputs=[frames, weather_input], outputs=[output_class, output_reg])
+
+
+def recent_frames(img_path, length=SEQUENCE_LENGTH, max_gap=MAX_GAP):
+    """同じフォルダの画像（ファイル名 YYYYMMDDHHMM）から、img_path までの直近 length 枚のパス。
+
+    学習時の sequence_index と同じ並べ方にする。ファイル名が時刻でなければ img_path だけを並べる。
+    """
+    folder = os.path.dirname(img_path) or "."
+    name = os.path.basename(img_path)
+    try:
+        times = {f: np.datetime64(f"{f[:4]}-{f[4:6]}-{f[6:8]}T{f[8:10]}:{f[10:12]}", "ns")
+                 for f in os.listdir(folder)
+                 if f.lower().endswith((".jpg", ".png")) and f[:12].isdigit() and f <= name}
+    except (OSError, ValueError):
+        times = {}
+    if name not in times:
+        return [img_path] * length
+
+    files = sorted(times)
+    files = files[max(0, len(files) - length * 4):]  # 間があいていても足りるだけ
+    idx = sequence_index([times[f] for f in files], length, max_gap)[-1]
+    return [os.path.join(folder, files[i]) for i in idx]
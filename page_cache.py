@@ -0,0 +1,166 @@
+# page_cache.py
+#
+# 入力が決まっているページ（トップ・input/<色>・結果）を描画済みで持っておくキャッシュ。
+#   - テンプレート名と引数をキーに、1回だけ Jinja で描画する
+#   - 本文のハッシュを強い ETag にし、gzip / brotli で圧縮した本文も先に作っておく
+#   - If-None-Match が一致すれば 304 を返す
+
+import gzip
+import hashlib
+import threading
+
+from flask import Response, render_template, request
+
+try:
+    import brotli
+except ImportError:  # brotli が入っていなければ gzip だけ使う
+    brotli = None
+
+
+class CachedPage:
+    def __init__(self, html):
+        self.body = html.encode("utf-8")
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.gzip = gzip.compress(self.body, compresslevel=9, mtime=0)
+        self.br = brotli.compress(self.body, quality=11) if brotli else None
+
+
+class PageCache:
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.pages = {}
+        self.lock = threading.Lock()
+
+    def get(self, template, **context):
+        key = (template, repr(sorted(context.items())))
+        page = self.pages.get(key)
+        if page is None:
+            page = CachedPage(render_template(template, **context))
+            with self.lock:
+                self.pages.setdefault(key, page)
+        return page
+
+    def render(self, template, status=200, conditional=True, **context):
+        """キャッシュ済みのページを Response にする（POST の応答などは conditional=False）"""
+        page = self.get(template, **context)
+        headers = {"Vary": "Accept-Encoding"}
+        if conditional:
+            headers["ETag"] = f'"{page.etag}"'
+            headers["Cache-Control"] = f"public, max-age={self.max_age}"
+            if page.etag in request.if_none_match:
+                return Response(status=304, headers=headers)
+
+        body = page.body
+        if page.br is not None and request.accept_encodings["br"]:
+            body = page.br
+            headers["Content-Encoding"] = "br"
+        elif request.accept_encodings["gzip"]:
+            body = page.gzip
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, status=status, headers=headers, content_type="text/html; charset=utf-8")
+
+
+def _load_worker(port, targets, start_at, seconds):
+    """1本の keep-alive 接続で、start_at から seconds 秒のあいだ targets を順に取り続ける。
+    (各リクエストの遅延, 受け取った本文のバイト数の合計) を返す"""
+    import http.client
+    import time
+
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    latencies = []
+    received = 0
+    time.sleep(max(0.0, start_at - time.time()))
+    end = time.time() + seconds
+    n = 0
+    while time.time() < end:
+        path, headers = targets[n % len(targets)]
+        t0 = time.perf_counter()
+        conn.request("GET", path, headers=headers)
+        res = conn.getresponse()
+        received += len(res.read())
+        latencies.append(time.perf_counter() - t0)
+        assert res.status in (200, 304), res.status
+        n += 1
+    conn.close()
+    return latencies, received
+
+
+if __name__ == "__main__":
+    # ベンチマーク: 実際の main.py のアプリをスレッドで処理する werkzeug のサーバーで立て、
+    # 別プロセスの keep-alive 接続を同時に張って、/input/<色> を
+    #   毎回描画する場合 / キャッシュ / キャッシュ + gzip / キャッシュ + 304
+    # の 1秒あたりの処理数・遅延・サーバーの CPU 時間・1回あたりの転送量を比べる。
+    #   python page_cache.py [同時接続数] [1つあたりの計測秒数]
+    import logging
+    import multiprocessing
+    import os
+    import sys
+    import tempfile
+    import time
+
+    from werkzeug.serving import make_server
+
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+
+    # 負荷をかける側は GIL を取り合わないように、サーバーより先に別プロセスとして作っておく
+    pool = multiprocessing.Pool(clients)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(tempfile.mkdtemp())  # LOG_FILE（logs_local.txt）や索引を一時ディレクトリに作る
+    os.environ["LOG_BACKEND"] = "file"
+    logging.disable(logging.WARNING)  # 1リクエストごとのアクセスログを出さない
+    import main
+
+    colors = list(main.COLOR_LABELS)
+
+    def uncached(color):
+        theme = main.THEME_COLORS[color]
+        return render_template("input.html", color=color, emotion_label=main.COLOR_LABELS[color],
+                               bg_color=theme["bg"], main_color=theme["main"])
+
+    main.app.add_url_rule("/bench/uncached/<color>", "bench_uncached", uncached)
+
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_port
+
+    with main.app.test_client() as client:
+        etags = {c: client.get(f"/input/{c}").headers["ETag"] for c in colors}
+
+    scenarios = [
+        ("毎回描画", [(f"/bench/uncached/{c}", {}) for c in colors]),
+        ("キャッシュ", [(f"/input/{c}", {}) for c in colors]),
+        ("キャッシュ + gzip", [(f"/input/{c}", {"Accept-Encoding": "gzip"}) for c in colors]),
+        ("キャッシュ + 304", [(f"/input/{c}", {"If-None-Match": etags[c]}) for c in colors]),
+    ]
+    print(f"werkzeug（スレッド）+ keep-alive 接続 {clients}本 × {seconds:.0f}秒")
+    base = None
+    for label, targets in scenarios:
+        start_at = time.time() + 0.5
+        cpu0 = time.process_time()  # サーバー側（このプロセスの全スレッド）の CPU 時間
+        results = pool.starmap(_load_worker, [(port, targets, start_at, seconds)] * clients)
+        cpu = time.process_time() - cpu0
+        latencies = sorted(x for r, _ in results for x in r)
+        received = sum(b for _, b in results)
+        rate = len(latencies) / seconds
+        base = base or rate
+        print(f"{label:<16}: {rate:8,.0f} req/s（{rate / base:4.1f}倍）"
+              f"  p50 {latencies[len(latencies) // 2] * 1000:5.1f} ms"
+              f" / p99 {latencies[int(len(latencies) * 0.99)] * 1000:5.1f} ms"
+              f"  CPU {cpu / len(latencies) * 1e6:6.0f} µs/req"
+              f"  本文 {received / len(latencies):7,.0f} B/req")
+    # キャッシュで省けるのは1回あたりの CPU のうち Jinja の描画の分だけ（残りは HTTP サーバー側）
+    with main.app.test_request_context():
+        t0 = time.perf_counter()
+        for n in range(2000):
+            uncached(colors[n % len(colors)])
+        render = (time.perf_counter() - t0) / 2000
+        t0 = time.perf_counter()
+        for n in range(2000):
+            main.page_cache.get("input.html", **main.input_context(colors[n % len(colors)]))
+        lookup = (time.perf_counter() - t0) / 2000
+    print(f"描画 {render * 1e6:.0f} µs → キャッシュを引く {lookup * 1e6:.1f} µs"
+          f"（1リクエストの CPU の大半は werkzeug 側なので、req/s の差はこの分だけ）")
+    pool.close()
+    server.shutdown()
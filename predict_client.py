@@ -0,0 +1,77 @@
+# predict_client.py
+#
+# predict_server.py に画像と気温・湿度を送り、予測結果を受け取るクライアント。
+# サーバーが起動していなければ、その場でモデルを読み込んで予測する（以前と同じく数秒かかる）。
+#   python predict_client.py        対話式に入力して、両方のモデルの予測を表示する
+
+import os
+
+import requests
+
+SERVER_URL = os.getenv("PREDICT_SERVER_URL", "http://127.0.0.1:5050")
+
+_local_predictor = None
+
+
+def ask_inputs():
+    """画像のパスと気温・湿度を対話式に受け取る。入力が正しくなければ None"""
+    img_path = input("🖼️ 入力画像のパスを入力してください（例: ./images/20230920/image001.jpg）: ").strip()
+    if not os.path.isfile(img_path):
+        print(f"❌ 画像ファイルが見つかりません: {img_path}")
+        return None
+
+    try:
+        temperature = float(input("🌡️ 気温 (℃): "))
+        humidity = float(input("💧 相対湿度 (%): "))
+    except ValueError:
+        print("❌ 数値を正しく入力してください。")
+        return None
+    return img_path, temperature, humidity
+
+
+def predict(img_path, temperature, humidity, url=SERVER_URL, timeout=60):
+    """{"mlp": {...}, "convlstm": {...}, "nowcast": {...}} の形の予測を返す。画像が読めなければ None"""
+    global _local_predictor
+    payload = {"image_path": os.path.abspath(img_path), "temperature": temperature,
+               "humidity": humidity}
+    try:
+        res = requests.post(f"{url}/predict", json=payload, timeout=timeout)
+    except requests.ConnectionError:
+        if _local_predictor is None:
+            print("⚠️ 予測サーバーに接続できないので、モデルをこの場で読み込みます"
+                  "（python predict_server.py で常駐させると速くなります）")
+            from predict_server import Predictor
+            _local_predictor = Predictor()
+        return _local_predictor.predict(temperature, humidity, image_path=img_path)
+
+    body = res.json()
+    if res.status_code != 200:
+        print(f"❌ 予測に失敗しました: {body.get('error')}")
+        return None
+    print(f"⏱️ サーバーでの処理時間: {body['latency_ms']:.1f} ms")
+    return body["predictions"]
+
+
+def print_prediction(title, pred):
+    print(f"\n===== {title} =====")
+    if "horizons" in pred:
+        # nowcast: 各時間の予測が並んでいる
+        for minutes, prob, mm in zip(pred["horizons"], pred["rain_probability"], pred["rain_mm"]):
+            print(f"{minutes:>2}分後: 降水確率 {prob * 100:6.2f} %  降水量 {mm:.2f} mm")
+        return
+    print(f"降水の有無（分類）: {'あり' if pred['rain'] else 'なし'}（{pred['rain_probability'] * 100:.2f} %）")
+    print(f"降水量の予測値（mm）: {pred['rain_mm']:.2f} mm")
+
+
+if __name__ == "__main__":
+    inputs = ask_inputs()
+    if inputs is None:
+        exit()
+
+    predictions = predict(*inputs)
+    if predictions is None:
+        exit()
+    names = {"mlp": "予測結果（MLP）", "convlstm": "予測結果（ConvLSTM）",
+             "nowcast": "予測結果（5〜30分後）"}
+    for name, pred in predictions.items():
+        print_prediction(names.get(name, name), pred)
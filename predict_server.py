@@ -0,0 +1,283 @@
+# predict_server.py
+#
+# 降水予測の常駐サーバー。ResNet50 と2つの予測モデルを起動時に1回だけ読み込み、
+# あとはリクエストごとに特徴抽出と予測だけを行う（毎回数秒かかっていた読み込みをなくす）。
+#   final_predictor_model.h5     画像特徴 + 気温・湿度 → 降水の有無・降水量（MLP）
+#   final_predictor_convLSTM.h5  直近 T 枚の画像 + 気温・湿度 → 降水の有無・降水量（ConvLSTM）
+#   nowcast_model.h5             直近の画像の並び + 気温・湿度 → 5〜30分後の降水（nowcast.py）
+#
+#   python predict_server.py [--port 5050]     起動（127.0.0.1 のみで待ち受け）
+#   python predict_server.py --bench 200       起動せずに、温まった状態の p50 / p99 を測る
+#
+# POST /predict
+#   JSON: {"image_path": "...", "temperature": 28.5, "humidity": 75}
+#   または multipart: image=<ファイル>, temperature=..., humidity=...
+#   → {"predictions": {"mlp": {...}, "convlstm": {...}, "nowcast": {...}}, "latency_ms": 12.3}
+#   nowcast は各値が HORIZONS（5, 10, ..., 30 分後）の順のリストになる
+# GET /stats → これまでのリクエストの件数と p50 / p99（ミリ秒）
+#
+# クライアント（対話式の入力）は predict_client.py。
+
+import io
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from flask import Flask, jsonify, request
+from tensorflow.keras.models import load_model
+
+from feature_cache import FeatureCache
+from feature_extractor import IMG_SIZE, FeatureExtractor, build_feature_model, load_image
+from frame_store import FrameStore
+from nowcast import HORIZONS, NOWCAST_MODEL_PATH, recent_frames
+from sequence_dataset import to_model_input
+
+MLP_MODEL_PATH = "final_predictor_model.h5"
+CONVLSTM_MODEL_PATH = "final_predictor_convLSTM.h5"
+PREDICT_PORT = 5050
+
+
+class Predictor:
+    def __init__(self, mlp_path=MLP_MODEL_PATH, convlstm_path=CONVLSTM_MODEL_PATH,
+                 nowcast_path=NOWCAST_MODEL_PATH, feature_model=None, use_cache=True, history=1000,
+                 frame_store=None):
+        self.feature_model = feature_model if feature_model is not None else build_feature_model()
+        cache = FeatureCache.for_model(self.feature_model) if use_cache else None
+        # 縮小済みの画像（frame_store.py）がある日は JPEG を読まない
+        self.frame_store = frame_store if frame_store is not None else FrameStore()
+        self.extractor = FeatureExtractor(self.feature_model, batch_size=1, cache=cache,
+                                          frame_store=self.frame_store)
+        self.models = {}
+        for name, path in (("mlp", mlp_path), ("convlstm", convlstm_path),
+                           ("nowcast", nowcast_path)):
+            if path and os.path.exists(path):
+                self.models[name] = load_model(path, compile=False)
+            else:
+                print(f"⚠️ モデルファイルが見つかりません（{name} は使いません）: {path}")
+        # ConvLSTM が画像の並び (T, H, W, 3) を入力にとるかどうか（train_model_convLSTM.py）
+        self.image_input = ("convlstm" in self.models
+                            and self.models["convlstm"].inputs[0].shape[-1] == 3)
+        self.clip_shape = (tuple(self.models["convlstm"].inputs[0].shape[1:])
+                           if self.image_input else None)
+        # nowcast が使う直近の画像の枚数
+        self.sequence_length = (self.models["nowcast"].inputs[0].shape[1]
+                                if "nowcast" in self.models else 0)
+        # TensorFlow のモデルを複数スレッドから同時に呼ばないようにする
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=history)  # 直近のリクエストの処理時間（秒）
+
+    def warmup(self):
+        """最初のリクエストが遅くならないよう、起動時に1回ずつ通しておく"""
+        img = np.zeros(IMG_SIZE + (3,), dtype=np.float32)
+        feat = self.extractor.predict_batch(img[None])[0]
+        x = {
+            "feat": feat,
+            "frames": np.zeros((self.sequence_length, len(feat)), dtype=np.float32),
+            "clip": np.zeros(self.clip_shape, dtype=np.float32) if self.image_input else None,
+        }
+        for name in self.models:
+            self._predict_model(name, x, 20.0, 50.0)
+
+    def _convlstm_input(self, x, weather):
+        # 画像の並びを入力にとるなら直近 T 枚の画像を、
+        # そうでなければ（古い形式のモデル）特徴ベクトルを入力の形に並べ替える
+        if self.image_input:
+            clip = x["clip"][None]
+        else:
+            shape = tuple(self.models["convlstm"].inputs[0].shape[1:])
+            clip = np.concatenate([x["feat"], weather[0]]).reshape((1,) + shape)
+        return [clip.astype(np.float32), weather]
+
+    def _predict_model(self, name, x, temperature, humidity):
+        weather = np.array([[temperature, humidity]], dtype=np.float32)
+        if name == "nowcast":
+            # 全部の時間を1回で予測する
+            pred_class, pred_reg = self.models[name]([x["frames"][None], weather], training=False)
+            probs = np.asarray(pred_class)[0]
+            return {
+                "horizons": list(HORIZONS),
+                "rain_probability": [float(p) for p in probs],
+                "rain": [bool(p >= 0.5) for p in probs],
+                "rain_mm": [float(v) for v in np.asarray(pred_reg)[0]],
+            }
+        if name == "convlstm":
+            inputs = self._convlstm_input(x, weather)
+        else:
+            inputs = np.concatenate([x["feat"], weather[0]]).astype(np.float32)[None]
+        # 1件だけなら model.predict より直接呼ぶほうがずっと速い
+        pred_class, pred_reg = self.models[name](inputs, training=False)
+        prob = float(np.asarray(pred_class)[0][0])
+        return {
+            "rain_probability": prob,
+            "rain": prob >= 0.5,
+            "rain_mm": float(np.asarray(pred_reg)[0][0]),
+        }
+
+    def predict(self, temperature, humidity, image_path=None, image_bytes=None):
+        """画像（パスか中身）と気温・湿度から、各モデルの予測を返す。画像が読めなければ None"""
+        t0 = time.perf_counter()
+        with self.lock:
+            if image_path is not None:
+                # 特徴がキャッシュにあれば画像は読まない
+                feat = self._features(image_path)
+            else:
+                img = load_image(io.BytesIO(image_bytes))
+                feat = None if img is None else self.extractor.predict_batch(img[None])[0]
+            if feat is None:
+                return None
+            x = {
+                "feat": feat,
+                "frames": self._frames(image_path, feat),
+                "clip": self._clip(image_path, image_bytes),
+            }
+            if self.image_input and x["clip"] is None:
+                return None
+            result = {name: self._predict_model(name, x, temperature, humidity)
+                      for name in self.models}
+        self.latencies.append(time.perf_counter() - t0)
+        return result
+
+    def _frames(self, image_path, feat):
+        """nowcast に渡す直近の画像特徴 (T, 2048)。アップロードされた画像なら1枚を並べる"""
+        if not self.sequence_length:
+            return None
+        if image_path is None:
+            return np.repeat(feat[None], self.sequence_length, axis=0)
+        paths = recent_frames(image_path, self.sequence_length)
+        frames = np.repeat(feat[None], len(paths), axis=0)
+        # いまの画像の特徴はもうあるので、それより前の画像だけを通す（たいていキャッシュにある）
+        earlier = [i for i, p in enumerate(paths) if p != paths[-1]]
+        if earlier:
+            feats, ok = self.extractor.extract([paths[i] for i in earlier])
+            idx = np.asarray(earlier)[ok]
+            frames[idx] = feats[ok]  # 読めなかった画像はいまの画像のまま
+        return frames
+
+    def _clip(self, image_path, image_bytes):
+        """ConvLSTM に渡す直近 T 枚の画像 (T, H, W, 3)。学習時（sequence_dataset.py）と同じ大きさ・値の範囲"""
+        if not self.image_input:
+            return None
+        length, h, w = self.clip_shape[:3]
+        if image_path is None:
+            img = load_image(io.BytesIO(image_bytes), (h, w))
+            return np.repeat(to_model_input(img)[None], length, axis=0)
+        paths = recent_frames(image_path, length)
+        frames, found = self.frame_store.lookup(paths, (h, w))
+        clip = frames.astype(np.float32)
+        for i in np.flatnonzero(~found):
+            img = load_image(paths[i], (h, w))
+            if img is not None:
+                clip[i] = img
+                found[i] = True
+        # 最後がいまの画像。読めなかったそれより前の画像はいまの画像で埋める
+        if not found[-1]:
+            return None
+        clip[~found] = clip[-1]
+        return to_model_input(clip)
+
+    def _features(self, image_path, img=None):
+        cache = self.extractor.cache
+        if cache is not None:
+            feats, hit = cache.get_many([image_path])
+            if hit[0]:
+                return feats[0]
+        if img is None:
+            frames, found = self.frame_store.lookup([image_path], IMG_SIZE)
+            img = frames[0].astype(np.float32) if found[0] else load_image(image_path)
+            if img is None:
+                return None
+        feat = self.extractor.predict_batch(img[None])[0]
+        if cache is not None:
+            cache.put_many([image_path], feat[None])
+        return feat
+
+    def stats(self):
+        lat = np.array(self.latencies) * 1000
+        if len(lat) == 0:
+            return {"count": 0}
+        return {
+            "count": len(lat),
+            "p50_ms": round(float(np.percentile(lat, 50)), 2),
+            "p99_ms": round(float(np.percentile(lat, 99)), 2),
+        }
+
+
+def create_app(predictor):
+    app = Flask(__name__)
+
+    @app.route("/predict", methods=["POST"])
+    def predict():
+        t0 = time.perf_counter()
+        data = request.get_json(silent=True) or request.form
+        try:
+            temperature = float(data["temperature"])
+            humidity = float(data["humidity"])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "temperature と humidity を数値で指定してください"}), 400
+
+        upload = request.files.get("image")
+        image_path = data.get("image_path")
+        if upload is not None:
+            result = predictor.predict(temperature, humidity, image_bytes=upload.read())
+        elif image_path:
+            if not os.path.isfile(image_path):
+                return jsonify({"error": f"画像ファイルが見つかりません: {image_path}"}), 404
+            result = predictor.predict(temperature, humidity, image_path=image_path)
+        else:
+            return jsonify({"error": "image_path か image を指定してください"}), 400
+
+        if result is None:
+            return jsonify({"error": "画像を読み込めませんでした"}), 422
+        return jsonify({
+            "predictions": result,
+            "latency_ms": round((time.perf_counter() - t0) * 1000, 2),
+        })
+
+    @app.route("/stats")
+    def stats():
+        return jsonify({"models": list(predictor.models), **predictor.stats()})
+
+    return app
+
+
+def bench(predictor, n):
+    """ランダムな画像で n 回予測し、温まった状態の p50 / p99 を表示する"""
+    import tempfile
+    from tensorflow.keras.preprocessing import image
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.jpg")
+        rng = np.random.default_rng(0)
+        image.array_to_img(rng.integers(0, 255, (480, 640, 3))).save(path)
+        predictor.latencies.clear()
+        for _ in range(n):
+            predictor.predict(25.0, 60.0, image_path=path)
+    print(f"モデル: {', '.join(predictor.models) or 'なし（特徴抽出のみ）'}")
+    print(predictor.stats())
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="降水予測の常駐サーバー")
+    parser.add_argument("--port", type=int, default=PREDICT_PORT)
+    parser.add_argument("--mlp", default=MLP_MODEL_PATH)
+    parser.add_argument("--convlstm", default=CONVLSTM_MODEL_PATH)
+    parser.add_argument("--nowcast", default=NOWCAST_MODEL_PATH)
+    parser.add_argument("--bench", type=int, default=0, metavar="N",
+                        help="サーバーを起動せず、N 回予測して p50 / p99 を表示する")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    # --bench は同じ画像を繰り返すので、特徴キャッシュを使わずに毎回 ResNet50 を通す
+    predictor = Predictor(args.mlp, args.convlstm, args.nowcast, use_cache=not args.bench)
+    predictor.warmup()
+    print(f"✅ モデル読み込み完了（{time.perf_counter() - t0:.1f} 秒）")
+
+    if args.bench:
+        bench(predictor, args.bench)
+    else:
+        # モデルは1つなので、リクエストはスレッドで受けて予測だけを順番に行う
+        create_app(predictor).run(host="127.0.0.1", port=args.port, threaded=True)
@@ -1,78 +1,225 @@
 # prepare_dataset.py
+#
+# 日付ごとの CSV（A_model_YYYYMMDD.csv）と画像から、特徴ストアのパーティションを作る。
+#   python prepare_dataset.py                           1日ずつ順番に処理する
+#   python prepare_dataset.py --workers 4               4プロセスで日付を分担する（プロセスごとにモデルを持つ）
+#   python prepare_dataset.py --workers 4 --shared-model
+#                                                       画像の読み込みだけを4プロセスで行い、
+#                                                       埋め込みは1つのモデルでまとめて行う
+#   python prepare_dataset.py --check --workers 4 --limit 3
+#                                                       順番に作った結果と並列で作った結果が同じか確かめる
 
+import argparse
+import multiprocessing
 import os
-import pandas as pd
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pandas as pd
 from tqdm import tqdm
-from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.models import Model
+from feature_extractor import FeatureExtractor, build_feature_model
+from feature_cache import FeatureCache, model_fingerprint
+from feature_store import (FeatureStore, is_partition_done, partition_path, source_stamp,
+                           write_partition)
+from frame_store import FrameStore
 
 # === 設定 ===
 img_root = r'\\150.89.226.195\Private\6期生\小畑\img_data'  # 画像フォルダ（YYYYMMDD サブフォルダあり）
 csv_root = r'\\150.89.226.195\Private\7期生\西山\Attached_WeatherData'  # A_model_*.csvなど
-output_path = r'features_dataset.csv'  # 出力ファイル
+output_path = r'features_dataset'  # 出力先（日付ごとのパーティションを置くフォルダ）
+frame_root = r'frame_store'  # 縮小済みの画像（frame_store.py）。ある日は JPEG を読まずに使う
+batch_size = 32   # ResNet50 に1回で渡す枚数
+io_workers = 8    # 画像の読み込み・リサイズを並列に行うスレッド数
+cache_dtype = 'float32'  # 特徴キャッシュの型（'float16' にすると半分の大きさ）
 
-# === モデル準備（ResNet50, avg_pool出力） ===
-base_model = ResNet50(weights='imagenet', include_top=False, pooling='avg')
-feature_model = Model(inputs=base_model.input, outputs=base_model.output)
 
-def extract_features(img_path):
-    try:
-        img = image.load_img(img_path, target_size=(224, 224))
-        x = image.img_to_array(img)
-        x = np.expand_dims(x, axis=0)
-        x = preprocess_input(x)
-        feat = feature_model.predict(x, verbose=0)
-        return feat.flatten()
-    except Exception as e:
-        print(f"[×] 画像読み込み失敗: {img_path} → {e}")
-        return None
-
-# === 処理開始 ===
-all_features = []
-all_labels = []
-
-csv_files = sorted([f for f in os.listdir(csv_root) if f.endswith('.csv')])
-
-for csv_file in tqdm(csv_files, desc="CSV処理中"):
-    csv_path = os.path.join(csv_root, csv_file)
+def list_days():
+    """(パーティション名, CSV のパス, 画像フォルダ) を日付順に返す"""
+    days = []
+    for csv_file in sorted(f for f in os.listdir(csv_root) if f.endswith('.csv')):
+        # 日付フォルダ名取得
+        date_folder = csv_file.split('_')[-1].split('.')[0]
+        img_folder = os.path.join(img_root, date_folder)
+        if not os.path.exists(img_folder):
+            print(f"[×] 対応する画像フォルダが見つかりません: {img_folder}")
+            continue
+        days.append((os.path.splitext(csv_file)[0], os.path.join(csv_root, csv_file), img_folder))
+    return days
+
+
+def load_day(extractor, csv_path, img_folder):
+    """1日分の (読み込めた画像のパス, 特徴, メタデータ) を作る"""
     df = pd.read_csv(csv_path, encoding='utf-8-sig')
-    
-    # 日付フォルダ名取得
-    date_folder = csv_file.split('_')[-1].split('.')[0]
-    img_folder = os.path.join(img_root, date_folder)
-    if not os.path.exists(img_folder):
-        print(f"[×] 対応する画像フォルダが見つかりません: {img_folder}")
-        continue
-
-    for _, row in df.iterrows():
-        img_file = row['filename']
-        img_path = os.path.join(img_folder, img_file)
-        feat = extract_features(img_path)
-        if feat is None:
+
+    # その日の画像をまとめて特徴抽出（読み込めなかった画像の行は除く）
+    img_paths = [os.path.join(img_folder, f) for f in df['filename']]
+    feats, ok = extractor.extract(img_paths)
+
+    # 気象特徴（必要なら追加）とラベル（降水量）。列がなければ NaN
+    meta = df.reindex(columns=['temperature', 'humidity', 'precipitation']).apply(pd.to_numeric, errors='coerce')
+    meta.insert(0, 'filename', df['filename'])
+    meta.insert(1, 'img_time', pd.to_datetime(df['img_time']) if 'img_time' in df else pd.NaT)
+    meta = meta[ok]
+
+    # ラベル列追加（回帰用と分類用）
+    meta['rain_mm'] = meta['precipitation']
+    meta['label'] = (meta['precipitation'] > 0).astype(int)
+    return [p for p, good in zip(img_paths, ok) if good], feats[ok], meta
+
+
+# === 並列ビルドの子プロセス ===
+# 子プロセスはそれぞれ ResNet50 を持ち、割り当てられた日を丸ごと処理して結果を親に返す。
+# 特徴キャッシュは読むだけにして、追記とパーティションの書き出しは親がまとめて行う。
+_worker_extractor = None
+
+
+def init_worker(weights, fingerprint, threads):
+    global _worker_extractor
+    import tensorflow as tf
+    # プロセスどうしでコアを取り合わないように、1プロセスあたりのスレッド数を絞る
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    cache = None
+    if fingerprint is not None:
+        cache = FeatureCache(fingerprint, dtype=cache_dtype, readonly=True)
+    _worker_extractor = FeatureExtractor(build_feature_model(weights), batch_size=batch_size,
+                                         workers=max(1, io_workers // 2), cache=cache,
+                                         frame_store=FrameStore(frame_root))
+
+
+def load_day_in_worker(csv_path, img_folder):
+    return load_day(_worker_extractor, csv_path, img_folder)
+
+
+def iter_parallel(todo, workers, weights, fingerprint):
+    """日ごとの結果を todo の順に返す。先に終わった日も順番が来るまで待たせる"""
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # TensorFlow を読み込んだ親を fork すると子が止まるので、spawn で新しく起動する
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(weights, fingerprint, threads),
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        days = iter(todo)
+        pending = deque()
+        while True:
+            # 結果がたまりすぎないよう、実行中と待ちを合わせて workers * 2 日分までにする
+            for day in days:
+                pending.append((day, pool.submit(load_day_in_worker, day[1], day[2])))
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                break
+            day, future = pending.popleft()
+            try:
+                yield day, future.result()
+            except Exception as e:
+                yield day, e
+
+
+def iter_serial(todo, extractor):
+    for day in todo:
+        try:
+            yield day, load_day(extractor, day[1], day[2])
+        except Exception as e:
+            yield day, e
+
+
+def build(output_path, workers=1, shared_model=False, weights='imagenet', use_cache=True,
+          limit=None):
+    """CSV（日付）ごとに output_path/partitions/<CSV名>/ へ書き出す。
+
+    完了印があり、CSV と画像フォルダが前回から変わっていない日は飛ばす。
+    途中で失敗した日は完了印が付かないので、次に実行したときにやり直される。
+    """
+    todo, skipped = [], 0
+    for name, csv_path, img_folder in list_days()[:limit]:
+        stamp = source_stamp(csv_path, img_folder)
+        if is_partition_done(output_path, name, stamp):
+            skipped += 1
             continue
+        todo.append((name, csv_path, img_folder, stamp))
+
+    # === モデル準備（ResNet50, avg_pool出力） ===
+    feature_model = build_feature_model(weights)
+    # 一度埋め込んだ画像は feature_cache/ から読むので、2回目以降は新しい画像だけを計算する
+    feature_cache = None
+    if use_cache:
+        feature_cache = FeatureCache.for_model(feature_model, dtype=cache_dtype)
 
-        # 気象特徴（必要なら追加）
-        weather_feat = [
-            row.get('temperature', np.nan),
-            row.get('humidity', np.nan)
-        ]
+    extractor = None
+    if workers > 1 and not shared_model:
+        fingerprint = model_fingerprint(feature_model) if use_cache else None
+        results = iter_parallel(todo, workers, weights, fingerprint)
+    else:
+        # 埋め込みは1つのモデルで行い、--workers のときは画像の読み込みをプロセスで並列にする
+        extractor = FeatureExtractor(feature_model, batch_size=batch_size,
+                                     workers=workers if workers > 1 else io_workers,
+                                     cache=feature_cache, processes=workers > 1,
+                                     frame_store=FrameStore(frame_root))
+        results = iter_serial(todo, extractor)
+
+    done, failed = 0, []
+    for (name, csv_path, img_folder, stamp), result in tqdm(results, total=len(todo), desc="CSV処理中"):
+        if isinstance(result, Exception):
+            print(f"[×] {os.path.basename(csv_path)} の処理に失敗しました（次回やり直します）: {result}")
+            failed.append(name)
+            continue
+        img_paths, feats, meta = result
+        if feature_cache is not None:
+            feature_cache.put_many(img_paths, feats)
+        write_partition(output_path, name, feats, meta, stamp)
+        done += 1
+    if extractor is not None:
+        extractor.close()
+    return done, skipped, failed
 
-        # ラベル（降水量）
-        label = row.get('precipitation', np.nan)
 
-        all_features.append(np.concatenate([feat, weather_feat]))
-        all_labels.append(label)
+def check(workers, shared_model, weights, limit):
+    """キャッシュを使わずに順番どおりと並列の両方で作り、パーティションが一致するか確かめる"""
+    tmp = tempfile.mkdtemp()
+    try:
+        if weights is None:
+            # 重みなしだとプロセスごとに乱数の重みが変わるので、一度作った重みを全員で読む
+            weights = os.path.join(tmp, 'resnet50.weights.h5')
+            build_feature_model(None).save_weights(weights)
+        serial_path = os.path.join(tmp, 'serial')
+        parallel_path = os.path.join(tmp, 'parallel')
+        build(serial_path, workers=1, weights=weights, use_cache=False, limit=limit)
+        build(parallel_path, workers=workers, shared_model=shared_model, weights=weights,
+              use_cache=False, limit=limit)
 
-# === 保存 ===
-feat_df = pd.DataFrame(all_features)
+        names = [name for name, _, _ in list_days()[:limit]]
+        for name in names:
+            a = FeatureStore(partition_path(serial_path, name))
+            b = FeatureStore(partition_path(parallel_path, name))
+            assert np.array_equal(a.embeddings, b.embeddings), f"{name}: 特徴が一致しません"
+            assert a.meta.equals(b.meta), f"{name}: メタデータが一致しません"
+        print(f"✅ {len(names)}日分のパーティションが順番どおりの結果と一致しました。")
+    finally:
+        shutil.rmtree(tmp)
 
-# ラベル列追加（回帰用と分類用）
-feat_df['precipitation'] = all_labels
-feat_df['rain_mm'] = feat_df['precipitation']
-feat_df['label'] = (feat_df['precipitation'] > 0).astype(int)
 
-feat_df.to_csv(output_path, index=False, encoding='utf-8-sig')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="日付ごとの特徴ストアを作る")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="並列に使うプロセス数（1なら順番に処理）")
+    parser.add_argument('--shared-model', action='store_true',
+                        help="日付を分担せず、画像の読み込みだけを並列にして1つのモデルで埋め込む")
+    parser.add_argument('--weights', default='imagenet',
+                        help="ResNet50 の重み（'none' で重みなし。--check の動作確認用）")
+    parser.add_argument('--check', action='store_true',
+                        help="順番どおりの結果と並列の結果が同じか確かめる（出力先には書かない）")
+    parser.add_argument('--limit', type=int, default=None, help="先頭から何日分を処理するか")
+    args = parser.parse_args()
+    weights = None if args.weights == 'none' else args.weights
 
-print(f"\n✅ 完了：{len(feat_df)}件の特徴データを {output_path} に保存しました。")
+    if args.check:
+        check(max(2, args.workers), args.shared_model, weights, args.limit)
+    else:
+        done, skipped, failed = build(output_path, args.workers, args.shared_model, weights,
+                                      limit=args.limit)
+        # === 結果 ===
+        print(f"\n✅ 完了：{done}日分を作成、{skipped}日分は変更なしのため省略しました（{output_path}）。")
+        if failed:
+            print(f"[!] 失敗 {len(failed)}日分: {', '.join(failed)}")
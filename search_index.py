@@ -0,0 +1,193 @@
+# search_index.py
+#
+# /logs の「ことばでさがす」用の転置索引。
+# 入力はほとんど日本語なので、単語ではなく文字の2-gramで索引を作る。
+#   - 各行の両端に BOUNDARY を付けるので、1文字だけの行や1文字検索も引ける
+#   - 2-gram → 記録の開始オフセット（昇順）の posting list
+#   - logs_local.txt.ngram に追記のみで保存し、起動時はそこから読み直す
+#
+# 索引ファイルの1行 = 1記録:
+#   開始オフセット \t 2-gramを重複なしで連結した文字列
+# 2-gramは必ず2文字なので区切り文字はいらない。
+
+import bisect
+import os
+import threading
+from array import array
+
+from log_store import last_line, lock_file, unlock_file
+
+BOUNDARY = "\x00"
+
+
+def bigrams(text):
+    grams = set()
+    for line in text.split("\n"):
+        line = line.replace("\t", " ").replace("\r", "")
+        padded = BOUNDARY + line + BOUNDARY
+        for i in range(len(padded) - 1):
+            grams.add(padded[i:i + 2])
+    return grams
+
+
+class NgramIndex:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.last_offset = -1  # 索引済みの最後の記録の開始オフセット
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8", newline="\n") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # 書き込み途中の行
+                offset, _, grams = line[:-1].partition("\t")
+                try:
+                    offset = int(offset)
+                except ValueError:
+                    continue
+                # 以前の版で複数ワーカーが同じ記録を書いた場合の重複は読み飛ばす
+                if offset <= self.last_offset:
+                    continue
+                self._add(offset, (grams[i:i + 2] for i in range(0, len(grams) - 1, 2)))
+
+    def _add(self, offset, grams):
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array("q")
+            posting.append(offset)
+        self.last_offset = offset
+
+    # --------------------
+    # 更新
+    # --------------------
+    def add(self, offset, text):
+        """記録1件を索引に加える（オフセットは昇順で渡すこと）"""
+        with self.lock:
+            if offset <= self.last_offset:
+                return
+            grams = bigrams(text)
+            self._add(offset, grams)
+            self._append(offset, grams)
+
+    def _append(self, offset, grams):
+        """索引ファイルに追記する。他のワーカーがすでに書いた記録なら書かない"""
+        with open(self.path, "ab+") as f:
+            lock_file(f, exclusive=True)
+            try:
+                line, complete = last_line(f)
+                try:
+                    written = int(line.partition(b"\t")[0])
+                except ValueError:
+                    written = -1
+                if offset > written:
+                    data = f"{offset}\t{''.join(grams)}\n"
+                    f.write((data if complete else "\n" + data).encode("utf-8"))
+                    f.flush()
+            finally:
+                unlock_file(f)
+
+    def update(self, log_store):
+        """ログに追記された記録のうち、まだ索引にないものだけを加える"""
+        with self.lock:
+            # ログが作り直された場合は索引も作り直す
+            if self.last_offset >= log_store.indexed_end:
+                self.postings = {}
+                self.last_offset = -1
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+        for log in log_store.read(log_store.positions_after(self.last_offset)):
+            self.add(log["offset"], log["user_input"])
+
+    # --------------------
+    # 検索
+    # --------------------
+    def search(self, keyword):
+        """keyword を含みうる記録の開始オフセットを昇順で返す（候補なので本文での確認が必要）"""
+        keyword = keyword.replace("\t", " ").replace("\r", "")
+        with self.lock:
+            if "\n" in keyword:
+                # 改行をまたぐキーワードは、行の区切りに BOUNDARY を付けた2-gramで引く
+                lines = keyword.split("\n")
+                grams = set()
+                for k, line in enumerate(lines):
+                    padded = (BOUNDARY if k > 0 else "") + line + \
+                        (BOUNDARY if k < len(lines) - 1 else "")
+                    grams.update(padded[i:i + 2] for i in range(len(padded) - 1))
+                if not grams:
+                    # 改行だけのキーワードは絞り込めないので、すべての記録が候補
+                    found = set()
+                    for posting in self.postings.values():
+                        found.update(posting)
+                    return sorted(found)
+            elif len(keyword) == 1:
+                # 1文字検索は、その文字を含む2-gramの和集合
+                found = set()
+                for gram, posting in self.postings.items():
+                    if keyword in gram:
+                        found.update(posting)
+                return sorted(found)
+            else:
+                grams = {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+            lists = []
+            for gram in grams:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    return []
+                lists.append(posting)
+
+        # 短い posting list から順に絞り込む。相手がずっと長いときだけ二分探索で確認する
+        lists.sort(key=len)
+        found = set(lists[0])
+        for other in lists[1:]:
+            if not found:
+                break
+            if len(other) > 32 * len(found):
+                found = {o for o in found
+                         if (i := bisect.bisect_left(other, o)) < len(other) and other[i] == o}
+            else:
+                found.intersection_update(other)
+        return sorted(found)
+
+if __name__ == "__main__":
+    # ベンチマーク: 合成データで検索時間を部分文字列スキャンと比べる
+    #   python search_index.py [件数 ...]
+    import random
+    import sys
+    import tempfile
+    import time
+
+    # 子どもの入力に近づけるため、ひらがな・カタカナ・漢字をまぜた語彙をランダムに作る
+    random.seed(0)
+    chars = [chr(c) for c in range(0x3041, 0x3094)] + [chr(c) for c in range(0x30A1, 0x30F5)] \
+        + list("雨雪風空山川海花犬猫鳥魚友達学校先生宿題遠足給食算数国語体育音楽図工")
+    words = ["".join(random.choices(chars, k=random.randint(2, 4))) for _ in range(5000)]
+    queries = [words[0], words[1] + words[2], words[3][:1], "ともだち", "宿題"]
+    sizes = [int(n) for n in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+
+    for n in sizes:
+        texts = ["".join(random.choices(words, k=random.randint(3, 12))) for _ in range(n)]
+        with tempfile.TemporaryDirectory() as tmp:
+            index = NgramIndex(os.path.join(tmp, "bench.ngram"))
+            t0 = time.perf_counter()
+            for offset, text in enumerate(texts):
+                index._add(offset, bigrams(text))
+            build = time.perf_counter() - t0
+
+            print(f"=== {n:,}件 （索引作成 {build:.1f}秒） ===")
+            for q in queries:
+                t0 = time.perf_counter()
+                hits = [o for o in index.search(q) if q in texts[o]]
+                t_index = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                scan = [o for o, text in enumerate(texts) if q in text]
+                t_scan = time.perf_counter() - t0
+
+                assert hits == scan
+                print(f"{q!r:>20}: {len(hits):>8}件  索引 {t_index * 1000:8.2f} ms  スキャン {t_scan * 1000:8.2f} ms")
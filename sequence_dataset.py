@@ -0,0 +1,219 @@
+# sequence_dataset.py
+#
+# 連続するカメラ画像 T 枚の並び (T, H, W, 3) を作り、tf.data で model.fit に流す。
+#   - 画像は frame_store.py が日付ごとに書き出した uint8 の memmap から読む（JPEG は読み直さない）
+#   - 並びは (日付, 最後の画像の位置) だけで表し、重なり合う並びをメモリ上に複製しない。
+#     バッチを作るときに memmap の連続した区間 frames[end - T + 1:end + 1] を切り出す
+#   - 間が max_gap より大きいところ（夜の間など）をまたぐ並びは作らない
+#   - stride 枚おきに並びを作る（stride=1 なら1枚ずつずらしたすべての並び）
+#
+# 正解（target）:
+#   "label"       最後の画像のラベル（A_model_YYYYMMDD.csv）。入力に気温・湿度も付ける
+#   "next_frame"  次の画像そのもの（ConvLSTM.py の ConvLSTM_network を次の画像の予測で学習する）
+
+import os
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from frame_store import FRAME_SIZE, FRAME_STORE_DIR, open_day
+
+SEQUENCE_LENGTH = 6
+MAX_GAP = np.timedelta64(30, "m")  # これ以上間があいたら別の並びとみなす
+
+
+def to_model_input(frames):
+    """uint8 の画像を 0〜1 の float32 にする（推論のときも同じ変換を使う）"""
+    return np.asarray(frames, dtype=np.float32) / 255.0
+
+
+def window_ends(times, length=SEQUENCE_LENGTH, stride=1, max_gap=MAX_GAP, horizon=0):
+    """間があかずに length 枚（と、その後 horizon 枚）が続く並びの、最後の画像の位置。
+
+    区切り（間が max_gap より大きいところ）から数えて stride 枚おきに選ぶ。
+    """
+    times = np.asarray(times, dtype="datetime64[ns]")
+    n = len(times)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    breaks = np.ones(n, dtype=bool)
+    breaks[1:] = np.diff(times) > max_gap
+    seg_start = np.maximum.accumulate(np.where(breaks, np.arange(n), 0))
+    seg_id = np.cumsum(breaks) - 1
+    seg_end = np.flatnonzero(np.append(breaks[1:], True))[seg_id]  # 区切りの最後の位置
+
+    ends = np.arange(n)
+    pos = ends - seg_start - (length - 1)  # 区切りの中で何番目の並びか
+    keep = (pos >= 0) & (pos % stride == 0) & (ends + horizon <= seg_end)
+    return ends[keep]
+
+
+def split_days(day_ids, n_days=None, test_size=0.2, random_state=42):
+    """日付の番号の配列を、日付単位で学習用・検証用の位置に分ける（重なった並びが両方に入らないように）"""
+    day_ids = np.asarray(day_ids)
+    if n_days is None:
+        n_days = int(day_ids.max()) + 1 if len(day_ids) else 0
+    rng = np.random.default_rng(random_state)
+    days = rng.permutation(n_days)
+    n_val = int(round(n_days * test_size)) if n_days > 1 else 0
+    val = np.isin(day_ids, days[:n_val])
+    return np.flatnonzero(~val), np.flatnonzero(val)
+
+
+class SequenceDataset:
+    """ラベル CSV の日付ごとに frame_store を開き、並びの一覧 (日付の番号, 最後の位置) を作る"""
+
+    def __init__(self, csv_paths, frame_root=FRAME_STORE_DIR, length=SEQUENCE_LENGTH, stride=1,
+                 size=FRAME_SIZE, target="label", max_gap=MAX_GAP):
+        if target not in ("label", "next_frame"):
+            raise ValueError("target must be 'label' or 'next_frame'")
+        self.length = length
+        self.size = size
+        self.target = target
+        self.days = []      # DayFrames
+        self.frames = []    # 日ごとの (N, H, W, 3) uint8 の memmap
+        self.weather = []   # 日ごとの (N, 2) 気温・湿度（画像の並びに合わせる。ラベルなしは NaN）
+        self.labels = []    # 日ごとの (N, 2) 降水の有無・降水量
+        day_ids, ends = [], []
+        for csv_path in csv_paths:
+            date_str = os.path.splitext(os.path.basename(csv_path))[0][-8:]
+            day = open_day(date_str, frame_root)
+            if day is None or tuple(size) not in day.sizes:
+                print(f"[×] {size[0]}x{size[1]} の画像の配列がありません"
+                      f"（python frame_store.py build で作ってください）: {date_str}")
+                continue
+
+            df = pd.read_csv(csv_path, encoding='utf-8-sig')
+            cols = df.reindex(columns=['filename', 'temperature', 'humidity', 'precipitation'])
+            rows = day.index[['filename']].merge(cols, on='filename', how='left')
+            values = rows[['temperature', 'humidity', 'precipitation']].apply(
+                pd.to_numeric, errors='coerce').to_numpy(dtype=np.float32)
+            weather = values[:, :2]
+            labels = np.stack([(values[:, 2] > 0).astype(np.float32), values[:, 2]], axis=1)
+            labels[np.isnan(values[:, 2])] = np.nan
+
+            if target == "label":
+                e = window_ends(day.times, length, stride, max_gap)
+                # 最後の画像にラベルと気温・湿度がある並びだけを使う
+                e = e[~np.isnan(labels[e]).any(axis=1) & ~np.isnan(weather[e]).any(axis=1)]
+            else:
+                e = window_ends(day.times, length, stride, max_gap, horizon=1)
+            day_ids.append(np.full(len(e), len(self.days)))
+            ends.append(e)
+            self.days.append(day)
+            self.frames.append(day.frames(size))
+            self.weather.append(weather)
+            self.labels.append(labels)
+
+        self.day_ids = np.concatenate(day_ids) if day_ids else np.zeros(0, dtype=np.int64)
+        self.ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ends)
+
+    @property
+    def frame_shape(self):
+        return (self.length,) + tuple(self.size) + (3,)
+
+    def gather(self, samples):
+        """並びの番号の配列から1バッチ分の numpy 配列を作る"""
+        frames = np.empty((len(samples),) + self.frame_shape, dtype=np.float32)
+        weather = np.empty((len(samples), 2), dtype=np.float32)
+        targets = np.empty((len(samples), 2), dtype=np.float32)
+        next_frames = np.empty((len(samples),) + self.frame_shape[1:], dtype=np.float32)
+        for k, s in enumerate(samples):
+            day, end = self.day_ids[s], self.ends[s]
+            frames[k] = to_model_input(self.frames[day][end - self.length + 1:end + 1])
+            if self.target == "label":
+                weather[k] = self.weather[day][end]
+                targets[k] = self.labels[day][end]
+            else:
+                next_frames[k] = to_model_input(self.frames[day][end + 1])
+        if self.target == "label":
+            return frames, weather, targets[:, :1], targets[:, 1:]
+        return frames, next_frames
+
+    def split_days(self, test_size=0.2, random_state=42):
+        """日付単位で学習用・検証用の並びの番号に分ける"""
+        return split_days(self.day_ids, len(self.days), test_size, random_state)
+
+    def as_tf_dataset(self, samples=None, batch_size=8, shuffle=False, seed=None):
+        """並びの番号を tf.data に流し、バッチごとに memmap から切り出して先読みする"""
+        if samples is None:
+            samples = np.arange(len(self))
+        ds = tf.data.Dataset.from_tensor_slices(np.asarray(samples, dtype=np.int64))
+        if shuffle:
+            ds = ds.shuffle(len(samples), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size)
+
+        if self.target == "label":
+            dtypes = [tf.float32] * 4
+            shapes = [(None,) + self.frame_shape, (None, 2), (None, 1), (None, 1)]
+        else:
+            dtypes = [tf.float32] * 2
+            shapes = [(None,) + self.frame_shape, (None,) + self.frame_shape[1:]]
+
+        def load(samples):
+            tensors = tf.numpy_function(self.gather, [samples], dtypes)
+            for t, shape in zip(tensors, shapes):
+                t.set_shape(shape)
+            if self.target == "label":
+                frames, weather, y_class, y_reg = tensors
+                return ({"img_input": frames, "weather_input": weather},
+                        {"class_output": y_class, "reg_output": y_reg})
+            return tuple(tensors)
+
+        return ds.map(load, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+
+def list_label_csvs(csv_root, mode='A'):
+    return [os.path.join(csv_root, f) for f in sorted(os.listdir(csv_root))
+            if f.startswith(f"{mode}_model_") and f.endswith('.csv')]
+
+
+if __name__ == "__main__":
+    # 合成データで、並びの切り出しが元の画像の順どおりになっているかを確かめる
+    import shutil
+    import tempfile
+
+    from tensorflow.keras.preprocessing import image
+
+    from frame_store import build_day
+
+    tmp = tempfile.mkdtemp()
+    try:
+        img_folder = os.path.join(tmp, "img", "20240701")
+        os.makedirs(img_folder)
+        times = list(pd.date_range("2024-07-01 06:00", periods=12, freq="2min")) + \
+            list(pd.date_range("2024-07-01 09:00", periods=5, freq="2min"))
+        rows = []
+        for i, t in enumerate(times):
+            name = t.strftime("%Y%m%d%H%M") + ".png"
+            pixel = np.full((32, 48, 3), i * 10, dtype=np.uint8)  # 何枚目かが画素値でわかる
+            image.array_to_img(pixel, scale=False).save(os.path.join(img_folder, name))
+            rows.append({"filename": name, "img_time": t, "temperature": 25.0, "humidity": 60.0,
+                         "precipitation": float(i % 3 == 0)})
+        csv_path = os.path.join(tmp, "A_model_20240701.csv")
+        pd.DataFrame(rows).to_csv(csv_path, index=False, encoding="utf-8-sig")
+        build_day(img_folder, os.path.join(tmp, "frames"), sizes=[(8, 8)])
+
+        data = SequenceDataset([csv_path], os.path.join(tmp, "frames"), length=4, stride=2,
+                               size=(8, 8))
+        # 06:00 からの12枚で 3, 5, 7, 9, 11 番目、09:00 からの5枚で 15 番目（12 + 3）が最後になる
+        assert data.ends.tolist() == [3, 5, 7, 9, 11, 15], data.ends
+        frames, weather, y_class, y_reg = data.gather(np.arange(len(data)))
+        first = np.round(frames[:, :, 0, 0, 0] * 255).astype(int) // 10
+        assert first.tolist()[0] == [0, 1, 2, 3] and first.tolist()[-1] == [12, 13, 14, 15]
+        assert y_reg[:, 0].tolist() == [float(e % 3 == 0) for e in data.ends]
+
+        batches = list(data.as_tf_dataset(batch_size=4))
+        assert sum(len(b[1]["class_output"]) for b in batches) == len(data)
+
+        nxt = SequenceDataset([csv_path], os.path.join(tmp, "frames"), length=4, size=(8, 8),
+                              target="next_frame")
+        x, y = nxt.gather(np.arange(len(nxt)))
+        assert np.allclose(y[:, 0, 0, 0], x[:, -1, 0, 0, 0] + 10 / 255)
+        print(f"✅ 並び {len(data)} 本（ラベル）/ {len(nxt)} 本（次の画像）を正しく切り出せました。")
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,464 @@
+# sql_log_store.py
+#
+# きもちの記録を SQL データベース（emotion_logs テーブル）に保存するバックエンド。
+# LogStore と同じ append / iter_logs / entries_from を持つので、main.py から差し替えられる。
+#   - ローカル・動作確認用は SQLite、本番用に PostgreSQL でも同じ列・索引を作る
+#   - 索引: (created_at), (color, created_at), 全文検索列 search_text
+#   - 全文検索は文字2-gramを16進にした単語の並び（SQLite: FTS5 / PostgreSQL: GIN）
+#   - 「オフセット」には行の id を使う（ページ送りのカーソル・集計の続きの位置）
+#   - 本文とキーワードの改行は LF にそろえ、ファイル版（log_store.py）と同じ部分一致にする
+#
+# logs_local.txt からの移行:
+#   python sql_log_store.py logs_local.txt emotion_logs.db
+# 移行先にすでに記録があれば断る（二重に入れない）。入れ直すときは --force で消してから入れる:
+#   python sql_log_store.py --force logs_local.txt emotion_logs.db
+# ファイル版と同じ記録が返るかの確認（DSN を渡すと PostgreSQL でも実際に確かめる）:
+#   python sql_log_store.py --check [postgresql://...]
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+from log_store import normalize_newlines
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS emotion_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        color VARCHAR(20) NOT NULL,
+        emotion_label VARCHAR(100) NOT NULL,
+        user_input TEXT,
+        search_text TEXT,
+        created_at TIMESTAMP NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS emotion_logs_created_at ON emotion_logs (created_at)",
+    "CREATE INDEX IF NOT EXISTS emotion_logs_color_created_at ON emotion_logs (color, created_at)",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS emotion_logs_fts USING fts5(
+        search_text, content='emotion_logs', content_rowid='id'
+    )""",
+]
+
+SEARCH_VECTOR = "to_tsvector('simple', search_text)"  # GIN 索引と検索で同じ式を使う
+
+POSTGRES_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS emotion_logs (
+        id SERIAL PRIMARY KEY,
+        color VARCHAR(20) NOT NULL,
+        emotion_label VARCHAR(100) NOT NULL,
+        user_input TEXT,
+        search_text TEXT,
+        created_at TIMESTAMP NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS emotion_logs_created_at ON emotion_logs (created_at)",
+    "CREATE INDEX IF NOT EXISTS emotion_logs_color_created_at ON emotion_logs (color, created_at)",
+    """CREATE INDEX IF NOT EXISTS emotion_logs_search_text
+        ON emotion_logs USING GIN (""" + SEARCH_VECTOR + ")",
+]
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def search_tokens(text, query=False):
+    """全文検索列に入れる単語（文字2-gramを16進にしたもの）。1文字だけの行はその1文字
+
+    query=True はキーワード用。キーワードの1文字だけの行（"あ\\nい" など）は本文の行の
+    一部かもしれないので単語にしない（単語がなければ本文の部分一致だけで探す）。
+    """
+    tokens = []
+    for line in normalize_newlines(text).split("\n"):
+        if len(line) == 1 and not query:
+            tokens.append(line.encode("utf-8").hex())
+        for i in range(len(line) - 1):
+            tokens.append(line[i:i + 2].encode("utf-8").hex())
+    return list(dict.fromkeys(tokens))
+
+
+def date_range(prefix):
+    """date フィルター（YYYY / YYYY-MM / YYYY-MM-DD）を [開始, 終了) の時刻に変換する"""
+    try:
+        if len(prefix) == 10:
+            start = date.fromisoformat(prefix)
+            end = start + timedelta(days=1)
+        elif len(prefix) == 7:
+            start = date.fromisoformat(prefix + "-01")
+            end = (start + timedelta(days=31)).replace(day=1)
+        elif len(prefix) == 4:
+            start = date(int(prefix), 1, 1)
+            end = date(int(prefix) + 1, 1, 1)
+        else:
+            return None
+    except ValueError:
+        return None
+    return f"{start} 00:00:00", f"{end} 00:00:00"
+
+
+def keyword_clause(dialect, keyword):
+    """キーワードの WHERE 句とパラメーター。全文検索索引で候補を絞り、本文の部分一致で確かめる"""
+    keyword = normalize_newlines(keyword)
+    tokens = search_tokens(keyword, query=True) if len(keyword) > 1 else []
+    # 本文での確認（大文字小文字を区別する部分一致）
+    contains = "instr(user_input, ?) > 0" if dialect == "sqlite" else "strpos(user_input, %s) > 0"
+    if not tokens:
+        return contains, [keyword]
+    if dialect == "sqlite":
+        fts = "id IN (SELECT rowid FROM emotion_logs_fts WHERE emotion_logs_fts MATCH ?)"
+        return f"{fts} AND {contains}", [" ".join(tokens), keyword]
+    fts = f"{SEARCH_VECTOR} @@ to_tsquery('simple', %s)"
+    return f"{fts} AND {contains}", [" & ".join(tokens), keyword]
+
+
+def select_logs(dialect, filter_color=None, keyword=None, date=None, before=None, limit=None):
+    """iter_logs の SELECT 文とパラメーター（日付が読めないときは None）。
+    ページ送りは id のキーセット（id < before ORDER BY id DESC）"""
+    ph = "?" if dialect == "sqlite" else "%s"
+    where, params = [], []
+    if filter_color:
+        where.append(f"color = {ph}")
+        params.append(filter_color)
+    if date:
+        span = date_range(date)
+        if span is None:
+            return None
+        where.append(f"created_at >= {ph} AND created_at < {ph}")
+        params.extend(span)
+    if keyword:
+        clause, clause_params = keyword_clause(dialect, keyword)
+        where.append(clause)
+        params.extend(clause_params)
+    if before is not None:
+        where.append(f"id < {ph}")
+        params.append(before)
+    sql = "SELECT id, created_at, color, emotion_label, user_input FROM emotion_logs"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, params
+
+
+class SqlLogStore:
+    def __init__(self, connect, dialect="sqlite"):
+        if dialect not in ("sqlite", "postgres"):
+            raise ValueError("dialect must be 'sqlite' or 'postgres'")
+        self.connect = connect
+        self.dialect = dialect
+        self.ph = "?" if dialect == "sqlite" else "%s"
+        self.local = threading.local()
+        conn = self._conn()
+        cur = conn.cursor()
+        for ddl in (SQLITE_SCHEMA if dialect == "sqlite" else POSTGRES_SCHEMA):
+            cur.execute(ddl)
+        conn.commit()
+
+    @classmethod
+    def sqlite(cls, path):
+        def connect():
+            conn = sqlite3.connect(path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return conn
+        return cls(connect, "sqlite")
+
+    @classmethod
+    def postgres(cls, dsn):
+        import psycopg2
+        return cls(lambda: psycopg2.connect(dsn), "postgres")
+
+    def _conn(self):
+        # 接続はスレッドやfork後のプロセスをまたげないので、それぞれで1本持つ
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = self.connect()
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    # --------------------
+    # 書き込み
+    # --------------------
+    def clear(self):
+        """記録をすべて消し、id を 1 から振り直す（移行のやり直し用）"""
+        conn = self._conn()
+        cur = conn.cursor()
+        try:
+            if self.dialect == "sqlite":
+                cur.execute("INSERT INTO emotion_logs_fts (emotion_logs_fts) VALUES ('delete-all')")
+                cur.execute("DELETE FROM emotion_logs")
+                cur.execute("DELETE FROM sqlite_sequence WHERE name = 'emotion_logs'")
+            else:
+                cur.execute("TRUNCATE emotion_logs RESTART IDENTITY")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def append(self, timestamp, color, emotion_label, user_input):
+        self.append_many([(timestamp, color, emotion_label, user_input)])
+
+    def append_many(self, records):
+        """(timestamp, color, emotion_label, user_input) をまとめて1トランザクションで入れる"""
+        conn = self._conn()
+        cur = conn.cursor()
+        ph = self.ph
+        sql = (f"INSERT INTO emotion_logs (created_at, color, emotion_label, user_input, search_text)"
+               f" VALUES ({ph}, {ph}, {ph}, {ph}, {ph})")
+        try:
+            for timestamp, color, emotion_label, user_input in records:
+                user_input = normalize_newlines(user_input)
+                search_text = " ".join(search_tokens(user_input))
+                cur.execute(sql, (timestamp, color, emotion_label, user_input, search_text))
+                if self.dialect == "sqlite":
+                    cur.execute("INSERT INTO emotion_logs_fts (rowid, search_text) VALUES (?, ?)",
+                                (cur.lastrowid, search_text))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # --------------------
+    # 読み出し
+    # --------------------
+    def iter_logs(self, filter_color=None, keyword=None, date=None, before=None, limit=None,
+                  offsets=None):
+        """新しい順に記録を返す。絞り込みはすべて索引で行う"""
+        query = select_logs(self.dialect, filter_color=filter_color, keyword=keyword, date=date,
+                            before=before, limit=limit)
+        if query is None:
+            return
+        sql, params = query
+        cur = self._conn().cursor()
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(100)
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_log(row)
+
+    def _row_to_log(self, row):
+        row_id, created_at, color, emotion_label, user_input = row
+        if isinstance(created_at, datetime):
+            created_at = created_at.strftime(TIMESTAMP_FORMAT)
+        return {
+            "created_at": created_at,
+            "color": color,
+            "emotion_label": emotion_label,
+            "user_input": user_input,
+            "offset": row_id
+        }
+
+    def logs_after(self, offset):
+        """id が offset より大きい記録を古い順に返す（ライブ配信用）"""
+        cur = self._conn().cursor()
+        cur.execute("SELECT id, created_at, color, emotion_label, user_input FROM emotion_logs"
+                    f" WHERE id > {self.ph} ORDER BY id", (offset,))
+        return [self._row_to_log(row) for row in cur.fetchall()]
+
+    def latest_offset(self):
+        """いちばん新しい記録の id（記録がなければ -1）"""
+        cur = self._conn().cursor()
+        cur.execute("SELECT COALESCE(MAX(id), -1) FROM emotion_logs")
+        return cur.fetchone()[0]
+
+    @property
+    def indexed_end(self):
+        cur = self._conn().cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM emotion_logs")
+        return cur.fetchone()[0]
+
+    def count(self):
+        cur = self._conn().cursor()
+        cur.execute("SELECT COUNT(*) FROM emotion_logs")
+        return cur.fetchone()[0]
+
+    def entries_from(self, offset):
+        """id が offset 以降の記録の (id, id + 1, タイムスタンプ, 色) を古い順に返す（集計用）"""
+        cur = self._conn().cursor()
+        cur.execute(f"SELECT id, created_at, color FROM emotion_logs WHERE id >= {self.ph} ORDER BY id",
+                    (offset,))
+        entries = []
+        for row_id, created_at, color in cur.fetchall():
+            if isinstance(created_at, datetime):
+                created_at = created_at.strftime(TIMESTAMP_FORMAT)
+            entries.append((row_id, row_id + 1, created_at, color))
+        return entries
+
+
+def migrate(log_path, store, batch_size=1000, force=False):
+    """logs_local.txt を先頭から少しずつ読み、batch_size 件ずつ SQL に入れる
+
+    すでに記録の入ったテーブルに入れると同じ記録が二重になるので、空でなければ ValueError。
+    force=True なら入っている記録を消してから入れ直す。
+    """
+    from log_store import iter_file_records
+
+    existing = store.count()
+    if existing and not force:
+        raise ValueError(f"emotion_logs にはすでに {existing}件の記録があります")
+    if existing:
+        store.clear()
+    batch = []
+    total = 0
+    for log in iter_file_records(log_path):
+        batch.append((log["created_at"], log["color"], log["emotion_label"], log["user_input"]))
+        if len(batch) >= batch_size:
+            store.append_many(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        store.append_many(batch)
+        total += len(batch)
+    return total
+
+
+def _postgres_scratch(dsn):
+    """check 用に、使い捨てのスキーマに emotion_logs を作った PostgreSQL のストアを返す"""
+    import psycopg2
+
+    schema = f"emotion_logs_check_{os.getpid()}"
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    store = SqlLogStore(lambda: psycopg2.connect(dsn, options=f"-c search_path={schema}"), "postgres")
+
+    def drop():
+        store._conn().close()
+        admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+    return store, drop
+
+
+def check(dsn=None):
+    """ファイル版（LogStore と 2-gram 索引）と同じ記録が同じ順に返るかを確かめる。
+
+    dsn がなければ PostgreSQL は SQL の組み立て（プレースホルダー・tsquery・GIN 索引の式・
+    id のキーセットでのページ送り）までを確かめ、dsn があれば実際に入れて引いてみる。
+    """
+    import tempfile
+
+    from log_store import LogStore
+    from search_index import NgramIndex
+
+    texts = ["ab\ncd", "あめ\nはれ", "x", "ともだち\r\nと\r\nあそんだ", "b\nc", "雨",
+             "きょうは\rあめ", "abc", "ともだちと あそんだ", "はれ\nあめ\nくもり"]
+    keywords = ["b\nc", "ab\ncd", "め\nは", "と\r\nあ", "\n", "と", "ともだち", "x", "雨",
+                "あめ", "zz", "れ\nあめ\nく"]
+    records = [(f"2025-07-{1 + n % 3:02d} 12:00:{n:02d}", ("pink", "blue")[n % 2], "😄 うれしい", text)
+               for n, text in enumerate(texts)]
+
+    # PostgreSQL の SQL（実行はしない）
+    for keyword in keywords:
+        sql, params = select_logs("postgres", filter_color="pink", keyword=keyword, date="2025-07",
+                                  before=10, limit=5)
+        assert "?" not in sql and sql.count("%s") == len(params), (sql, params)
+        assert sql.endswith("id < %s ORDER BY id DESC LIMIT 5"), sql
+        if "to_tsquery" in sql:
+            assert f"{SEARCH_VECTOR} @@ to_tsquery('simple', %s)" in sql, sql
+            assert re.fullmatch(r"[0-9a-f]+( & [0-9a-f]+)*", params[3]), params[3]
+    assert SEARCH_VECTOR in POSTGRES_SCHEMA[-1]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "logs.txt")
+        file_store = LogStore(path, fsync="never")
+        for timestamp, color, label, text in records:
+            # main.save_log と同じく改行をそろえてから書く
+            file_store.append(timestamp, color, label, normalize_newlines(text))
+        index = NgramIndex(path + ".ngram")
+        index.update(file_store)
+
+        stores = {"SQLite": (SqlLogStore.sqlite(os.path.join(tmp, "logs.db")), None)}
+        if dsn:
+            stores["PostgreSQL"] = _postgres_scratch(dsn)
+        try:
+            for store, _ in stores.values():
+                store.append_many(records)
+
+            def paged(store, **filters):
+                # 2件ずつ、前のページの最後のオフセットを before にして読む
+                texts, before = [], None
+                while True:
+                    page = list(store.iter_logs(before=before, limit=2, **filters))
+                    texts += [log["user_input"] for log in page]
+                    if len(page) < 2:
+                        return texts
+                    before = page[-1]["offset"]
+
+            checked = 0
+            for keyword in keywords:
+                keyword = normalize_newlines(keyword)  # main.py でそろえてから渡す
+                for filters in ({}, {"filter_color": "pink"}, {"date": "2025-07-02"}):
+                    expected = [log["user_input"]
+                                for log in file_store.iter_logs(keyword=keyword, **filters)]
+                    indexed = [log["user_input"] for log in file_store.iter_logs(
+                        keyword=keyword, offsets=index.search(keyword), **filters)]
+                    assert indexed == expected, (keyword, filters, indexed, expected)
+                    for name, (store, _) in stores.items():
+                        got = paged(store, keyword=keyword, **filters)
+                        assert got == expected, (name, keyword, filters, got, expected)
+                    checked += 1
+            assert checked and paged(stores["SQLite"][0]) == [log["user_input"]
+                                                               for log in file_store.iter_logs()]
+
+            # 移行をやり直しても二重にならない（空でなければ断り、force なら入れ直す）
+            expected = [log["user_input"] for log in file_store.iter_logs()]
+            for name, (store, _) in stores.items():
+                try:
+                    migrate(path, store)
+                except ValueError:
+                    pass
+                else:
+                    raise AssertionError(f"{name}: 記録の入ったテーブルにもう一度移行した")
+                assert migrate(path, store, force=True) == store.count() == len(records), name
+                assert paged(store) == expected, name
+                assert paged(store, keyword="ともだち") == [
+                    log["user_input"] for log in file_store.iter_logs(keyword="ともだち")], name
+
+            if dsn:
+                # 件数が少なくても GIN 索引を使う計画になるか
+                store = stores["PostgreSQL"][0]
+                sql, params = select_logs("postgres", keyword="ともだち")
+                cur = store._conn().cursor()
+                cur.execute("SET enable_seqscan = off")
+                cur.execute("EXPLAIN " + sql, params)
+                plan = "\n".join(row[0] for row in cur.fetchall())
+                assert "emotion_logs_search_text" in plan, plan
+        finally:
+            for _, drop in stores.values():
+                if drop:
+                    drop()
+
+    print(f"✅ {' / '.join(stores)}: キーワード {len(keywords)}種 × 条件3種でファイル版と同じ記録が"
+          f"同じ順に返りました（改行をまたぐキーワード・ページ送りを含む）")
+    if not dsn:
+        print("   PostgreSQL は SQL の組み立てだけ確認しました（--check <DSN> で実際のDBに対して確認できます）")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--check":
+        check(sys.argv[2] if len(sys.argv) > 2 else None)
+        sys.exit(0)
+    force = "--force" in sys.argv[1:]
+    args = [a for a in sys.argv[1:] if a != "--force"]
+    if len(args) < 2:
+        print("使い方: python sql_log_store.py [--force] <logs_local.txt> <SQLiteファイル | postgresql://...>")
+        print("        （--force: 移行先に記録があれば消してから入れ直す）")
+        print("        python sql_log_store.py --check [postgresql://...]")
+        sys.exit(1)
+
+    log_path, target = args[0], args[1]
+    if target.startswith(("postgres://", "postgresql://")):
+        store = SqlLogStore.postgres(target)
+    else:
+        store = SqlLogStore.sqlite(target)
+    try:
+        total = migrate(log_path, store, force=force)
+    except ValueError as e:
+        print(f"❌ {e}。移行済みなら何もしなくてかまいません（入れ直すなら --force）")
+        sys.exit(1)
+    print(f"✅ {total}件を移行しました → {target}")
+    if force:
+        print("   集計のスナップショット（*.stats.json）は古い記録のものなので、消してから起動してください")
@@ -0,0 +1,201 @@
+# streaming.py
+#
+# ライブカメラ向けに、画像が1枚届くたびに1ステップだけ進める推論。
+#   - PredNet（PredNet.py）は r / c / e（extrap_start_time があれば ahat / t も）の状態を、
+#     ConvLSTM_network（ConvLSTM.py）は ConvLSTM 層ごとの h / c の状態を、呼び出しの間で持ち続ける
+#   - 窓全体 (T, H, W, C) を毎回計算し直さないので、1枚あたりの計算は T によらない
+#   - snapshot() で状態を取り出し、restore() で戻せる（別の続きを試す、再起動をまたぐなど）
+# 出力は、それまでの画像をまとめてモデルに入れたとき（return_sequences=True の各ステップ）と同じ。
+#
+#   stream = PredNetStream(model)     # PredNet 層を含むモデル（または PredNet 層そのもの）
+#   pred = stream.step(frame)         # frame: (H, W, C)。次の画像の予測（output_mode による）
+#
+#   python streaming.py               バッチの計算と一致するかを確かめる
+#   python streaming.py bench         1枚ずつ進める場合と、窓全体を計算し直す場合を比べる
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras import layers
+
+from PredNet import PredNet
+
+
+class _Stream:
+    """状態を持ち、1枚ずつ進める共通部分。子クラスは _initial_states と _step を用意する"""
+
+    def __init__(self, batch_size=1):
+        self.batch_size = batch_size
+        # 形が変わらないかぎり、1ステップの計算は1回だけトレースされる
+        self._compiled = tf.function(self._step)
+        self.reset()
+
+    def reset(self):
+        self.states = self._initial_states(self.batch_size)
+        self.t = 0
+
+    def step(self, frame):
+        """画像1枚（(H, W, C) または (batch, H, W, C)）を入れて、そのステップの出力を返す"""
+        x = np.asarray(frame, dtype=np.float32)
+        single = x.ndim == 3
+        if single:
+            x = x[None]
+        if x.shape[0] != self.batch_size:
+            raise ValueError(f"batch size must be {self.batch_size}, got {x.shape[0]}")
+        output, self.states = self._compiled(tf.constant(x), list(self.states))
+        self.t += 1
+        output = np.asarray(output)
+        return output[0] if single else output
+
+    def snapshot(self):
+        """いまの状態のコピー（restore() に渡す）"""
+        return {"t": self.t, "states": [np.array(s) for s in self.states]}
+
+    def restore(self, snapshot):
+        self.t = snapshot["t"]
+        self.states = [tf.constant(s) for s in snapshot["states"]]
+
+
+class PredNetStream(_Stream):
+    def __init__(self, model, batch_size=1):
+        layer = model if isinstance(model, PredNet) else next(
+            (l for l in model.layers if isinstance(l, PredNet)), None)
+        if layer is None:
+            raise ValueError("model has no PredNet layer")
+        if not layer.built:
+            raise ValueError("PredNet layer must be built (call the model once or give an Input)")
+        self.cell = layer.cell
+        super().__init__(batch_size)
+
+    def _initial_states(self, batch_size):
+        return self.cell.get_initial_state(batch_size=batch_size)
+
+    def _step(self, x, states):
+        return self.cell(x, states)
+
+
+class ConvLSTMStream(_Stream):
+    """ConvLSTM2D の層は h / c を持って1ステップずつ進め、ほかの層（BatchNormalization など）は
+    各ステップの画像にそのまま使う。最後の ConvLSTM2D が return_sequences=False でも、
+    出力はそのステップまでの並びを入れたときの出力と同じになる"""
+
+    def __init__(self, model, batch_size=1):
+        self.model = model
+        self.layers = [l for l in model.layers if not isinstance(l, layers.InputLayer)]
+        if not any(isinstance(l, layers.ConvLSTM2D) for l in self.layers):
+            raise ValueError("model has no ConvLSTM2D layer")
+        self.frame_shape = tuple(model.inputs[0].shape[2:])
+        super().__init__(batch_size)
+
+    def _initial_states(self, batch_size):
+        states = []
+        shape = (batch_size,) + self.frame_shape
+        for layer in self.layers:
+            if isinstance(layer, layers.ConvLSTM2D):
+                out = layer.compute_output_shape((batch_size, 1) + shape[1:])
+                shape = (batch_size,) + tuple(out[-3:])
+                states += [tf.zeros(shape), tf.zeros(shape)]  # h, c
+            else:
+                shape = tuple(layer.compute_output_shape(shape))
+        return states
+
+    def _step(self, x, states):
+        new_states = []
+        k = 0
+        for layer in self.layers:
+            if isinstance(layer, layers.ConvLSTM2D):
+                x, (h, c) = layer.cell(x, states[k:k + 2], training=False)
+                new_states += [h, c]
+                k += 2
+            else:
+                # 層は (batch, T, ...) の形で作られているので、形の確認をせずに1枚分に使う
+                x = layer.call(x, training=False)
+        return x, new_states
+
+
+def check():
+    """バッチで計算した出力と、1枚ずつ進めた出力が一致するか確かめる"""
+    from ConvLSTM import ConvLSTM_network
+    from PredNet import build_prednet_model
+
+    rng = np.random.default_rng(0)
+    T, H, W = 6, 16, 16
+    x = rng.random((1, T, H, W, 3)).astype(np.float32)
+
+    for mode, extrap in (('prediction', None), ('error', None), ('R1', None), ('prediction', 3)):
+        model = build_prednet_model((T, H, W, 3), stack_sizes=(3, 8), output_mode=mode,
+                                    extrap_start_time=extrap)
+        batch = np.asarray(model(x))[0]
+        stream = PredNetStream(model)
+        streamed = np.stack([stream.step(x[0, t]) for t in range(T)])
+        assert np.allclose(batch, streamed, atol=1e-5), (mode, np.abs(batch - streamed).max())
+
+    # 途中で状態を取っておき、別の画像を入れたあとに戻しても同じ続きになる
+    stream = PredNetStream(model)
+    for t in range(2):
+        stream.step(x[0, t])
+    snap = stream.snapshot()
+    expected = [stream.step(x[0, t]) for t in range(2, T)]
+    stream.restore(snap)
+    stream.step(rng.random((H, W, 3)))
+    stream.restore(snap)
+    again = [stream.step(x[0, t]) for t in range(2, T)]
+    assert all(np.allclose(a, b) for a, b in zip(expected, again))
+
+    for return_seq in (True, False):
+        model = ConvLSTM_network((T, H, W, 3), return_seq=return_seq)
+        # BatchNormalization が恒等写像にならないよう、移動平均・分散を適当な値にする
+        for layer in model.layers:
+            if isinstance(layer, layers.BatchNormalization):
+                layer.moving_mean.assign(rng.normal(0, 0.1, layer.moving_mean.shape))
+                layer.moving_variance.assign(rng.uniform(0.5, 2, layer.moving_variance.shape))
+        stream = ConvLSTMStream(model)
+        streamed = np.stack([stream.step(x[0, t]) for t in range(T)])
+        if return_seq:
+            batch = np.asarray(model(x, training=False))[0]
+            assert np.allclose(batch, streamed, atol=1e-4), np.abs(batch - streamed).max()
+        else:
+            # return_sequences=False のモデルは、t 枚目までを入れたときの出力と比べる
+            for t in (1, T // 2, T):
+                batch = np.asarray(model(x[:, :t], training=False))[0]
+                assert np.allclose(batch, streamed[t - 1], atol=1e-4), t
+    print("✅ PredNet / ConvLSTM: 1枚ずつ進めた出力がバッチの出力と一致しました（snapshot / restore も OK）。")
+
+
+def bench(T=10, size=(64, 64), frames=20):
+    """新しい画像が届くたびに、1ステップだけ進める場合と窓全体 T 枚を計算し直す場合を比べる"""
+    import time
+
+    from PredNet import build_prednet_model
+
+    rng = np.random.default_rng(0)
+    video = rng.random((frames + T,) + size + (3,)).astype(np.float32)
+    model = build_prednet_model((T,) + size + (3,), output_mode='prediction', return_sequences=False)
+    window = tf.function(lambda v: model(v, training=False))
+    stream = PredNetStream(model)
+
+    window(video[None, :T])
+    for t in range(T):
+        stream.step(video[t])
+
+    t0 = time.perf_counter()
+    for t in range(T, T + frames):
+        np.asarray(window(video[None, t - T + 1:t + 1]))
+    dt_window = (time.perf_counter() - t0) / frames
+
+    t0 = time.perf_counter()
+    for t in range(T, T + frames):
+        stream.step(video[t])
+    dt_stream = (time.perf_counter() - t0) / frames
+
+    print(f"PredNet {size[0]}x{size[1]}, T={T}: 1枚あたり")
+    print(f"  窓全体を計算し直す : {dt_window * 1000:8.1f} ms")
+    print(f"  1ステップだけ進める: {dt_stream * 1000:8.1f} ms（{dt_window / dt_stream:.1f} 倍）")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        bench()
+    else:
+        check()
@@ -0,0 +1,81 @@
+# subscribers.py
+#
+# LINE の友だち（通知の宛先）を SQLite（WAL モード）で管理する。
+#   - follow / unfollow ごとに1行追加・削除するだけ（全件の書き直しはしない）
+#   - gunicorn の各ワーカーは同じ DB を見るので、どのワーカーでも最新の宛先になる
+#   - 送信側は iter_batches() で少しずつ読み出せる（全件をメモリに載せない）
+
+import json
+import os
+import sqlite3
+import threading
+
+
+class SubscriberStore:
+    def __init__(self, path, legacy_json=None):
+        self.path = path
+        self.local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscribers ("
+            " user_id TEXT PRIMARY KEY,"
+            " followed_at TEXT DEFAULT CURRENT_TIMESTAMP"
+            ")"
+        )
+        conn.commit()
+        if legacy_json:
+            self._import_json(legacy_json)
+
+    def _conn(self):
+        # sqlite3 の接続はスレッドやfork後のプロセスをまたげないので、それぞれで1本持つ
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def _import_json(self, json_path):
+        """以前の users.json があれば一度だけ取り込む"""
+        if not os.path.exists(json_path) or self.count() > 0:
+            return
+        with open(json_path, "r", encoding="utf-8") as f:
+            try:
+                user_ids = json.load(f)
+            except json.JSONDecodeError:
+                return
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)",
+                ((user_id,) for user_id in user_ids)
+            )
+
+    def add(self, user_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)", (user_id,))
+
+    def remove(self, user_id):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM subscribers WHERE user_id = ?", (user_id,))
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM subscribers").fetchone()[0]
+
+    def iter_batches(self, size=500):
+        """user_id を size 件ずつのリストで返す（キーの続きから読むので途中の追加・削除に強い）"""
+        conn = self._conn()
+        last = ""
+        while True:
+            rows = conn.execute(
+                "SELECT user_id FROM subscribers WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (last, size)
+            ).fetchall()
+            if not rows:
+                return
+            yield [row[0] for row in rows]
+            last = rows[-1][0]
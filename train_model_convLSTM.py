@@ -1,38 +1,23 @@
 # train_model_convLSTM.py
 
-import pandas as pd
-import numpy as np
-from sklearn.model_selection import train_test_split
 from tensorflow.keras import layers, models, Input
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping
-
-# === データ読み込み ===
-df = pd.read_csv("features_dataset.csv", encoding="utf-8-sig")
-
-# 欠損値除去
-df = df.dropna(subset=["temperature", "humidity", "precipitation", "label"])
-
-# === 特徴量とラベル ===
-X = df.iloc[:, :2050].values.astype(np.float32)  # 2048 + 2 の特徴量
-y_class = df["label"].values.astype(np.float32)  # 分類用
-y_reg = df["precipitation"].values.astype(np.float32)  # 回帰用
-
-# === 特徴量を時系列として扱う（ダミーでT=1）===
-# ConvLSTMの入力: (samples, timesteps, height, width, channels)
-# ここでは画像1枚（flatten済み）を (1, 32, 64, 1) のように reshape
-# 例：2050 = 32×64 に reshape（要調整）
-
-T, H, W, C = 1, 32, 64, 1
-X_seq = X.reshape((-1, T, H, W, C))
-
-# === 気象データだけ抽出（気温＋湿度）===
-weather_feat = X[:, -2:]  # 最後の2列
-
-# === データ分割 ===
-X_img_train, X_img_val, weather_train, weather_val, y_class_train, y_class_val, y_reg_train, y_reg_val = train_test_split(
-    X_seq, weather_feat, y_class, y_reg, test_size=0.2, random_state=42
-)
+from frame_store import FRAME_STORE_DIR
+from sequence_dataset import SEQUENCE_LENGTH, SequenceDataset, list_label_csvs
+
+# === データ読み込み（連続する T 枚の画像の並び。画像は frame_store の memmap から読む） ===
+# 先に python frame_store.py build <画像フォルダ> で日付ごとの画像の配列を作っておく
+csv_root = r'\\150.89.226.195\Private\7期生\西山\Attached_WeatherData'  # A_model_*.csv
+T, STRIDE = SEQUENCE_LENGTH, 1
+data = SequenceDataset(list_label_csvs(csv_root), FRAME_STORE_DIR, length=T, stride=STRIDE)
+H, W, C = data.frame_shape[1:]
+print(f"並び: {len(data)} 本（{len(data.days)}日分, T={T}, stride={STRIDE}）")
+
+# === データ分割（重なった並びが学習と検証の両方に入らないよう、日付で分ける） ===
+train_idx, val_idx = data.split_days(test_size=0.2, random_state=42)
+train_ds = data.as_tf_dataset(train_idx, batch_size=32, shuffle=True, seed=42)
+val_ds = data.as_tf_dataset(val_idx, batch_size=32)
 
 # === モデル定義 ===
 
@@ -66,11 +51,9 @@ model.summary()
 callbacks = [EarlyStopping(patience=5, restore_best_weights=True)]
 
 history = model.fit(
-    [X_img_train, weather_train],
-    {'class_output': y_class_train, 'reg_output': y_reg_train},
-    validation_data=([X_img_val, weather_val], {'class_output': y_class_val, 'reg_output': y_reg_val}),
+    train_ds,
+    validation_data=val_ds if len(val_idx) else None,
     epochs=50,
-    batch_size=32,
     callbacks=callbacks
 )
 
@@ -0,0 +1,100 @@
+# train_nowcast.py
+#
+# 5分後〜30分後の降水を1回でまとめて予測するモデル（nowcast.py）を学習する。
+#   画像特徴: features_dataset（prepare_dataset.py で作る特徴ストア）
+#   正解    : weather_store（download_weather_data.py が足していく10分値）
+
+import numpy as np
+import pandas as pd
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.utils import Sequence
+from feature_store import open_feature_store
+from sequence_dataset import split_days
+from weather_store import WeatherStore
+from nowcast import (HORIZONS, NOWCAST_MODEL_PATH, SEQUENCE_LENGTH, build_nowcast_model,
+                     horizon_targets, sequence_index)
+
+# === データ読み込み ===
+# 特徴行列はパーティション（日付）ごとの memmap のまま持ち、バッチを作るときに必要な行だけ読む
+store = open_feature_store("features_dataset")
+parts = [(emb, meta.reset_index(drop=True)) for emb, meta in store.iter_slices()]
+if not parts:
+    raise SystemExit("特徴ストアが空です（python prepare_dataset.py で作ってください）")
+meta = pd.concat([m for _, m in parts], ignore_index=True)
+part_id = np.concatenate([np.full(len(m), p) for p, (_, m) in enumerate(parts)])
+times = meta["img_time"].to_numpy()
+weather = WeatherStore("weather_store")
+
+# === 正解（各時間の10分間降水量と、雨かどうか） ===
+y_reg = horizon_targets(weather, times)
+y_class = (y_reg > 0).astype(np.float32)
+weather_feat = meta[["temperature", "humidity"]].to_numpy(dtype=np.float32)
+
+# 各画像について直前 SEQUENCE_LENGTH 枚の画像の、同じパーティションの中での行番号
+seq = np.concatenate([sequence_index(m["img_time"].to_numpy(), SEQUENCE_LENGTH) for _, m in parts])
+
+# 欠損値除去（どれかの時間の正解がない、気温・湿度がない）
+keep = ~np.isnan(y_reg).any(axis=1) & ~np.isnan(weather_feat).any(axis=1)
+rows = np.flatnonzero(keep)
+print(f"学習に使える画像: {len(rows)} / {len(meta)} 枚（予測する時間: {HORIZONS} 分後）")
+
+
+class NowcastBatches(Sequence):
+    """画像特徴の並びはバッチごとに組み立てる（全部を (N, T, 2048) で持つと大きすぎる）"""
+
+    def __init__(self, rows, batch_size=32, shuffle=False, **kwargs):
+        super().__init__(**kwargs)
+        self.rows = rows
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.order = np.arange(len(rows))
+
+    def __len__(self):
+        return (len(self.rows) + self.batch_size - 1) // self.batch_size
+
+    def __getitem__(self, i):
+        batch = self.rows[self.order[i * self.batch_size:(i + 1) * self.batch_size]]
+        frames = np.empty((len(batch), SEQUENCE_LENGTH, parts[0][0].shape[1]), dtype=np.float32)
+        # バッチに入ったパーティションの memmap から、それぞれの並びの行だけを読む
+        for p in np.unique(part_id[batch]):
+            sel = part_id[batch] == p
+            frames[sel] = parts[p][0][seq[batch[sel]]]
+        return ({"frames": frames, "weather_input": weather_feat[batch]},
+                {"class_output": y_class[batch], "reg_output": y_reg[batch]})
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
+
+# === データ分割 ===
+# 日付単位で分ける（重なり合う並びが学習用と検証用の両方に入らないように）
+day_ids, days = pd.factorize(meta["img_time"].dt.normalize())
+train_idx, val_idx = split_days(day_ids[rows], len(days), test_size=0.2, random_state=42)
+rows_train, rows_val = rows[train_idx], rows[val_idx]
+print(f"学習: {len(rows_train)} 枚 / 検証: {len(rows_val)} 枚（{len(days)} 日を日付単位で分割）")
+
+# === モデル定義 ===
+model = build_nowcast_model(SEQUENCE_LENGTH, parts[0][0].shape[1], HORIZONS)
+model.compile(
+    optimizer=Adam(1e-4),
+    loss={'class_output': 'binary_crossentropy', 'reg_output': 'mse'},
+    metrics={'class_output': 'accuracy', 'reg_output': 'mae'}
+)
+
+model.summary()
+
+# === 学習 ===
+callbacks = [EarlyStopping(patience=5, restore_best_weights=True)]
+
+history = model.fit(
+    NowcastBatches(rows_train, shuffle=True),
+    validation_data=NowcastBatches(rows_val),
+    epochs=50,
+    callbacks=callbacks
+)
+
+# === モデル保存 ===
+model.save(NOWCAST_MODEL_PATH)
+print(f"✅ モデルを保存しました → {NOWCAST_MODEL_PATH}")
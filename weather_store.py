@@ -0,0 +1,271 @@
+# weather_store.py
+#
+# 日ごとの cp932 CSV（weather_data/YYYYMMDD.csv）をまとめた、型付きの10分値ストア。
+#   weather_store/
+#     manifest.json   列名などの説明
+#     time.i8         観測時刻（datetime64[ns] の整数, 昇順）
+#     values.f32      (N, 列数) float32 の値
+#     flags.u8        (N, 列数) 品質フラグ（下の QUALITY_* の組み合わせ）
+# 3つとも memmap で開き、時刻範囲の検索は time.i8 の二分探索だけで済む。
+# 追記は values → flags → time の順に書き足すので、途中で止まっても time.i8 の行数までが有効。
+#
+# 気象庁の記号の扱い:
+#   "12.3 )"  準正常値       → 値は使い、QUALITY_QUASI
+#   "12.3 ]"  資料不足値     → 値は使い、QUALITY_INSUFFICIENT
+#   "12.3 #"  疑問値         → 値は使い、QUALITY_DOUBTFUL
+#   "×" "///" "" 欠測        → NaN、QUALITY_MISSING
+#   "--"      該当現象なし   → 降水量は 0、ほかは NaN。QUALITY_NO_PHENOMENON
+#   "静穏"    風向（静穏）   → NaN、QUALITY_NO_PHENOMENON
+#
+# 既存の CSV の取り込みと検索のベンチマーク:
+#   python weather_store.py import weather_data weather_store
+#   python weather_store.py bench weather_store
+
+import csv
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from feature_store import replace_dir
+
+WEATHER_STORE_DIR = "weather_store"
+MANIFEST = "manifest.json"
+TIME = "time.i8"
+VALUES = "values.f32"
+FLAGS = "flags.u8"
+
+# CSV の見出し → ストアの列名
+COLUMNS = {
+    "降水量 (mm)": "precipitation",
+    "気温 (℃)": "temperature",
+    "相対湿度 (%)": "humidity",
+    "平均風速 (m/s)": "wind_speed",
+    "平均風向": "wind_direction",
+}
+
+QUALITY_QUASI = 1
+QUALITY_INSUFFICIENT = 2
+QUALITY_DOUBTFUL = 4
+QUALITY_MISSING = 8
+QUALITY_NO_PHENOMENON = 16
+
+QUALITY_MARKS = {")": QUALITY_QUASI, "]": QUALITY_INSUFFICIENT, "#": QUALITY_DOUBTFUL}
+MISSING_MARKS = {"", "×", "///"}
+
+# 16方位 → 北を 0 とした時計回りの角度
+DIRECTIONS = {name: i * 22.5 for i, name in enumerate(
+    ["北", "北北東", "北東", "東北東", "東", "東南東", "南東", "南南東",
+     "南", "南南西", "南西", "西南西", "西", "西北西", "北西", "北北西"])}
+
+
+def parse_value(text, column):
+    """気象庁の表の文字列を (float 値, 品質フラグ) にする"""
+    text = text.strip()
+    if text in MISSING_MARKS:
+        return np.nan, QUALITY_MISSING
+    if text == "--":
+        return (0.0 if column == "precipitation" else np.nan), QUALITY_NO_PHENOMENON
+
+    flag = 0
+    if text[-1] in QUALITY_MARKS:
+        flag = QUALITY_MARKS[text[-1]]
+        text = text[:-1].strip()
+    if column == "wind_direction":
+        if text == "静穏":
+            return np.nan, flag | QUALITY_NO_PHENOMENON
+        angle = DIRECTIONS.get(text)
+        return (np.nan, QUALITY_MISSING) if angle is None else (angle, flag)
+    try:
+        return float(text), flag
+    except ValueError:
+        return np.nan, QUALITY_MISSING
+
+
+def parse_rows(date, header, rows):
+    """1日分の表（見出しと文字列の行）を (時刻, 値, フラグ) の配列にする"""
+    columns = list(COLUMNS.values())
+    positions = {COLUMNS[h]: i for i, h in enumerate(header) if h in COLUMNS}
+    day = np.datetime64(pd.Timestamp(date).normalize(), "ns")
+
+    times = np.empty(len(rows), dtype="datetime64[ns]")
+    values = np.full((len(rows), len(columns)), np.nan, dtype=np.float32)
+    flags = np.full((len(rows), len(columns)), QUALITY_MISSING, dtype=np.uint8)
+    for r, row in enumerate(rows):
+        # "24:00" は翌日の 0:00
+        hour, minute = row[0].split(":")
+        times[r] = day + np.timedelta64(int(hour) * 60 + int(minute), "m")
+        for c, column in enumerate(columns):
+            if column in positions and positions[column] < len(row):
+                values[r, c], flags[r, c] = parse_value(row[positions[column]], column)
+    return times, values, flags
+
+
+def read_csv_rows(csv_path):
+    with open(csv_path, "r", encoding="cp932", errors="replace", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        return header, [row for row in reader if row]
+
+
+class WeatherStore:
+    def __init__(self, path=WEATHER_STORE_DIR):
+        self.path = path
+        self.columns = list(COLUMNS.values())
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.columns = json.load(f)["columns"]
+        else:
+            self._write_manifest(path)
+        self._open()
+
+    def _write_manifest(self, path):
+        manifest = {"version": 1, "columns": self.columns, "time": TIME, "values": VALUES,
+                    "flags": FLAGS}
+        with open(os.path.join(path, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    def _open(self):
+        # time.i8 の行数が確定した行数（values / flags が途中まで書かれていても無視する）
+        width = len(self.columns)
+        rows = self._file_rows(TIME, 8)
+        rows = min(rows, self._file_rows(VALUES, 4 * width), self._file_rows(FLAGS, width))
+        self.rows = rows
+        self.times = self._memmap(TIME, "datetime64[ns]", (rows,))
+        self.values = self._memmap(VALUES, np.float32, (rows, width))
+        self.flags = self._memmap(FLAGS, np.uint8, (rows, width))
+
+    def _file_rows(self, name, row_bytes):
+        path = os.path.join(self.path, name)
+        return os.path.getsize(path) // row_bytes if os.path.exists(path) else 0
+
+    def _memmap(self, name, dtype, shape):
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode="r", shape=shape)
+
+    def __len__(self):
+        return self.rows
+
+    def _bounds(self, start=None, end=None):
+        lo = 0 if start is None else np.searchsorted(self.times, np.datetime64(pd.Timestamp(start), "ns"), "left")
+        hi = self.rows if end is None else np.searchsorted(self.times, np.datetime64(pd.Timestamp(end), "ns"), "left")
+        return int(lo), int(hi)
+
+    def slice(self, start=None, end=None):
+        """[start, end) の (時刻, 値, フラグ) を memmap のビューで返す"""
+        lo, hi = self._bounds(start, end)
+        return self.times[lo:hi], self.values[lo:hi], self.flags[lo:hi]
+
+    def query(self, start=None, end=None, flags=False):
+        """[start, end) を時刻を index にした DataFrame で返す（flags=True なら *_flag 列も付ける）"""
+        times, values, quality = self.slice(start, end)
+        df = pd.DataFrame(np.array(values), columns=self.columns,
+                          index=pd.DatetimeIndex(np.array(times), name="timestamp"))
+        if flags:
+            for c, column in enumerate(self.columns):
+                df[f"{column}_flag"] = np.array(quality[:, c])
+        return df
+
+    def has_day(self, date):
+        day = pd.Timestamp(date).normalize()
+        lo, hi = self._bounds(day, day + pd.Timedelta(days=1))
+        return hi > lo
+
+    def append(self, times, values, flags):
+        """行を足す。いちばん新しい時刻より後ならファイルの末尾に書き足し、
+        そうでなければ（過去の日の取り直しなど）全体を並べ直して書き直す"""
+        times = np.asarray(times, dtype="datetime64[ns]")
+        if len(times) == 0:
+            return
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        values = np.asarray(values, dtype=np.float32)[order]
+        flags = np.asarray(flags, dtype=np.uint8)[order]
+
+        with self.lock:
+            if self.rows == 0 or times[0] > self.times[-1]:
+                width = len(self.columns)
+                for name, data, row_bytes in ((VALUES, values, 4 * width), (FLAGS, flags, width),
+                                              (TIME, times, 8)):
+                    with open(os.path.join(self.path, name), "ab") as f:
+                        f.truncate(self.rows * row_bytes)  # 前回途中で止まった追記の残りを捨てる
+                        f.write(np.ascontiguousarray(data).tobytes())
+            else:
+                self._rewrite(times, values, flags)
+            self._open()
+
+    def _rewrite(self, times, values, flags):
+        # 同じ時刻の行は新しいほうで置き換える
+        keep = ~np.isin(self.times, times)
+        all_times = np.concatenate([self.times[keep], times])
+        order = np.argsort(all_times, kind="stable")
+        tmp_path = self.path.rstrip("/\\") + ".tmp"
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        for name, data in ((VALUES, np.concatenate([self.values[keep], values])[order]),
+                           (FLAGS, np.concatenate([self.flags[keep], flags])[order]),
+                           (TIME, all_times[order])):
+            with open(os.path.join(tmp_path, name), "wb") as f:
+                f.write(np.ascontiguousarray(data).tobytes())
+        self._write_manifest(tmp_path)
+        # 開いている memmap を閉じてから置き換える
+        self.times = self.values = self.flags = None
+        replace_dir(tmp_path, self.path)
+
+    def append_rows(self, date, header, rows):
+        self.append(*parse_rows(date, header, rows))
+
+    def import_csv_dir(self, weather_dir, skip_existing=True):
+        """weather_data/YYYYMMDD.csv をまとめて取り込む。取り込んだ日数を返す"""
+        parts = []
+        for name in sorted(os.listdir(weather_dir)):
+            stem, ext = os.path.splitext(name)
+            if ext != ".csv" or not (stem.isdigit() and len(stem) == 8):
+                continue
+            if skip_existing and self.has_day(stem):
+                continue
+            header, rows = read_csv_rows(os.path.join(weather_dir, name))
+            parts.append(parse_rows(stem, header, rows))
+        if parts:
+            self.append(*(np.concatenate(p) for p in zip(*parts)))
+        return len(parts)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ("import", "bench"):
+        print("使い方: python weather_store.py import <weather_data> <ストア> | bench <ストア>")
+        sys.exit(1)
+
+    if sys.argv[1] == "import":
+        store = WeatherStore(sys.argv[3] if len(sys.argv) > 3 else WEATHER_STORE_DIR)
+        days = store.import_csv_dir(sys.argv[2])
+        print(f"✅ {days}日分を取り込みました（全 {len(store)}行）→ {store.path}")
+        sys.exit(0)
+
+    # ベンチマーク: 1日分の検索を CSV の読み直しと比べる
+    store = WeatherStore(sys.argv[2])
+    if len(store) == 0:
+        # 空なら 5年分の10分値を作る
+        times = np.arange(np.datetime64("2020-01-01T00:00"), np.datetime64("2025-01-01T00:00"),
+                          np.timedelta64(10, "m")).astype("datetime64[ns]")
+        rng = np.random.default_rng(0)
+        store.append(times, rng.random((len(times), len(store.columns)), dtype=np.float32),
+                     np.zeros((len(times), len(store.columns)), dtype=np.uint8))
+    days = pd.to_datetime(store.times[np.random.default_rng(1).integers(0, len(store), 1000)]).normalize()
+
+    t0 = time.perf_counter()
+    for day in days:
+        store.query(day, day + pd.Timedelta(days=1))
+    elapsed = (time.perf_counter() - t0) / len(days)
+    print(f"行数: {len(store):,}  1日分の検索: {elapsed * 1e6:.0f} µs")